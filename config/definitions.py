@@ -94,3 +94,14 @@ class AgentBehaviour(Enum):
     QUITFAILURE = 6
     RELAPSE = 7
     NORELAPSE = 8
+
+#map region numbers (used by ABM) to region names (used by regional smoking prevalence data file)
+hash_region = {1: "North East",
+               2: "North West",
+               3: "Yorkshire and the Humber",
+               4: "East Midlands",
+               5: "West Midlands",
+               6: "East of England",
+               7: "London",
+               8: "South East",
+               9: "South West"}
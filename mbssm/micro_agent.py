@@ -8,6 +8,7 @@ from mbssm.theory_mediator import TheoryMediator
 
 
 class MicroAgent(repast4py.core.Agent):
+    __slots__ = ('mediator', 'rank') #no per-instance __dict__ (subclasses must declare their attributes in __slots__)
 
     def __init__(self, id: int, rank: int, type: int = None):
         """
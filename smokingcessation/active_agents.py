@@ -0,0 +1,112 @@
+'''
+definition of the ActiveAgents class which is the registry of the active agents of the context:
+the membership bitmap (the active column of the PopulationStore) and an ordered array of the slots of the active agents.
+The registry is updated when an agent is activated or deactivated, so the size of the population is known without a scan of the context
+and the loops over the active agents do not visit the inactive agents (the agents entering the population in later years and the dead agents).
+The deterministic order of the active agents is the order of insertion of the agents into the context i.e. the order of context.agents().
+The StateIndex groups the active agents by their current states.
+'''
+import numpy as np
+from repast4py import random as repast_random
+from smokingcessation.state_history import STATES
+
+class ActiveAgents:
+    def __init__(self, store):
+        '''
+        input: store, PopulationStore of the agents
+        '''
+        self.active = store.active #membership bitmap: active[slot] = True if the agent of the slot is active
+        self.agents = np.empty(store.size, dtype=object) #agents[slot] = agent of the slot in the context or None
+        self.ranks = np.full(store.size, -1, dtype=np.int64) #ranks[slot] = order of insertion of the agent of the slot into the context
+        self.next_rank = 0
+        self.count = 0 #number of active agents
+        self.slots = np.empty(0, dtype=np.int64) #slots of the active agents in the order of insertion into the context
+        self.activated = [] #slots of the agents activated since the ordered array was last updated
+        self.deactivated = False #True if some agents were deactivated since the ordered array was last updated
+
+    def register(self, agent):
+        '''add an agent to the registry when it is added to the context (the agent is inactive until activate is called)'''
+        self.agents[agent.slot] = agent
+        self.ranks[agent.slot] = self.next_rank
+        self.next_rank += 1
+
+    def unregister(self, agent):
+        '''remove an inactive agent from the registry when it is removed from the context'''
+        if self.active[agent.slot]:
+            raise ValueError(f'agent {agent.get_id()} is active and cannot be removed from the registry of the active agents')
+        self.agents[agent.slot] = None
+
+    def activate(self, agent):
+        if not self.active[agent.slot]:
+            self.active[agent.slot] = True
+            self.count += 1
+            self.activated.append(agent.slot)
+
+    def deactivate(self, agent):
+        if self.active[agent.slot]:
+            self.active[agent.slot] = False
+            self.count -= 1
+            self.deactivated = True
+
+    def __len__(self):
+        return self.count
+
+    def ordered_slots(self):
+        '''
+        output: array of the slots of the active agents in the order of insertion into the context.
+                The array is updated with the agents activated and deactivated since its last update.
+        '''
+        if self.deactivated:
+            self.slots = self.slots[self.active[self.slots]]
+            self.deactivated = False
+        if len(self.activated) > 0:
+            activated = np.array(self.activated, dtype=np.int64)
+            activated = activated[self.active[activated]] #an agent may be deactivated after its activation
+            slots = np.concatenate((self.slots, activated))
+            self.slots = slots[np.argsort(self.ranks[slots], kind='stable')]
+            self.activated = []
+        return self.slots
+
+    def agents_of_context(self, shuffle=False):
+        '''
+        output: list of the active agents in the order of insertion into the context (shuffle=False)
+                or in a random order drawn with the random number generator of repast4py as context.agents(shuffle=True) (shuffle=True)
+        '''
+        agents = list(self.agents[self.ordered_slots()])
+        if shuffle:
+            repast_random.default_rng.shuffle(agents)
+        return agents
+
+class StateIndex:
+    '''
+    index of the active agents grouped by their current states (AgentState): the slots of the active agents sorted by the codes of their states
+    (in the order of insertion into the context within a state) and the bounds of the bucket of each state.
+    The transitions of the agents are recorded as their states of the next time step in the StateHistory,
+    so the index is regrouped from the codes of the state history in one NumPy pass when the agents move to the next time step.
+    '''
+    def __init__(self, active_agents: ActiveAgents, state_history):
+        self.active_agents = active_agents
+        self.state_history = state_history
+        self.slots = np.empty(0, dtype=np.int64) #slots of the active agents sorted by the codes of their states
+        self.bounds = np.zeros(len(STATES) + 1, dtype=np.int64) #slots[bounds[code]:bounds[code+1]] = slots of the agents in the state of the code
+        self.time_step = -1 #time step of the current states of the index
+
+    def update(self, t: int):
+        '''group the active agents by their states at time step t (every active agent must have a state at time step t)'''
+        slots = self.active_agents.ordered_slots()
+        codes = self.state_history.codes_at(slots, t)
+        self.slots = slots[np.argsort(codes, kind='stable')]
+        self.bounds[1:] = np.cumsum(np.bincount(codes, minlength=len(STATES)))
+        self.time_step = t
+
+    def slots_of(self, state):
+        return self.slots[self.bounds[state.value]:self.bounds[state.value + 1]]
+
+    def agents_of(self, states):
+        '''output: list of the active agents in the states (an AgentState or a list of AgentState)'''
+        if not isinstance(states, (list, tuple)):
+            states = [states]
+        return [agent for state in states for agent in self.active_agents.agents[self.slots_of(state)]]
+
+    def count(self, state):
+        return int(self.bounds[state.value + 1] - self.bounds[state.value])
@@ -0,0 +1,54 @@
+'''
+definition of the AgentArchive class which stores the dead agents removed from the context (tombstones) in a compact form:
+the id, slot, final state and tick of death of each dead agent and the edges of the social network between a dead agent and the other agents.
+The other attributes of a dead agent remain in its slot of the PopulationStore and StateHistory.
+'''
+import pandas as pd
+from smokingcessation.state_history import STATES
+
+class AgentArchive:
+    def __init__(self):
+        self.ids = [] #ids of the dead agents
+        self.slots = [] #slots of the dead agents in the population store
+        self.final_states = [] #codes of the states of the dead agents at their ticks of death
+        self.death_ticks = [] #ticks of death
+        self.edges = [] #(ego id, alter id) of the edges of the social network between the dead agents and the other agents when the dead agents were archived
+        self.index = {} #key=id of a dead agent, value=index of the dead agent in the lists
+
+    def archive(self, agent, death_tick: int, graph=None):
+        '''
+        add a dead agent to the archive
+        input: agent, a dead Person
+               death_tick, tick of death
+               graph, graph of the social network or None
+        '''
+        agent_id = agent.get_id()
+        self.index[agent_id] = len(self.ids)
+        self.ids.append(agent_id)
+        self.slots.append(agent.slot)
+        self.final_states.append(agent.get_current_state().value)
+        self.death_ticks.append(death_tick)
+        if graph is not None and agent in graph:
+            self.edges.extend((agent_id, alter.get_id()) for alter in graph.successors(agent))
+            self.edges.extend((ego.get_id(), agent_id) for ego in graph.predecessors(agent))
+
+    def __contains__(self, agent_id):
+        return agent_id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_final_state(self, agent_id):
+        return STATES[self.final_states[self.index[agent_id]]]
+
+    def to_dataframe(self):
+        '''output: dataframe with columns id, slot, state (name of the final state) and death_tick of the dead agents'''
+        return pd.DataFrame({'id': self.ids,
+                             'slot': self.slots,
+                             'state': [STATES[code].name for code in self.final_states],
+                             'death_tick': self.death_ticks})
+
+    def write_csv(self, filename: str, edges_filename: str = None):
+        self.to_dataframe().to_csv(filename, index=False)
+        if edges_filename is not None:
+            pd.DataFrame(self.edges, columns=['ego.id', 'alter.id']).to_csv(edges_filename, index=False)
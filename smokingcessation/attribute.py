@@ -1,15 +1,23 @@
 '''
-definition of Level1Attribute, Level2Attribute, Level2AttributeInt, Level2AttributeFloat and PersonalAttribute classes
+definition of Level1Attribute, Level2Attribute, Level2AttributeInt, Level2AttributeFloat, PersonalAttribute, ColumnAttribute, Level2ColumnAttribute and Level2AttributeMap classes
 and testing the values of the Level2AttributeInt objects o, o2 and o3 associated with the PersonalAttribute object p.
+The classes use __slots__ (no per-instance __dict__) and intern their names (all the instances of an attribute share one name string)
+as they are instantiated for every agent.
 '''
 from abc import abstractmethod, ABC
 from typing import List
+import sys
+
+def intern_name(name: str):
+    '''intern the name of an attribute (None if no name)'''
+    return sys.intern(name) if name is not None else None
 
 class Level2Attribute(ABC):
+    __slots__ = ('ontology_id', 'name', 'value')
 
     def __init__(self, ontology_id: str = None, name: str = None):
-        self.ontology_id: str = ontology_id
-        self.name: str = name
+        self.ontology_id: str = intern_name(ontology_id)
+        self.name: str = intern_name(name)
         self.value = None
  
     @abstractmethod
@@ -21,6 +29,7 @@ class Level2Attribute(ABC):
         return self.value
 
 class Level2AttributeInt(Level2Attribute):
+    __slots__ = ('_value',)
 
     def __init__(self, ontology_id: str = None, name: str = None, value: int = None):
         super().__init__(ontology_id, name)
@@ -33,6 +42,7 @@ class Level2AttributeInt(Level2Attribute):
         return self._value
 
 class Level2AttributeFloat(Level2Attribute):
+    __slots__ = ('_value',)
 
     def __init__(self, ontology_id: str = None, name: str = None, value: float = None):
         super().__init__(ontology_id, name)
@@ -45,11 +55,12 @@ class Level2AttributeFloat(Level2Attribute):
         return self._value
 
 class Level1Attribute:
+    __slots__ = ('value', 'ontology_id', 'name', 'list')
 
     def __init__(self, ontology_id: str = None, name: str = None):
         self.value: float = None
-        self.ontology_id: str = ontology_id
-        self.name: str = name
+        self.ontology_id: str = intern_name(ontology_id)
+        self.name: str = intern_name(name)
         self.list: List[Level2Attribute] = []
         self.value = None
 
@@ -63,10 +74,11 @@ class Level1Attribute:
         return self.value
 
 class PersonalAttribute:
+    __slots__ = ('ontology_id', 'name', 'list', 'value')
 
     def __init__(self, ontology_id: str = None, name: str = None):
-        self.ontology_id: str = ontology_id
-        self.name: str = name
+        self.ontology_id: str = intern_name(ontology_id)
+        self.name: str = intern_name(name)
         self.list: List[Level2Attribute] = []  # list of the associated level 2 attributes
         self.value = None
     
@@ -82,6 +94,73 @@ class PersonalAttribute:
     def get_value(self):
         return self.value
 
+class ColumnAttribute(PersonalAttribute):
+    '''
+    a PersonalAttribute whose value is stored in a column of the PopulationStore (a NumPy array) at the slot of an agent
+    '''
+    __slots__ = ('column', 'slot')
+
+    def __init__(self, column, slot: int, ontology_id: str = None, name: str = None):
+        self.ontology_id: str = intern_name(ontology_id)
+        self.name: str = intern_name(name)
+        self.list: List[Level2Attribute] = []  # list of the associated level 2 attributes
+        self.column = column #column of the PopulationStore
+        self.slot: int = slot #slot of the agent
+
+    def bind_level2_attribute(self, level2_attributes, name: str):
+        '''
+        bind a level 2 attribute of a theory (e.g. oAge of the regular smoking theory) to the column of this attribute i.e.
+        replace the level 2 attribute in the hashmap of the level 2 attributes of the theory with a Level2ColumnAttribute of the column and slot of this attribute
+        so that the personal attribute and its level 2 attributes share one value (an update of the personal attribute is one write to the column)
+        input: level2_attributes, the hashmap of the level 2 attributes of a theory
+               name, name of the level 2 attribute
+        '''
+        level2_attributes[name] = Level2ColumnAttribute(self.column, self.slot, ontology_id=level2_attributes[name].ontology_id, name=name)
+
+    def set_value(self, value):
+        self.column[self.slot] = value
+        for attr in self.list:#level 2 attributes which are not bound to the column
+            attr.set_value(value)
+
+    def get_value(self):
+        return self.column[self.slot]
+
+class Level2ColumnAttribute(Level2Attribute):
+    '''
+    a level 2 attribute bound to the column of a ColumnAttribute (e.g. oAge bound to the age column of pAge) i.e. its value is the value of the personal attribute
+    '''
+    __slots__ = ('column', 'slot')
+
+    def __init__(self, column, slot: int, ontology_id: str = None, name: str = None):
+        super().__init__(ontology_id, name)
+        self.column = column #column of the PopulationStore
+        self.slot: int = slot #slot of the agent
+
+    def set_value(self, value):
+        self.column[self.slot] = value
+
+    def get_value(self):
+        return self.column[self.slot]
+
+class Level2AttributeMap(dict):
+    '''
+    hashmap of the level 2 attributes of a COM-B theory (key=level 2 attribute name, value=Level2Attribute object) which also keeps the level 2 attributes
+    of the formula of the theory in a list indexed by the attribute slots of the FormulaPlan of the formula (None if a level 2 attribute is not set yet).
+    The list is updated when a level 2 attribute of the formula is stored into the hashmap (e.g. a new Level2AttributeInt object replacing the old one).
+    '''
+    __slots__ = ('plan', 'slots')
+
+    def __init__(self, plan):
+        super().__init__()
+        self.plan = plan #FormulaPlan of the formula of the theory
+        self.slots = [None] * len(plan.names) #slots[i] = level 2 attribute of attribute slot i of the plan
+
+    def __setitem__(self, name: str, attribute: Level2Attribute):
+        super().__setitem__(name, attribute)
+        slot = self.plan.slot_of.get(name)
+        if slot is not None:
+            self.slots[slot] = attribute
+
 if __name__ == '__main__':
     '''
     the code below tests the values of the Level2AttributeInt objects o, o2 and o3 associated with the PersonalAttribute object p.
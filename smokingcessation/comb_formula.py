@@ -0,0 +1,65 @@
+'''
+definition of the COM-B formula compiler: the betas of the COM-B formula of a theory (regular smoking (uptake), quit attempt or quit maintenance) in model.yaml
+are validated against the level 2 attributes of the synthetic population once at the start of the simulation and compiled into an immutable FormulaPlan:
+the names of the level 2 attributes of the formula (attribute slot i = name i) and, for each component (C, O and M) of the formula,
+its beta, the attribute slots of its level 2 attributes and a contiguous vector of their betas.
+A COM-B theory keeps the level 2 attributes of its formula in a Level2AttributeMap indexed by the attribute slots of the plan,
+so the formula of an agent is evaluated without string-keyed lookups.
+'''
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+from types import MappingProxyType
+import numpy as np
+
+#level 2 attributes which are derived from the level 2 attributes of the synthetic population or set by the theories during the simulation,
+#so they may not be columns of the synthetic population
+RUNTIME_LEVEL2_ATTRIBUTES = ('mSmokerIdentity', 'mNonSmokerSelfIdentity', 'oPrevalenceOfSmokingInGeographicLocality', 'oNumberOfSmokersInSocialNetwork',
+                             'oReceiptOfGPAdvice', 'cUseOfBehaviourSupport', 'cCytisineUse')
+
+class ComponentPlan(NamedTuple):
+    component: str #'C', 'O' or 'M'
+    beta: float #beta of the component
+    slots: Tuple[int, ...] #attribute slots of the level 2 attributes of the component (in the order of model.yaml)
+    betas: np.ndarray #contiguous read-only vector of the betas of the level 2 attributes of the component
+    terms: Tuple[Tuple[int, float], ...] #(attribute slot, beta) of the level 2 attributes of the component
+
+class FormulaPlan(NamedTuple):
+    formula: str #'uptake', 'attempt' or 'maintenance'
+    names: Tuple[str, ...] #names of the level 2 attributes of the formula indexed by attribute slot
+    slot_of: Mapping[str, int] #read-only hashmap: key=name of a level 2 attribute of the formula, value=attribute slot
+    components: Mapping[str, ComponentPlan] #read-only hashmap: key='C', 'O' or 'M', value=ComponentPlan (a component without a beta in model.yaml is not in the formula)
+    bias: float
+
+def compile_comb_formula(formula: str, betas: Dict, level2_attributes_of_formula: Dict[str, List[str]], level2_attributes_names: List[str], data_file: str):
+    '''
+    validate the betas of a COM-B formula of model.yaml against the level 2 attributes of the synthetic population and compile the formula into a FormulaPlan
+    input: formula, 'uptake', 'attempt' or 'maintenance'
+           betas, hashmap of the betas of the formula (key=level 2 attribute name, C, O, M or bias, value=beta) e.g. uptake_betas of SmokingModel
+           level2_attributes_of_formula, hashmap with keys=C, O, M and values=lists of the level 2 attributes of the components e.g. level2_attributes_of_uptake_formula
+           level2_attributes_names, names of the level 2 attributes (columns) of the synthetic population
+           data_file, the synthetic population file
+    output: FormulaPlan
+    '''
+    available = set(level2_attributes_names) | set(RUNTIME_LEVEL2_ATTRIBUTES)
+    names = []
+    components = {}
+    for component in ('C', 'O', 'M'):
+        if betas.get(component) is None:#the component is not in the formula
+            continue
+        terms = []
+        for level2_attribute_name in level2_attributes_of_formula[component]:
+            if level2_attribute_name not in available:
+                raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {data_file}')
+            beta = betas[level2_attribute_name]
+            if not isinstance(beta, (int, float)):
+                raise ValueError(f'{formula}.{level2_attribute_name}.beta: {beta} of model.yaml is not a number')
+            terms.append((len(names), beta))
+            names.append(level2_attribute_name)
+        if not isinstance(betas[component], (int, float)):
+            raise ValueError(f'{formula}.{component}.beta: {betas[component]} of model.yaml is not a number')
+        component_betas = np.array([beta for _, beta in terms], dtype=np.float64)
+        component_betas.flags.writeable = False
+        components[component] = ComponentPlan(component, betas[component], tuple(slot for slot, _ in terms), component_betas, tuple(terms))
+    if betas.get('bias') is None:
+        raise ValueError(f'{formula}.bias of the COM-B formula is missing in model.yaml')
+    return FormulaPlan(formula, tuple(names), MappingProxyType({name: slot for slot, name in enumerate(names)}),
+                       MappingProxyType(components), betas['bias'])
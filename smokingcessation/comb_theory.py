@@ -1,88 +1,66 @@
 '''
 definition of the COMBTheory abstract class and its subclasses: RegSmokeTheory, QuitAttemptTheory, QuitMaintenanceTheory
 the COMBTheory represents the COM-B model of behaviour change. 
+the COMBEngine evaluates the COM-B formula of a theory for a group of agents in one NumPy pass.
 '''
 from typing import Dict
 from abc import abstractmethod
 import numpy as np
 import math
 import random
-import sys
-import pandas as pd
 
-from config.definitions import AgentState, AgentBehaviour, eCigDiffSubGroup
+from config.definitions import AgentState, AgentBehaviour, eCigDiffSubGroup, Theories
 from mbssm.theory import Theory
 from mbssm.micro_agent import MicroAgent
 from smokingcessation.smoking_model import SmokingModel
-from smokingcessation.attribute import Level2AttributeInt, Level2AttributeFloat, Level1Attribute
+from smokingcessation.attribute import Level2AttributeInt, Level2AttributeFloat, Level2AttributeMap
 
 class COMBTheory(Theory):
 
     def __init__(self, name, smoking_model: SmokingModel, indx_of_agent: int):
         super().__init__(name)
         self.smoking_model = smoking_model
-        self.comp_c: Level1Attribute
-        self.comp_o: Level1Attribute
-        self.comp_m: Level1Attribute
-        self.level2_attributes: Dict = {}  # a hashmap with keys=level 2 attribute names, values=Level2Attribute objects
+        self.plan = smoking_model.comb_formula_plans[name] #FormulaPlan of the COM-B formula of this theory
+        self.level2_attributes: Dict = Level2AttributeMap(self.plan)  # a hashmap with keys=level 2 attribute names, values=Level2Attribute objects
         self.power = 0  # power within logistic regression: 1/(1+e^power) where power=-(bias+beta1*x1+...,betak*xk)
         self.indx_of_agent = indx_of_agent
         self.store_level2_attributes_into_map(indx_of_agent)
 
     def store_level2_attributes_into_map(self, indx_of_agent: int):
-        """store the level 2 attributes of agent i from the 'data' dataframe of SmokingModel class into a map with key=level 2 attribute name, value= Level2Attribute object
+        """store the level 2 attributes of agent i from the row i of the Level2Table of SmokingModel class into a map with key=level 2 attribute name, value= Level2Attribute object
         """
-        for level2_attribute_name in self.smoking_model.level2_attributes_names:
-            if np.isnan(self.smoking_model.data.at[indx_of_agent, level2_attribute_name]):
-                # level 2 attribute has NaN (missing value)
-                # ignore this level 2 attribute by set it to 0 so that 0*beta=0 in the COMB formula.
-                at_obj = Level2AttributeInt(name=level2_attribute_name, value=0)
-                self.level2_attributes[level2_attribute_name] = at_obj
-            elif level2_attribute_name == 'mUseofNRT':
-                agent=self.smoking_model.context.agent((indx_of_agent, self.smoking_model.type, self.smoking_model.rank))
-                if agent.pOverCounterNRT.get_value()==1 or agent.pPrescriptionNRT.get_value()==1:
-                  val = 1
-                else:
-                  val = 0 
-                at_obj = Level2AttributeInt(name=level2_attribute_name, value=val)
-                self.level2_attributes[level2_attribute_name] = at_obj
-            elif type(self.smoking_model.data.at[indx_of_agent, level2_attribute_name]) is np.int64:
-                at_obj = Level2AttributeInt(name=level2_attribute_name,
-                                            value=self.smoking_model.data.at[indx_of_agent, level2_attribute_name])
-                self.level2_attributes[level2_attribute_name] = at_obj
-            elif type(self.smoking_model.data.at[indx_of_agent, level2_attribute_name]) is np.float64:
-                at_obj = Level2AttributeFloat(name=level2_attribute_name,
-                                              value=self.smoking_model.data.at[indx_of_agent, level2_attribute_name])
-                self.level2_attributes[level2_attribute_name] = at_obj
-            else:
-                sstr = ' is not int64 or float64 and not stored into the level2_attributes hashmap.'
-                sys.exit(str(self.smoking_model.data.at[indx_of_agent, level2_attribute_name]) + sstr)            
-        if self.level2_attributes.get('mSmokerIdentity')!=None: 
-            if self.level2_attributes['mSmokerIdentity'].get_value()==2: #mSmokerIdentity: '1=I think of myself as a non-smoker', '2=I still think of myself as a smoker', -1='don't know', 4='not stated'. 
-                at_obj = Level2AttributeInt(name='mNonSmokerSelfIdentity', value=0)
-                self.level2_attributes['mNonSmokerSelfIdentity']=at_obj
-            elif self.level2_attributes['mSmokerIdentity'].get_value()==1:
-                at_obj = Level2AttributeInt(name='mNonSmokerSelfIdentity', value=1)
-                self.level2_attributes['mNonSmokerSelfIdentity']=at_obj
-            else:
-                at_obj = Level2AttributeInt(name='mNonSmokerSelfIdentity', value=self.level2_attributes['mSmokerIdentity'].get_value()) #-1='don't know' or 4='not stated'.
-                self.level2_attributes['mNonSmokerSelfIdentity']=at_obj 
+        for at_obj in self.smoking_model.level2_table.level2_attributes_of_row(indx_of_agent):
+            self.level2_attributes[at_obj.name] = at_obj
 
     @abstractmethod
     def do_situation(self, agent: MicroAgent):  # run the situation mechanism of the agent of this theory
         pass
 
-    @abstractmethod
+    def make_comp(self, component: str):
+        '''
+        add the value of a component of the COM-B formula times the beta of the component to the power
+        input: component, 'C', 'O' or 'M'
+        '''
+        component_plan = self.plan.components.get(component)
+        if component_plan is not None:
+            level2_attributes = self.level2_attributes.slots
+            val = 0
+            for slot, beta in component_plan.terms:
+                level2_attribute = level2_attributes[slot]
+                if level2_attribute is None:#the level 2 attribute is not set
+                    raise ValueError(f'{self.plan.names[slot]} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
+                val += beta * level2_attribute.get_value()
+            self.power += val * component_plan.beta
+        return self.power
+
     def make_comp_c(self):
-        pass
+        return self.make_comp('C')
 
-    @abstractmethod
     def make_comp_o(self):
-        pass
+        return self.make_comp('O')
 
-    @abstractmethod
     def make_comp_m(self):
-        pass
+        return self.make_comp('M')
 
     @abstractmethod
     def do_behaviour(self, agent: MicroAgent):
@@ -142,73 +120,37 @@ class RegSmokeTheory(COMBTheory):
     def do_learning(self):
         pass
 
-    def make_comp_c(self):
-        if self.smoking_model.uptake_betas.get('C') is not None:
-            self.comp_c = Level1Attribute('C')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_uptake_formula['C']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_c.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:#level2_attribute_name is missing in level2_attributes hashmap
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
-                beta = self.smoking_model.uptake_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_c.set_value(val)
-            self.power += val * self.smoking_model.uptake_betas.get('C')
-        return self.power
-
-    def make_comp_o(self):
-        if self.smoking_model.uptake_betas.get('O') is not None:
-            self.comp_o = Level1Attribute('O')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_uptake_formula['O']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_o.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
-                beta = self.smoking_model.uptake_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_o.set_value(val)
-            self.power += val * self.smoking_model.uptake_betas.get('O')
-        return self.power
-
-    def make_comp_m(self):
-        if self.smoking_model.uptake_betas.get('M') is not None:
-            self.comp_m = Level1Attribute('M')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_uptake_formula['M']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_m.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
-                beta = self.smoking_model.uptake_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_m.set_value(val)
-            self.power += val * self.smoking_model.uptake_betas.get('M')
-        return self.power
-
     def do_behaviour(self, agent: MicroAgent):
         """
         calculate probability of regular smoking uptake using the COMB formula:
             prob=1/(1+e^power) where power = -1 * (C*beta1 + O*beta2 + M*beta3 + bias)
         """
-        self.power += self.smoking_model.uptake_betas['bias']
+        self.power += self.plan.bias
         self.power = -1 * self.power
         self.prob_behaviour = 1 / (1 + math.e ** self.power)
         # for a never smoker, run the regular smoking theory to calculate the probability of regular smoking;
         # if p >= threshold {A transitions to a smoker at t+1} else { A stays as never smoker or ex-smoker at t+1}
         self.threshold = random.uniform(0, 1)  # threshold
-        if self.prob_behaviour >= self.threshold:
-            # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
-            agent.delete_oldest_behaviour()
-            # append the agent's new behaviour to its behaviour buffer
-            agent.add_behaviour(AgentBehaviour.UPTAKE)
+        self.do_transition(agent, self.prob_behaviour >= self.threshold)
+
+    def do_transition(self, agent: MicroAgent, uptake: bool, update_behaviour_buffer=True):
+        '''
+        transition of a never smoker to a smoker (uptake=True) or a never smoker (uptake=False) at t+1
+        update_behaviour_buffer: False: the behaviour buffer is updated by COMBEngine.do_action_of_agents
+        '''
+        if uptake:
+            if update_behaviour_buffer:
+                # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
+                agent.delete_oldest_behaviour()
+                # append the agent's new behaviour to its behaviour buffer
+                agent.add_behaviour(AgentBehaviour.UPTAKE)
             agent.set_state_of_next_time_step(AgentState.SMOKER)
         else:
-            # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
-            agent.delete_oldest_behaviour()
-            # append the agent's new behaviour to its behaviour buffer
-            agent.add_behaviour(AgentBehaviour.NOUPTAKE)
+            if update_behaviour_buffer:
+                # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
+                agent.delete_oldest_behaviour()
+                # append the agent's new behaviour to its behaviour buffer
+                agent.add_behaviour(AgentBehaviour.NOUPTAKE)
             agent.set_state_of_next_time_step(AgentState.NEVERSMOKE)
         
 class QuitAttemptTheory(COMBTheory):
@@ -252,27 +194,24 @@ class QuitAttemptTheory(COMBTheory):
             # if self.smoking_model.running_mode == 'debug' and agent.get_id() in self.fixed_agent_ids:
             #    self.network.log_network_stats(agent)
             
+        if self.smoking_model.comb_engine is None:#otherwise the treatments of all the smokers are sampled by COMBEngine.do_treatment_uptake after the situation mechanisms
+            self.do_treatment_uptake(agent)
+
+    def do_treatment_uptake(self, agent: MicroAgent):
+        """sample the receipt of GP advice (oReceiptOfGPAdvice) and the use of prescription NRT (pPrescriptionNRT) of a smoker and update mUseOfNRT"""
         #update oReceiptOfGPAdvice        
-        matched_row = self.smoking_model.attempt_exogenous_dynamics_data[
-                                (self.smoking_model.attempt_exogenous_dynamics_data["year"] == self.smoking_model.year_of_current_time_step) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["social grade"] == agent.p_sep.get_value())
-                                ]
-        matched_row = pd.DataFrame(matched_row)
-        #ipdb.set_trace()#debug break point
-        if len(matched_row) > 0:
-             col_index = matched_row.columns.get_loc("oReceiptGPAdviceLodOdds")
-             logodds = float(matched_row.iat[0, col_index])
-             col_index2 = matched_row.columns.get_loc("pNRTLogOdds")
-             logodds2 = float(matched_row.iat[0, col_index2])
+        logodds_row = self.smoking_model.attempt_exogenous_dynamics_cache.get(self.smoking_model.year_of_current_time_step,
+                                                                              agent.p_age.get_value(),
+                                                                              agent.p_gender.get_value(),
+                                                                              agent.p_sep.get_value())
+        if logodds_row is not None:
+             logodds, logodds2 = logodds_row #oReceiptGPAdviceLodOdds, pNRTLogOdds
         else: 
              logodds = 0
              logodds2 = 0
-             print(f'Logodds in QuitAttemptTheory are set to 0, as there is no matching logodds for year={self.smoking_model.attempt_exogenous_dynamics_data["year"]},\
-                   age={self.smoking_model.attempt_exogenous_dynamics_data["age"]},\
-                   sex={self.smoking_model.attempt_exogenous_dynamics_data["sex"]},\
-                  social grade={self.smoking_model.attempt_exogenous_dynamics_data["social grade"]}')   
+             #record the miss (summarised in lookup_misses.csv at the end of the simulation)
+             self.smoking_model.lookup_misses.record(self.smoking_model.year_of_current_time_step, 'attempt_exogenous_dynamics',
+                                                     (agent.p_age.get_value(), agent.p_gender.get_value(), agent.p_sep.get_value()))
         logodds += agent.propensity_receive_GP_advice_attempt
         prob = math.e ** logodds / (1 + math.e ** logodds)
         threshold = random.uniform(0, 1)
@@ -300,70 +239,34 @@ class QuitAttemptTheory(COMBTheory):
     def do_learning(self):
         pass
 
-    def make_comp_c(self):
-        if self.smoking_model.attempt_betas.get('C') is not None:
-            self.comp_c = Level1Attribute('C')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_attempt_formula['C']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_c.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
-                beta = self.smoking_model.attempt_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_c.set_value(val)
-            self.power += val * self.smoking_model.attempt_betas.get('C')
-        return self.power
-
-    def make_comp_o(self):
-        if self.smoking_model.attempt_betas.get('O') is not None:
-            self.comp_o = Level1Attribute('O')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_attempt_formula['O']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_o.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')               
-                beta = self.smoking_model.attempt_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_o.set_value(val)
-            self.power += val * self.smoking_model.attempt_betas.get('O')
-        return self.power
-
-    def make_comp_m(self):
-        if self.smoking_model.attempt_betas.get('M') is not None:
-            self.comp_m = Level1Attribute('M')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_attempt_formula['M']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_m.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')                 
-                beta = self.smoking_model.attempt_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_m.set_value(val)
-            self.power += val * self.smoking_model.attempt_betas.get('M')
-        return self.power
-
     def do_behaviour(self, agent: MicroAgent):
         """calculate probability of making a quit attempt by using the COMB formula:
         prob=1/(1+e^power) where power = -1 * (C*beta1 + O*beta2 + M*beta3 + bias)
         """
-        self.power += self.smoking_model.attempt_betas['bias']
+        self.power += self.plan.bias
         self.power = -1 * self.power
         self.prob_behaviour = 1 / (1 + math.e ** self.power)
         # for a smoker A, run the quit attempt theory to calculate the probability of making a quit attempt.
         # If p >= threshold, { A transitions to a quitter at t+1} else {A stays as a smoker at t+1}
         self.threshold = random.uniform(0, 1)
-        if self.prob_behaviour >= self.threshold:
-            agent.delete_oldest_behaviour()
-            agent.add_behaviour(AgentBehaviour.QUITATTEMPT)
+        self.do_transition(agent, self.prob_behaviour >= self.threshold)
+
+    def do_transition(self, agent: MicroAgent, quit_attempt: bool, update_behaviour_buffer=True):
+        '''
+        transition of a smoker to a new quitter (quit_attempt=True) or a smoker (quit_attempt=False) at t+1
+        update_behaviour_buffer: False: the behaviour buffer is updated by COMBEngine.do_action_of_agents
+        '''
+        if quit_attempt:
+            if update_behaviour_buffer:
+                agent.delete_oldest_behaviour()
+                agent.add_behaviour(AgentBehaviour.QUITATTEMPT)
             agent.set_state_of_next_time_step(state=AgentState.NEWQUITTER)
         else:
-            # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
-            agent.delete_oldest_behaviour()
-            # append the agent's new behaviour to its behaviour buffer
-            agent.add_behaviour(AgentBehaviour.NOQUITEATTEMPT)
+            if update_behaviour_buffer:
+                # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
+                agent.delete_oldest_behaviour()
+                # append the agent's new behaviour to its behaviour buffer
+                agent.add_behaviour(AgentBehaviour.NOQUITEATTEMPT)
             agent.set_state_of_next_time_step(state=AgentState.SMOKER)
         agent.b_number_of_recent_quit_attempts=agent.count_quit_attempt_behaviour()
 
@@ -402,124 +305,71 @@ class QuitMaintenanceTheory(COMBTheory):
             # if self.smoking_model.running_mode == 'debug' and agent.get_id() in self.fixed_agent_ids:
             #    self.network.log_network_stats(agent)
             
-        if agent.get_current_state()==AgentState.NEWQUITTER:
-            matched_row = self.smoking_model.maintenance_exogenous_dynamics_data[
-                                (self.smoking_model.maintenance_exogenous_dynamics_data["year"] == self.smoking_model.year_of_current_time_step) &
-                                (self.smoking_model.maintenance_exogenous_dynamics_data["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.maintenance_exogenous_dynamics_data["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.maintenance_exogenous_dynamics_data["social grade"] == agent.p_sep.get_value())
-                                ]
-            matched_row = pd.DataFrame(matched_row)
-            #ipdb.set_trace()#debug break point
-            if len(matched_row) > 0:
-                col_index = matched_row.columns.get_loc("pPrescriptionNRTLogOdds")
-                logodds_nrt = float(matched_row.iat[0, col_index])
-                col_index2 = matched_row.columns.get_loc("cUseOfBehaviourSupportLogOdds")
-                logodds_behaviour_support = float(matched_row.iat[0, col_index2])
-                col_index3 = matched_row.columns.get_loc("pVareniclineUseLogOdds")
-                logodds_varenicline = float(matched_row.iat[0, col_index3])
-                col_index4 = matched_row.columns.get_loc("pCytisineUseLogOdds")
-                logodds_cytisine = float(matched_row.iat[0, col_index4])         
-            else:#no matched row, 0 logodds 
-                logodds_nrt = 0
-                logodds_behaviour_support = 0
-                logodds_varenicline = 0
-                logodds_cytisine = 0
-                print(f'Logodds in QuitMaintenanceTheory are set to 0, as there is no matching logodds for year={self.smoking_model.attempt_exogenous_dynamics_data["year"]},\
-                    age={self.smoking_model.attempt_exogenous_dynamics_data["age"]},\
-                    sex={self.smoking_model.attempt_exogenous_dynamics_data["sex"]},\
-                    social grade={self.smoking_model.attempt_exogenous_dynamics_data["social grade"]}')   
-            #update p_prescription_nrt
-            logodds_nrt += agent.propensity_NRT_maintenance   
-            prob = math.e ** logodds_nrt / (1 + math.e ** logodds_nrt)
-            threshold = random.uniform(0, 1)
-            if prob >= threshold:
-                agent.p_prescription_nrt.set_value(1)
-            else:
-                agent.p_prescription_nrt.set_value(0)
-            #update cUseOfBehaviourSupport
-            logodds_behaviour_support += agent.propensity_behaviour_support_maintenance
-            prob = math.e ** logodds_behaviour_support / (1 + math.e ** logodds_behaviour_support)
-            threshold = random.uniform(0, 1)     
-            if prob >= threshold:
-                at_obj = Level2AttributeInt(name='cUseOfBehaviourSupport', value=1)
-                self.level2_attributes['cUseOfBehaviourSupport'] = at_obj 
-            else:
-                at_obj = Level2AttributeInt(name='cUseOfBehaviourSupport', value=0)
-                self.level2_attributes['cUseOfBehaviourSupport'] = at_obj  
-            #update p_varenicline_use
-            logodds_varenicline += agent.propensity_varenicline_maintenance
-            prob = math.e ** logodds_varenicline / (1 + math.e ** logodds_varenicline)
-            threshold = random.uniform(0, 1)
-            if prob >= threshold:
-                agent.p_varenicline_use.set_value(1)
-            else:
-                agent.p_varenicline_use.set_value(0)
-            #update cCytisineUse
-            logodds_cytisine += agent.propensity_cytisine_maintenance
-            prob = math.e ** logodds_cytisine / (1 + math.e ** logodds_cytisine)
-            threshold = random.uniform(0, 1)
-            if prob >= threshold:
-                at_obj = Level2AttributeInt(name='cCytisineUse', value=1)
-                self.level2_attributes['cCytisineUse'] = at_obj 
-            else:
-                at_obj = Level2AttributeInt(name='cCytisineUse', value=0)
-                self.level2_attributes['cCytisineUse'] = at_obj  
+        if agent.get_current_state()==AgentState.NEWQUITTER and self.smoking_model.comb_engine is None:#otherwise the treatments of all the new quitters are sampled by COMBEngine.do_treatment_uptake
+            self.do_treatment_uptake(agent)
         if self.smoking_model.months_counter == 1:
                self.level2_attributes['cCigConsumptionPrequit'].set_value(agent.b_cig_consumption)
         
+    def do_treatment_uptake(self, agent: MicroAgent):
+        """sample the use of prescription NRT (pPrescriptionNRT), behaviour support (cUseOfBehaviourSupport), varenicline (pVareniclineUse) and cytisine (cCytisineUse) of a new quitter"""
+        logodds_row = self.smoking_model.maintenance_exogenous_dynamics_cache.get(self.smoking_model.year_of_current_time_step,
+                                                                                  agent.p_age.get_value(),
+                                                                                  agent.p_gender.get_value(),
+                                                                                  agent.p_sep.get_value())
+        if logodds_row is not None:
+            logodds_nrt, logodds_behaviour_support, logodds_varenicline, logodds_cytisine = logodds_row
+        else:#no matched row, 0 logodds 
+            logodds_nrt = 0
+            logodds_behaviour_support = 0
+            logodds_varenicline = 0
+            logodds_cytisine = 0
+            #record the miss (summarised in lookup_misses.csv at the end of the simulation)
+            self.smoking_model.lookup_misses.record(self.smoking_model.year_of_current_time_step, 'maintenance_exogenous_dynamics',
+                                                    (agent.p_age.get_value(), agent.p_gender.get_value(), agent.p_sep.get_value()))
+        #update p_prescription_nrt
+        logodds_nrt += agent.propensity_NRT_maintenance   
+        prob = math.e ** logodds_nrt / (1 + math.e ** logodds_nrt)
+        threshold = random.uniform(0, 1)
+        if prob >= threshold:
+            agent.p_prescription_nrt.set_value(1)
+        else:
+            agent.p_prescription_nrt.set_value(0)
+        #update cUseOfBehaviourSupport
+        logodds_behaviour_support += agent.propensity_behaviour_support_maintenance
+        prob = math.e ** logodds_behaviour_support / (1 + math.e ** logodds_behaviour_support)
+        threshold = random.uniform(0, 1)     
+        if prob >= threshold:
+            at_obj = Level2AttributeInt(name='cUseOfBehaviourSupport', value=1)
+            self.level2_attributes['cUseOfBehaviourSupport'] = at_obj 
+        else:
+            at_obj = Level2AttributeInt(name='cUseOfBehaviourSupport', value=0)
+            self.level2_attributes['cUseOfBehaviourSupport'] = at_obj  
+        #update p_varenicline_use
+        logodds_varenicline += agent.propensity_varenicline_maintenance
+        prob = math.e ** logodds_varenicline / (1 + math.e ** logodds_varenicline)
+        threshold = random.uniform(0, 1)
+        if prob >= threshold:
+            agent.p_varenicline_use.set_value(1)
+        else:
+            agent.p_varenicline_use.set_value(0)
+        #update cCytisineUse
+        logodds_cytisine += agent.propensity_cytisine_maintenance
+        prob = math.e ** logodds_cytisine / (1 + math.e ** logodds_cytisine)
+        threshold = random.uniform(0, 1)
+        if prob >= threshold:
+            at_obj = Level2AttributeInt(name='cCytisineUse', value=1)
+            self.level2_attributes['cCytisineUse'] = at_obj 
+        else:
+            at_obj = Level2AttributeInt(name='cCytisineUse', value=0)
+            self.level2_attributes['cCytisineUse'] = at_obj  
+
     def do_learning(self):
         pass
 
-    def make_comp_c(self):
-        if self.smoking_model.maintenance_betas.get('C') is not None:
-            self.comp_c = Level1Attribute('C')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_maintenance_formula['C']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_c.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')                 
-                beta = self.smoking_model.maintenance_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_c.set_value(val)
-            self.power += val * self.smoking_model.maintenance_betas.get('C')
-        return self.power
-
-    def make_comp_o(self):
-        if self.smoking_model.maintenance_betas.get('O') is not None:
-            self.comp_o = Level1Attribute('O')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_maintenance_formula['O']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_o.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')                 
-                beta = self.smoking_model.maintenance_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_o.set_value(val)
-            self.power += val * self.smoking_model.maintenance_betas.get('O')
-        return self.power
-
-    def make_comp_m(self):
-        if self.smoking_model.maintenance_betas.get('M') is not None:
-            self.comp_m = Level1Attribute('M')
-            val = 0
-            for level2_attribute_name in self.smoking_model.level2_attributes_of_maintenance_formula['M']:
-                if self.level2_attributes.get(level2_attribute_name)!=None:
-                    self.comp_m.add_level2_attribute(self.level2_attributes[level2_attribute_name])
-                else:
-                    raise ValueError(f'{level2_attribute_name} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')                    
-                beta = self.smoking_model.maintenance_betas[level2_attribute_name]
-                val += beta * self.level2_attributes[level2_attribute_name].get_value()
-            self.comp_m.set_value(val)
-            self.power += val * self.smoking_model.maintenance_betas.get('M')
-        return self.power
-
     def do_behaviour(self, agent: MicroAgent):
         """calculate probability of quit maintenance by using the COMB formula:
         prob=1/(1+e^power) where power = -1 * (C*beta1 + O*beta2 + M*beta3 + bias)"""
-        self.power += self.smoking_model.maintenance_betas['bias']
+        self.power += self.plan.bias
         self.power = -1 * self.power
         self.prob_behaviour = 1 / (1 + math.e ** self.power)
         # for a quitter Q,
@@ -537,13 +387,22 @@ class QuitMaintenanceTheory(COMBTheory):
         #        k=0;
         #  }
         self.threshold = random.uniform(0, 1)
-        if self.prob_behaviour >= self.threshold:            
-            agent.delete_oldest_behaviour()#delete the agent's oldest behaviour (at 0th index) from the behaviour buffer            
-            agent.add_behaviour(AgentBehaviour.QUITMAINTENANCE)
+        self.do_transition(agent, self.prob_behaviour >= self.threshold)
+
+    def do_transition(self, agent: MicroAgent, quit_maintenance: bool, update_behaviour_buffer=True):
+        '''
+        transition of a new quitter or an ongoing quitter to the next ongoing quitter state or an ex-smoker (quit_maintenance=True)
+        or a smoker (quit_maintenance=False) at t+1
+        update_behaviour_buffer: False: the behaviour buffer is updated by COMBEngine.do_action_of_agents
+        '''
+        if quit_maintenance:            
+            if update_behaviour_buffer:
+                agent.delete_oldest_behaviour()#delete the agent's oldest behaviour (at 0th index) from the behaviour buffer            
+                agent.add_behaviour(AgentBehaviour.QUITMAINTENANCE)
             agent.b_months_since_quit += 1
             self.level2_attributes['cCigAddictStrength'].set_value(np.round(self.level2_attributes['cCigAddictStrength'].get_value() * np.exp(self.smoking_model.lbda*self.smoking_model.tickInterval)))#cCigAddictStrength[t+1] = round(cCigAddictStrength[t] * exp(lambda*tick_interval)), where t = a tick, lambda = 0.0368 and tick_interval = 52/12 (weeks)            
             threshold=random.uniform(0,1)#sample from probability of smoker self identity = 1/(1+alpha*(k*tick_interval)^beta) where alpha = 1.1312, beta = 0.500, k = number of quit maintenances and tick_interval = 52/12 (weeks)
-            quit_maintenance_count=agent.behaviour_buffer.count(AgentBehaviour.QUITMAINTENANCE)
+            quit_maintenance_count=0 #the behaviour buffer stores quit attempt (1) and not quit attempt (0) behaviours only, so it has no quit maintenance behaviours to count
             probOfSmokerSelfIdentity=1/(1+self.smoking_model.alpha*(quit_maintenance_count*self.smoking_model.tickInterval)**self.smoking_model.beta)
             if probOfSmokerSelfIdentity >= threshold:
                 self.level2_attributes['mSmokerIdentity']=Level2AttributeInt(name='mSmokerIdentity', value=2)#mSmokerIdentity: '1=I think of myself as a non-smoker', '2=I still think of myself as a smoker', -1='don't know', 4='not stated'.
@@ -578,10 +437,135 @@ class QuitMaintenanceTheory(COMBTheory):
                 agent.set_state_of_next_time_step(AgentState.EXSMOKER)
                 agent.b_months_since_quit=0
         else:
-            agent.delete_oldest_behaviour()
-            agent.add_behaviour(AgentBehaviour.QUITFAILURE)
+            if update_behaviour_buffer:
+                agent.delete_oldest_behaviour()
+                agent.add_behaviour(AgentBehaviour.QUITFAILURE)
             agent.set_state_of_next_time_step(AgentState.SMOKER)
             agent.b_months_since_quit = 0
             self.level2_attributes['cCigAddictStrength'].set_value(agent.prequit_addiction_strength)
         agent.b_number_of_recent_quit_attempts=agent.count_quit_attempt_behaviour()
 
+
+class COMBEngine:
+    '''
+    vectorised COM-B formulae of the regular smoking (uptake), quit attempt and quit maintenance theories.
+    For the agents running a theory, the level 2 attributes of the formula of the theory are gathered into a design matrix X (agents x level 2 attributes)
+    and the probabilities of the behaviour are computed with one matrix product: prob = 1/(1+e^power) where power = -(power at the previous run + C*beta_C + O*beta_O + M*beta_M + bias)
+    and C, O, M = X * (betas of the level 2 attributes grouped by C, O and M). As in make_comp_c, make_comp_o, make_comp_m and do_behaviour,
+    the power of a theory is accumulated over its runs. The thresholds are drawn as one vector from the random number generator of the model.
+    '''
+    def __init__(self, smoking_model: SmokingModel):
+        self.smoking_model = smoking_model
+        #key=name of a COM-B theory of the agents, value=(FormulaPlan of the formula, matrix of the betas of the level 2 attributes (attribute slots x C, O, M),
+        #                                                  vector of the betas of C, O and M (0 if a component is not in the formula))
+        self.formulae = {}
+        for theory_name, plan in smoking_model.comb_formula_plans.items():
+            level2_betas = np.zeros((len(plan.names), 3))
+            level1_betas = np.zeros(3)
+            for j, component in enumerate(('C', 'O', 'M')):
+                component_plan = plan.components.get(component)
+                if component_plan is None:#the component is not in the formula
+                    continue
+                level1_betas[j] = component_plan.beta
+                level2_betas[list(component_plan.slots), j] = component_plan.betas
+            self.formulae[theory_name] = (plan, level2_betas, level1_betas)
+
+    def sample(self, logodds: np.ndarray):
+        '''
+        draw the treatments of the agents with probabilities e^logodds/(1+e^logodds) and thresholds drawn as one vector from the random number generator of the model
+        output: boolean array, True if an agent takes up the treatment (probability >= threshold)
+        '''
+        with np.errstate(over='ignore'):
+            probs = 1 / (1 + np.exp(-logodds))
+        return probs >= self.smoking_model.rng.uniform(0, 1, len(logodds))
+
+    def do_treatment_uptake(self):
+        '''
+        vectorised do_treatment_uptake of QuitAttemptTheory and QuitMaintenanceTheory: sample the treatments of all the smokers and new quitters
+        of the current time step in one pass. The log odds of the agents are the exogenous log odds of their (year, age, sex, social grade)
+        (0 if there is no matching row) plus their propensities. The treatments are written into the columns of the personal attributes
+        (pPrescriptionNRT and pVareniclineUse) and the level 2 attributes of the quit attempt and quit maintenance theories of the agents.
+        '''
+        if Theories.QUITATTEMPT not in self.formulae:#quitting behaviour is STPM
+            return
+        smoking_model = self.smoking_model
+        store = smoking_model.population_store
+        year = smoking_model.year_of_current_time_step
+        #smokers: receipt of GP advice (oReceiptOfGPAdvice) and use of prescription NRT (pPrescriptionNRT and mUseOfNRT)
+        slots = smoking_model.state_index.slots_of(AgentState.SMOKER)
+        if len(slots) > 0:
+            logodds = self.logodds_of_agents(smoking_model.attempt_exogenous_dynamics_cache, 'attempt_exogenous_dynamics', year, slots)
+            gp_advice = self.sample(logodds[:, 0] + store.propensity_receive_GP_advice_attempt[slots])
+            store.prescription_nrt[slots] = self.sample(logodds[:, 1] + store.propensity_NRT_attempt[slots])
+            use_of_nrt = (store.prescription_nrt[slots] == 1) | (store.over_counter_nrt[slots] == 1)
+            for agent, receipt, use in zip(smoking_model.active_agents.agents[slots], gp_advice.tolist(), use_of_nrt.tolist()):
+                theory = agent.mediator.theory_map[Theories.QUITATTEMPT]
+                theory.level2_attributes['oReceiptOfGPAdvice'] = Level2AttributeInt(name='oReceiptOfGPAdvice', value=int(receipt))
+                theory.level2_attributes['mUseOfNRT'].set_value(int(use))
+        #new quitters: use of prescription NRT (pPrescriptionNRT), behaviour support (cUseOfBehaviourSupport), varenicline (pVareniclineUse) and cytisine (cCytisineUse)
+        slots = smoking_model.state_index.slots_of(AgentState.NEWQUITTER)
+        if len(slots) > 0:
+            logodds = self.logodds_of_agents(smoking_model.maintenance_exogenous_dynamics_cache, 'maintenance_exogenous_dynamics', year, slots)
+            store.prescription_nrt[slots] = self.sample(logodds[:, 0] + store.propensity_NRT_maintenance[slots])
+            behaviour_support = self.sample(logodds[:, 1] + store.propensity_behaviour_support_maintenance[slots])
+            store.varenicline_use[slots] = self.sample(logodds[:, 2] + store.propensity_varenicline_maintenance[slots])
+            cytisine = self.sample(logodds[:, 3] + store.propensity_cytisine_maintenance[slots])
+            for agent, support, use in zip(smoking_model.active_agents.agents[slots], behaviour_support.tolist(), cytisine.tolist()):
+                theory = agent.mediator.theory_map[Theories.QUITMAINTENANCE]
+                theory.level2_attributes['cUseOfBehaviourSupport'] = Level2AttributeInt(name='cUseOfBehaviourSupport', value=int(support))
+                theory.level2_attributes['cCytisineUse'] = Level2AttributeInt(name='cCytisineUse', value=int(use))
+
+    def logodds_of_agents(self, cache, table: str, year: int, slots: np.ndarray):
+        '''
+        output: matrix of the exogenous log odds of the agents (rows=agents, columns=log odds columns of the table) with 0 log odds for the agents with no matching row
+                (the misses are recorded as in the scalar lookups)
+        '''
+        store = self.smoking_model.population_store
+        ages, sexes, social_grades = store.age[slots], store.gender[slots], store.sep[slots]
+        logodds, found = cache.get_many(year, ages, sexes, social_grades)
+        if not found.all():
+            for key in zip(ages[~found], sexes[~found], social_grades[~found]):
+                self.smoking_model.lookup_misses.record(year, table, key)
+        return logodds
+
+    def design_matrix(self, theories, plan):
+        '''
+        output: matrix of the values of the level 2 attributes (columns indexed by the attribute slots of the plan) of the theories (rows)
+        '''
+        try:
+            values = [level2_attribute.get_value() for theory in theories for level2_attribute in theory.level2_attributes.slots]
+        except AttributeError:#a level 2 attribute is not set (None)
+            missing = next(slot for theory in theories for slot, level2_attribute in enumerate(theory.level2_attributes.slots) if level2_attribute is None)
+            raise ValueError(f'{plan.names[missing]} of model.yaml is missing in the baseline synthetic population: {self.smoking_model.data_file}')
+        return np.array(values, dtype=np.float64).reshape(len(theories), len(plan.names))
+
+    def do_action_of_agents(self, theory_name: Theories, agents):
+        '''
+        vectorised do_action of a COM-B theory: compute the probabilities of the behaviour of all the given agents with one matrix product,
+        draw their thresholds, shift their new behaviours into their behaviour buffers at once and run the transitions of the agents.
+        input: theory_name, Theories.REGSMOKE, Theories.QUITATTEMPT or Theories.QUITMAINTENANCE
+               agents, the agents running the theory (never smokers, smokers or new quitters and ongoing quitters)
+        '''
+        n = len(agents)
+        if n == 0:
+            return
+        plan, level2_betas, level1_betas = self.formulae[theory_name]
+        theories = [agent.mediator.theory_map[theory_name] for agent in agents]
+        X = self.design_matrix(theories, plan)
+        powers = np.fromiter((theory.power for theory in theories), dtype=np.float64, count=n)
+        powers = -1 * (powers + (X @ level2_betas) @ level1_betas + plan.bias)
+        with np.errstate(over='ignore'):
+            probs = 1 / (1 + np.exp(powers))
+        thresholds = self.smoking_model.rng.uniform(0, 1, n)
+        behaviours = probs >= thresholds
+        #a quit attempt is the only behaviour counted by the behaviour buffer: shift the new behaviours into the behaviour buffers of all the agents at once
+        slots = np.fromiter((agent.slot for agent in agents), dtype=np.int64, count=n)
+        if theory_name == Theories.QUITATTEMPT:
+            self.smoking_model.population_store.add_behaviours(slots, behaviours)
+        else:
+            self.smoking_model.population_store.add_behaviours(slots, np.zeros(n, dtype=bool))
+        for theory, agent, power, prob, threshold, behaviour in zip(theories, agents, powers.tolist(), probs.tolist(), thresholds.tolist(), behaviours.tolist()):
+            theory.power = power
+            theory.prob_behaviour = prob
+            theory.threshold = threshold
+            theory.do_transition(agent, behaviour, update_behaviour_buffer=False)
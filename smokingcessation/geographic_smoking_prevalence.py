@@ -3,21 +3,24 @@ definition of GeographicSmokingPrevalence class which is a subclass the MacroEnt
 '''
 from mbssm.macro_entity import MacroEntity
 from smokingcessation.smoking_model import SmokingModel
-import pandas as pd
+from config.definitions import hash_region
+import math
 import sys
 #import ipdb #python debugger
 
 class GeographicSmokingPrevalence(MacroEntity):
     def __init__(self, smoking_model : SmokingModel):
         super().__init__()
-        self.regionalSmokingPrevalence=None #dataframe that contains the regional smoking prevalence of a specific month
+        self.regionalSmokingPrevalence=None #vector of the regional smoking prevalences of a specific month: regionalSmokingPrevalence[region-1] = smoking prevalence of the region
+        self.month=None #the month of regionalSmokingPrevalence
         self.smoking_model = smoking_model
 
-    def readInAllPrevalenceOfMonth(self,month):#read all the regional prevalences of this month into regionalSmokingPrevalence dataframe
+    def readInAllPrevalenceOfMonth(self,month):#read all the regional prevalences of this month into regionalSmokingPrevalence vector
         #format of month: Nov-06, Dec-10 etc.
-        allprev=self.smoking_model.regionalSmokingPrevalence[self.smoking_model.regionalSmokingPrevalence['month']==month]
-        if len(allprev) > 0:
-            self.regionalSmokingPrevalence=allprev[['month','region','prevalence']]
+        i=self.smoking_model.regionalSmokingPrevalenceMonths.get(month)
+        if i is not None:
+            self.regionalSmokingPrevalence=self.smoking_model.regionalSmokingPrevalenceMatrix[i]
+            self.month=month
         else:
             sys.exit('Smoking prevalences of regions for month: '+month+' are not found.')
 
@@ -26,24 +29,17 @@ class GeographicSmokingPrevalence(MacroEntity):
            input: month e.g. Nov-06
                   region e.g. 1
            
-           map region numbers (used by ABM) to region names (used by regional smoking prevalence data file):
+           the prevalences of the current month are read from the vector published by the regulator at each tick;
+           the prevalences of another month are read from the (month, region) prevalence matrix of SmokingModel.
         '''
-        hash_region={1: "North East",
-                     2: "North West",
-                     3: "Yorkshire and the Humber",
-                     4: "East Midlands",
-                     5: "West Midlands",
-                     6: "East of England",
-                     7: "London",
-                     8: "South East",
-                     9: "South West"}
-       
-        smokprev=self.smoking_model.regionalSmokingPrevalence[(self.smoking_model.regionalSmokingPrevalence['month']==month) &
-                                                              (self.smoking_model.regionalSmokingPrevalence['region']==hash_region[region])]
-        smokprev = pd.DataFrame(smokprev)
-        #ipdb.set_trace()#debug break point
-        if len(smokprev) > 0:
-            col_index = smokprev.columns.get_loc('prevalence')
-            return (float(smokprev.iat[0,col_index]))
+        if region not in hash_region:#an index out of 1 to 9 would read the prevalence of another region
+            raise ValueError('region '+str(region)+' is not a region number between 1 and 9.')
+        if month==self.month:
+            smokprev=self.regionalSmokingPrevalence[int(region)-1]
         else:
-            raise ValueError('smoking prevalence of '+hash_region[region]+' for '+month+' is not found in regionalSmokingPrevalence dataframe.')
\ No newline at end of file
+            i=self.smoking_model.regionalSmokingPrevalenceMonths.get(month)
+            smokprev=math.nan if i is None else self.smoking_model.regionalSmokingPrevalenceMatrix[i,int(region)-1]
+        if not math.isnan(smokprev):
+            return float(smokprev)
+        else:
+            raise ValueError('smoking prevalence of '+hash_region[region]+' for '+month+' is not found in regionalSmokingPrevalence data.')
\ No newline at end of file
@@ -0,0 +1,130 @@
+'''
+functions to read the CSV input data files of the ABM, compile them into lookup tables and write (or load) a compiled input bundle.
+A compiled input bundle is a directory of NumPy .npy files plus a JSON index (index.json). It stores the synthetic population,
+the regional smoking prevalences and every lookup table (STPM probabilities, death probabilities, exogenous dynamics and
+cigarette consumption percentiles) in their indexed array forms.
+The bundle is written by tools/process_input_data_files.py (compile mode) and loaded by SmokingModel without parsing any CSV file.
+The .npy files of the bundle can be memory-mapped.
+'''
+import json
+import os
+from typing import Dict
+import numpy as np
+import pandas as pd
+from config.definitions import ROOT_DIR, hash_region
+from smokingcessation.lookup_tables import LookupTable
+
+BUNDLE_VERSION = 1 #version of the format of the compiled input bundle. A bundle of another version must be recompiled.
+
+def read_input_data_files(props: Dict, initiation=True, quit=True):
+    '''
+    read the CSV input data files of model.yaml into dataframes
+    input: props, a hashmap representing model.yaml
+           initiation, True: read the STPM initiation probabilities file
+           quit, True: read the STPM quit probabilities file
+    output: hashmap with key=name of the data e.g. relapse_prob, value=dataframe
+    '''
+    data = {}
+    data['population'] = pd.read_csv(f'{ROOT_DIR}/' + props["data_file"], encoding='ISO-8859-1')
+    data['regional_prevalence'] = pd.read_csv(f'{ROOT_DIR}/' + props["regional_prevalence"], encoding='ISO-8859-1')
+    data['relapse_prob'] = pd.read_csv(f'{ROOT_DIR}/' + props["relapse_prob_file"])
+    data['death_prob'] = pd.read_csv(f'{ROOT_DIR}/' + props["death_prob_file"], encoding='ISO-8859-1')
+    data['attempt_exogenous_dynamics'] = pd.read_csv(f'{ROOT_DIR}/' + props["attempt_exogenous_dynamics_file"], encoding='ISO-8859-1')
+    data['maintenance_exogenous_dynamics'] = pd.read_csv(f'{ROOT_DIR}/' + props["maintenance_exogenous_dynamics_file"], encoding='ISO-8859-1')
+    data['cig_consumption_percentiles'] = pd.read_csv(f'{ROOT_DIR}/' + props["cig_consumption_percentiles_file"], encoding='ISO-8859-1')
+    if initiation:
+        data['initiation_prob'] = pd.read_csv(f'{ROOT_DIR}/' + props["initiation_prob_file"])
+    if quit:
+        data['quit_prob'] = pd.read_csv(f'{ROOT_DIR}/' + props["quit_prob_file"])
+    return data
+
+def compile_regional_prevalence(df: pd.DataFrame):
+    '''
+    compile the regional smoking prevalences between 2011 and 2019 into a matrix with rows=months (Jan-11,...,Dec-19) and columns=regions (1 to 9)
+    input: df, dataframe of the regional smoking prevalence data file
+    output: months, list of the months of the rows of the matrix e.g. ['Jan-11', 'Feb-11',...]
+            matrix, the (month, region) smoking prevalence matrix with NaN for a missing prevalence
+    '''
+    pattern = r"^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-1[1-9]$"#match months: Jan-11,Feb-11,...,Dec-19
+    df = df[df["month"].str.match(pattern, na=False)]
+    region_numbers = {name: number for number, name in hash_region.items()}
+    months = list(dict.fromkeys(df['month']))
+    month_rows = {month: i for i, month in enumerate(months)}
+    matrix = np.full((len(months), len(hash_region)), np.nan)
+    rows = zip(df['month'].tolist(), df['region'].tolist(), df['prevalence'].tolist())
+    for month, region, prevalence in reversed(list(rows)):#fill in the rows in reverse order so that the first row of a month and region is kept
+        if region in region_numbers:
+            matrix[month_rows[month], region_numbers[region] - 1] = prevalence
+    return months, matrix
+
+def compile_lookup_tables(data: Dict[str, pd.DataFrame]):
+    '''
+    compile the dataframes of the input data files into lookup tables
+    input: data, output of read_input_data_files
+    output: hashmap with key=name of the table, value=LookupTable
+    '''
+    tables = {}
+    #STPM transition probabilities indexed by (year, age, sex, imd_quintile[, time_since_quit])
+    tables['relapse_prob'] = LookupTable.from_dataframe(data['relapse_prob'], ['year', 'age', 'sex', 'imd_quintile', 'time_since_quit'], data['relapse_prob'].columns[-1])
+    if 'initiation_prob' in data:
+        tables['initiation_prob'] = LookupTable.from_dataframe(data['initiation_prob'], ['year', 'age', 'sex', 'imd_quintile'], data['initiation_prob'].columns[-1])
+    if 'quit_prob' in data:
+        tables['quit_prob'] = LookupTable.from_dataframe(data['quit_prob'], ['year', 'age', 'sex', 'imd_quintile'], data['quit_prob'].columns[-1])
+    #death probabilities indexed by (year, smk.state, age, sex, imd_quintile) i.e. a death probabilities cube per year
+    death_prob = data['death_prob'].assign(smk_state=data['death_prob']['smk.state'].map({'current': 0, 'former': 1, 'never': 2}))
+    tables['death_prob'] = LookupTable.from_dataframe(death_prob, ['year', 'smk_state', 'age', 'sex', 'imd_quintile'], 'qx')
+    #log odds of the quit attempt and quit maintenance exogenous dynamics indexed by (year, age, sex, social grade)
+    tables['attempt_exogenous_dynamics'] = LookupTable.from_dataframe(data['attempt_exogenous_dynamics'], ['year', 'age', 'sex', 'social grade'],
+                                                                      ['oReceiptGPAdviceLodOdds', 'pNRTLogOdds'])
+    tables['maintenance_exogenous_dynamics'] = LookupTable.from_dataframe(data['maintenance_exogenous_dynamics'], ['year', 'age', 'sex', 'social grade'],
+                                                                          ['pPrescriptionNRTLogOdds', 'cUseOfBehaviourSupportLogOdds', 'pVareniclineUseLogOdds', 'pCytisineUseLogOdds'])
+    #bCigConsumption of the years before 2025 indexed by (year, age, sex, pSEP, perc_num) and its multiplier from 2025 onwards indexed by (year, age, sex, social grade)
+    consumption = data['cig_consumption_percentiles'][data['cig_consumption_percentiles']['year'] < 2025]
+    tables['cig_consumption'] = LookupTable.from_dataframe(consumption, ['year', 'age', 'sex', 'pSEP', 'perc_num'], 'bCigConsumption', fill_value=np.nan)
+    if 'bCigConsumptionTrend' in data['attempt_exogenous_dynamics'].columns:
+        tables['cig_consumption_trend'] = LookupTable.from_dataframe(data['attempt_exogenous_dynamics'], ['year', 'age', 'sex', 'social grade'], 'bCigConsumptionTrend', fill_value=1)
+    return tables
+
+def write_input_bundle(bundle_dir: str, population: pd.DataFrame, regional_prevalence_months, regional_prevalence_matrix: np.ndarray, tables: Dict[str, LookupTable]):
+    '''
+    write a compiled input bundle
+    input: bundle_dir, directory of the bundle
+           population, dataframe of the synthetic population
+           regional_prevalence_months and regional_prevalence_matrix, output of compile_regional_prevalence
+           tables, output of compile_lookup_tables
+    '''
+    os.makedirs(bundle_dir, exist_ok=True)
+    index = {'version': BUNDLE_VERSION, 'population': {'columns': []}, 'regional_prevalence': {}, 'tables': {}}
+    #store each column of the synthetic population in a .npy file
+    for i, col in enumerate(population.columns):
+        values = population[col].to_numpy()
+        if values.dtype == object:#e.g. strings
+            values = values.astype(str)
+        np.save(f'{bundle_dir}/population.{i}.npy', values)
+        index['population']['columns'].append({'name': col, 'file': f'population.{i}.npy'})
+    np.save(f'{bundle_dir}/regional_prevalence.npy', regional_prevalence_matrix)
+    index['regional_prevalence'] = {'months': list(regional_prevalence_months), 'matrix': 'regional_prevalence.npy'}
+    for name, table in tables.items():
+        index['tables'][name] = table.save(bundle_dir, name)
+    with open(f'{bundle_dir}/index.json', 'w') as f:
+        json.dump(index, f, indent=1)
+
+def load_input_bundle(bundle_dir: str, mmap_mode=None):
+    '''
+    load a compiled input bundle
+    input: bundle_dir, directory of the bundle
+           mmap_mode, None: read the arrays into memory; 'r': memory-map the arrays of the lookup tables read-only
+    output: hashmap with keys: population (dataframe of the synthetic population),
+                               regional_prevalence_months and regional_prevalence_matrix,
+                               tables (hashmap with key=name of the table, value=LookupTable)
+    '''
+    with open(f'{bundle_dir}/index.json') as f:
+        index = json.load(f)
+    if index.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"compiled input bundle '{bundle_dir}' has version {index.get('version')} but version {BUNDLE_VERSION} is required.\nRecompile the bundle using tools/process_input_data_files.py compile")
+    bundle = {}
+    bundle['population'] = pd.DataFrame({col['name']: np.load(f'{bundle_dir}/' + col['file']) for col in index['population']['columns']})
+    bundle['regional_prevalence_months'] = index['regional_prevalence']['months']
+    bundle['regional_prevalence_matrix'] = np.load(f'{bundle_dir}/' + index['regional_prevalence']['matrix'])
+    bundle['tables'] = {name: LookupTable.load(bundle_dir, entry, mmap_mode=mmap_mode) for name, entry in index['tables'].items()}
+    return bundle
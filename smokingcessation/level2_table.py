@@ -0,0 +1,69 @@
+'''
+definition of the Level2Table class: the columnar loader of the level 2 attributes of the synthetic population.
+The level 2 columns (the columns starting with c, o or m) are selected from the synthetic population once and their dtypes are coerced column by column:
+an integer (or boolean) column is an int64 column and a float column is a float64 column. A missing value (NaN) of a float column is 0 as a Level2AttributeInt.
+mUseofNRT and mNonSmokerSelfIdentity are derived with array expressions. A COM-B theory reads the level 2 attributes of its agent from a row of the table
+instead of reading the cells of the dataframe one by one.
+'''
+from typing import List
+import sys
+import numpy as np
+import pandas as pd
+from smokingcessation.attribute import Level2AttributeInt, Level2AttributeFloat
+
+INT = 0 #the values of a column are stored as Level2AttributeInt
+FLOAT = 1 #the values of a column are stored as Level2AttributeFloat (a missing value is stored as a Level2AttributeInt with value 0)
+
+class Level2Table:
+    def __init__(self, data: pd.DataFrame, level2_attributes_names: List[str]):
+        '''
+        input: data, dataframe of the synthetic population (row i = slot i)
+               level2_attributes_names, names of the level 2 attributes (columns) of the synthetic population
+        '''
+        #key=name of a level 2 attribute, value=(INT or FLOAT, NumPy array of the values indexed by row, boolean array of the missing values or None)
+        self.columns = {}
+        for name in level2_attributes_names:
+            column = data[name]
+            if pd.api.types.is_integer_dtype(column.dtype) or pd.api.types.is_bool_dtype(column.dtype):
+                self.columns[name] = (INT, column.to_numpy(dtype=np.int64), None)
+            elif pd.api.types.is_float_dtype(column.dtype):
+                values = column.to_numpy(dtype=np.float64)
+                missing = np.isnan(values)
+                self.columns[name] = (FLOAT, values, missing if missing.any() else None)
+            else:
+                sstr = ' is not int64 or float64 and not stored into the level2_attributes hashmap.'
+                sys.exit(str(column.iloc[0]) + sstr)
+        if 'mUseofNRT' in self.columns:
+            #mUseofNRT = pOverCounterNRT or pPrescriptionNRT (0 if mUseofNRT is missing)
+            _, _, missing = self.columns['mUseofNRT']
+            values = ((data['pOverCounterNRT'].to_numpy() == 1) | (data['pPrescriptionNRT'].to_numpy() == 1)).astype(np.int64)
+            if missing is not None:
+                values[missing] = 0
+            self.columns['mUseofNRT'] = (INT, values, None)
+        if 'mSmokerIdentity' in self.columns:
+            #mSmokerIdentity: '1=I think of myself as a non-smoker', '2=I still think of myself as a smoker', -1='don't know', 4='not stated'.
+            #mNonSmokerSelfIdentity: 0 if mSmokerIdentity is 2, 1 if mSmokerIdentity is 1, otherwise mSmokerIdentity (-1='don't know' or 4='not stated')
+            _, values, missing = self.columns['mSmokerIdentity']
+            if missing is not None:
+                values = np.where(missing, 0, values)
+            values = np.where(values == 2, 0, np.where(values == 1, 1, values))
+            self.columns['mNonSmokerSelfIdentity'] = (INT, values, None)
+        self.columns = [(name, kind, values, missing) for name, (kind, values, missing) in self.columns.items()]
+
+    def level2_attributes_of_row(self, i: int):
+        '''
+        output: generator of new Level2Attribute objects of the level 2 attributes of row i (a theory has its own objects)
+        '''
+        for name, kind, values, missing in self.columns:
+            if kind == INT:
+                yield Level2AttributeInt(name=name, value=values[i])
+            elif missing is not None and missing[i]:
+                #level 2 attribute has NaN (missing value)
+                #ignore this level 2 attribute by set it to 0 so that 0*beta=0 in the COM-B formula.
+                yield Level2AttributeInt(name=name, value=0)
+            else:
+                yield Level2AttributeFloat(name=name, value=values[i])
+
+    def nbytes(self):
+        '''memory of the columns in bytes'''
+        return sum(values.nbytes + (0 if missing is None else missing.nbytes) for _, _, values, missing in self.columns)
@@ -0,0 +1,129 @@
+'''
+startup coverage precheck of the lookup tables of the ABM.
+The distinct keys of the synthetic population are cross-joined with the years of the simulation (year_of_baseline to the year of the final tick)
+and every key which an agent can look up in the death probabilities, STPM probabilities, exogenous dynamics, cigarette consumption
+and regional smoking prevalence tables during the simulation is checked against the table in one vectorised pass before any tick runs.
+A key with no matching row is a silent 0 probability (or 0 log odds or no update of bCigConsumption) during the simulation,
+whereas a missing regional smoking prevalence stops the simulation, so the missing regional smoking prevalences are fatal at startup.
+'''
+from typing import Dict
+import numpy as np
+import pandas as pd
+from config.definitions import hash_region
+from smokingcessation.lookup_tables import LookupTable
+
+def project_population_keys(population: pd.DataFrame, year_of_baseline: int, final_year: int):
+    '''
+    cross-join the distinct keys of the synthetic population with the years of the simulation.
+    An agent entering the population in year e at age pAge is in the population from year e to the final year (if e >= year_of_baseline)
+    and its age in year y is pAge + y - e (the ages are incremented in December). The agents older than 90 are killed.
+    input: population, dataframe of the synthetic population
+           year_of_baseline, year of the baseline population
+           final_year, year of the final tick of the simulation
+    output: dataframe of the distinct keys with columns year, age, sex, imd_quintile, sep, region, perc_num
+    '''
+    keys = population[['year', 'pAge', 'pGender', 'pIMDquintile', 'pSEP', 'pRegion', 'perc_num']].astype(np.int64).drop_duplicates()
+    keys = keys[keys['year'] >= year_of_baseline]
+    start = keys['year'].to_numpy()
+    years_in_population = np.clip(final_year - start + 1, 0, None) #number of years of the simulation of each key
+    rows = np.repeat(np.arange(len(keys)), years_in_population)
+    years = start[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(years_in_population) - years_in_population, years_in_population)
+    projected = pd.DataFrame({'year': years,
+                              'age': keys['pAge'].to_numpy()[rows] + years - start[rows],
+                              'sex': keys['pGender'].to_numpy()[rows],
+                              'imd_quintile': keys['pIMDquintile'].to_numpy()[rows],
+                              'sep': keys['pSEP'].to_numpy()[rows],
+                              'region': keys['pRegion'].to_numpy()[rows],
+                              'perc_num': keys['perc_num'].to_numpy()[rows]})
+    return projected[projected['age'] <= 90].drop_duplicates().reset_index(drop=True)
+
+def find_uncovered_keys(table: LookupTable, keys: Dict[str, np.ndarray]):
+    '''
+    input: table, a LookupTable
+           keys, hashmap with key=name of a key column, value=array of the values of the key column (in the order of the key columns of the table)
+    output: dataframe of the distinct keys with no matching row in the table
+    '''
+    keys = pd.DataFrame(keys).drop_duplicates()
+    contains = table.contains_many(*[keys[col].to_numpy() for col in keys.columns])
+    return keys[~contains]
+
+def check_lookup_coverage(smoking_model, year_of_baseline: int, final_year: int):
+    '''
+    check that the lookup tables of the smoking model have a row for every key of the synthetic population during the simulation.
+    The tables with no uncovered key are marked as covered (the no-miss fast path of LookupTable.get).
+    input: smoking_model, a SmokingModel with the lookup tables and the synthetic population read in
+           year_of_baseline, year of the baseline population
+           final_year, year of the final tick of the simulation
+    output: uncovered, dataframe with columns table, year, key (e.g. age=16;sex=1;imd_quintile=3) of the uncovered keys
+            fatal, list of the messages of the missing regional smoking prevalences
+    '''
+    population = project_population_keys(smoking_model.data, year_of_baseline, final_year)
+    year, age, sex = population['year'].to_numpy(), population['age'].to_numpy(), population['sex'].to_numpy()
+    imd, sep, perc_num = population['imd_quintile'].to_numpy(), population['sep'].to_numpy(), population['perc_num'].to_numpy()
+    alive = age <= 89 #agents older than 89 are killed in December without a lookup of their death probabilities
+    checks = [] #(name of the table, table, hashmap of the keys of the lookups)
+    #December mortality of the never smokers (2), ex-smokers (1) and smokers and quitters (0)
+    for state in (0, 1, 2):
+        checks.append(('death_prob', smoking_model.death_prob_table,
+                       {'year': year[alive], 'smk_state': np.full(alive.sum(), state), 'age': age[alive], 'sex': sex[alive], 'imd_quintile': imd[alive]}))
+    #relapse of the ex-smokers of 1 to 10 years since quit (STPM probabilities of 2011 are used before 2011)
+    for years_since_quit in range(1, 11):
+        checks.append(('relapse_prob', smoking_model.relapse_prob_table,
+                       {'year': np.maximum(year, 2011), 'age': age, 'sex': sex, 'imd_quintile': imd, 'time_since_quit': np.full(len(year), years_since_quit)}))
+    if smoking_model.regular_smoking_behaviour == 'STPM':
+        checks.append(('initiation_prob', smoking_model.initiation_prob_table,
+                       {'year': np.maximum(year, 2011), 'age': age, 'sex': sex, 'imd_quintile': imd}))
+    if smoking_model.quitting_behaviour == 'STPM':
+        after_2010 = year >= 2011
+        checks.append(('quit_prob', smoking_model.quit_prob_table,
+                       {'year': year[after_2010], 'age': age[after_2010], 'sex': sex[after_2010], 'imd_quintile': imd[after_2010]}))
+    else:#COMB quit attempt and quit maintenance theories look up the log odds by the agents' pSEP
+        for name, cache in (('attempt_exogenous_dynamics', smoking_model.attempt_exogenous_dynamics_cache),
+                            ('maintenance_exogenous_dynamics', smoking_model.maintenance_exogenous_dynamics_cache)):
+            checks.append((name, cache.table, {'year': year, 'age': age, 'sex': sex, 'social grade': sep}))
+    #bCigConsumption of the surviving agents at their new ages in December
+    checks.append(('cig_consumption', smoking_model.cig_consumption_table,
+                   {'year': year[alive], 'age': age[alive] + 1, 'sex': sex[alive], 'pSEP': sep[alive], 'perc_num': perc_num[alive]}))
+    uncovered = []
+    tables = {} #key=name of a table, value=(table, True if any key of the table is uncovered)
+    for name, table, keys in checks:
+        missing = find_uncovered_keys(table, keys)
+        if len(missing) > 0:
+            columns = [col for col in missing.columns if col != 'year']
+            uncovered.append(pd.DataFrame({'table': name,
+                                           'year': missing['year'].to_numpy(),
+                                           'key': [';'.join(f'{col}={value}' for col, value in zip(columns, row)) for row in missing[columns].itertuples(index=False)]}))
+        tables[name] = (table, tables.get(name, (table, False))[1] or len(missing) > 0)
+    for table, has_uncovered_keys in tables.values():
+        table.covered = not has_uncovered_keys
+    #regional smoking prevalences of the months between 2011 and 2019
+    fatal = []
+    regions = np.unique(population['region'].to_numpy())
+    uses_regional_prevalence = smoking_model.regular_smoking_behaviour == 'COMB' or smoking_model.quitting_behaviour == 'COMB'
+    missing_regional = []
+    for tick in range(1, int(smoking_model.stop_at) + 1):
+        year_of_tick = year_of_baseline + (tick - 1) // 12
+        if year_of_tick < 2011 or year_of_tick > 2019:
+            continue
+        month = pd.Timestamp(year=year_of_tick, month=(tick - 1) % 12 + 1, day=1).strftime('%b-%y')
+        i = smoking_model.regionalSmokingPrevalenceMonths.get(month)
+        if i is None:
+            fatal.append(f'smoking prevalences of regions for month: {month} are not found.')
+            missing_regional.append((year_of_tick, f'month={month}'))
+        elif uses_regional_prevalence:
+            for region in regions.tolist():
+                if region not in hash_region:
+                    fatal.append(f'region {region} of the synthetic population is not a region number between 1 and 9.')
+                    missing_regional.append((year_of_tick, f'month={month};region={region}'))
+                elif np.isnan(smoking_model.regionalSmokingPrevalenceMatrix[i, region - 1]):
+                    fatal.append(f'smoking prevalence of {hash_region[region]} for {month} is not found.')
+                    missing_regional.append((year_of_tick, f'month={month};region={region}'))
+    if len(missing_regional) > 0:
+        uncovered.append(pd.DataFrame({'table': 'regional_prevalence',
+                                       'year': [year for year, _ in missing_regional],
+                                       'key': [key for _, key in missing_regional]}))
+    if len(uncovered) > 0:
+        uncovered = pd.concat(uncovered, ignore_index=True)
+    else:
+        uncovered = pd.DataFrame({'table': [], 'year': [], 'key': []})
+    return uncovered, list(dict.fromkeys(fatal))
@@ -0,0 +1,266 @@
+'''
+definition of the LookupTable class which compiles a data table (e.g. a STPM transition probabilities file) into a dense NumPy array
+indexed by the integer values of the key columns of the table (e.g. year, age, sex, imd_quintile and time_since_quit).
+A lookup of the value of an agent is an O(1) array indexing instead of filtering the whole dataframe with a boolean mask.
+'''
+from typing import List, Union
+import numpy as np
+import pandas as pd
+
+class LookupTable:
+    def __init__(self, key_columns: List[str], offsets: np.ndarray, values: np.ndarray, found: np.ndarray, fill_value=0, value_columns: List[str] = None):
+        self.key_columns = key_columns #names of the key columns e.g. ['year', 'age', 'sex', 'imd_quintile']
+        self.offsets = offsets #offsets[i] = the smallest value of the ith key column (i.e. index 0 of the ith dimension of values)
+        self.values = values #values[key1-offsets[0], key2-offsets[1],...] = value (or vector of the values of value_columns) of the row matching (key1, key2,...)
+        self.found = found #found[key1-offsets[0], key2-offsets[1],...] = True if the table has a row matching (key1, key2,...)
+        self.fill_value = fill_value #value of a key which is not in the table
+        self.value_columns = value_columns #names of the value columns of a table with several values per key; None if the table has one value per key
+        self.shape = found.shape
+        #True if the startup coverage precheck found a row for every key of the simulation: get skips the check of found
+        #(values is fill_value for a key with no row, so a lookup of a key not in the table still returns fill_value)
+        self.covered = False
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, key_columns: List[str], value_column: Union[str, List[str]], fill_value=0):
+        '''
+        compile the dataframe into a LookupTable
+        input: df, a dataframe with integer key columns
+               key_columns, names of the key columns e.g. ['year', 'age', 'sex', 'imd_quintile']
+               value_column, name of the column to look up e.g. 'p_start_1month' or a list of the names of several columns to look up
+               fill_value, value of a key which is not in the dataframe
+        '''
+        #keep the first row matching a key (as filtering the dataframe and taking its first row does)
+        df = df.dropna(subset=key_columns).drop_duplicates(subset=key_columns, keep='first')
+        keys = [df[col].to_numpy().astype(np.int64) for col in key_columns]
+        if len(df) > 0:
+            offsets = np.array([k.min() for k in keys], dtype=np.int64)
+            shape = tuple(int(k.max() - k.min()) + 1 for k in keys)
+        else:
+            offsets = np.zeros(len(key_columns), dtype=np.int64)
+            shape = tuple(0 for _ in key_columns)
+        value_columns = list(value_column) if isinstance(value_column, (list, tuple)) else None
+        values = np.full(shape if value_columns is None else shape + (len(value_columns),), fill_value, dtype=np.float64)
+        found = np.zeros(shape, dtype=bool)
+        index = tuple(k - offset for k, offset in zip(keys, offsets))
+        values[index] = df[value_column if value_columns is None else value_columns].to_numpy().astype(np.float64)
+        found[index] = True
+        return cls(list(key_columns), offsets, values, found, fill_value, value_columns)
+
+    def get(self, *keys):
+        '''
+        get the value of the row matching the keys
+        input: keys, values of the key columns in the order of key_columns e.g. year, age, sex, imd_quintile
+        output: the value of the matching row or fill_value if the table has no matching row
+        '''
+        index = []
+        for key, offset, size in zip(keys, self.offsets, self.shape):
+            i = int(key) - offset
+            if i < 0 or i >= size:
+                return self.fill_value
+            index.append(i)
+        index = tuple(index)
+        if self.covered or self.found[index]:
+            return float(self.values[index])
+        return self.fill_value
+
+    def contains_many(self, *keys):
+        '''
+        input: keys, arrays (or scalars) of the values of the key columns in the order of key_columns
+        output: boolean array, True if the table has a row matching the keys
+        '''
+        keys = np.broadcast_arrays(*[np.asarray(key).astype(np.int64) for key in keys])
+        contains = np.zeros(keys[0].shape, dtype=bool)
+        in_range = np.ones(keys[0].shape, dtype=bool)
+        index = []
+        for key, offset, size in zip(keys, self.offsets, self.shape):
+            i = key - offset
+            in_range &= (i >= 0) & (i < size)
+            index.append(i)
+        contains[in_range] = self.found[tuple(i[in_range] for i in index)]
+        return contains
+
+    def get_many(self, *keys):
+        '''
+        vectorised get: get the values of the rows matching the arrays of keys
+        input: keys, arrays (or scalars) of the values of the key columns in the order of key_columns e.g. years, ages, sexes, imd_quintiles
+        output: array of the values of the matching rows with fill_value for the keys which are not in the table
+        '''
+        keys = np.broadcast_arrays(*[np.asarray(key).astype(np.int64) for key in keys])
+        values = np.full(keys[0].shape, self.fill_value, dtype=np.float64)
+        in_range = np.ones(keys[0].shape, dtype=bool)
+        index = []
+        for key, offset, size in zip(keys, self.offsets, self.shape):
+            i = key - offset
+            in_range &= (i >= 0) & (i < size)
+            index.append(i)
+        index = tuple(i[in_range] for i in index)
+        found = self.found[index]
+        values.reshape(-1)[np.flatnonzero(in_range)[found]] = self.values[index][found]
+        return values
+
+    def save(self, directory: str, name: str):
+        '''
+        save the arrays of this table into the .npy files <name>.offsets.npy, <name>.values.npy and <name>.found.npy in the directory
+        output: the entry of this table in the JSON index of a compiled input bundle
+        '''
+        entry = {'key_columns': self.key_columns,
+                 'value_columns': self.value_columns,
+                 'fill_value': None if np.isnan(self.fill_value) else self.fill_value, #NaN is not valid JSON
+                 'offsets': name + '.offsets.npy',
+                 'values': name + '.values.npy',
+                 'found': name + '.found.npy'}
+        np.save(f'{directory}/' + entry['offsets'], self.offsets)
+        np.save(f'{directory}/' + entry['values'], self.values)
+        np.save(f'{directory}/' + entry['found'], self.found)
+        return entry
+
+    @classmethod
+    def load(cls, directory: str, entry: dict, mmap_mode=None):
+        '''
+        load a table saved by save
+        input: directory, directory of the .npy files
+               entry, entry of the table in the JSON index
+               mmap_mode, None: read the arrays into memory; 'r': memory-map the arrays read-only 
+                          (the pages of the .npy files are shared by all the processes memory-mapping them)
+        '''
+        #np.asarray: plain ndarray views of the memory-mapped files (indexing a np.memmap is slower)
+        return cls(entry['key_columns'],
+                   np.load(f'{directory}/' + entry['offsets']),
+                   np.asarray(np.load(f'{directory}/' + entry['values'], mmap_mode=mmap_mode)),
+                   np.asarray(np.load(f'{directory}/' + entry['found'], mmap_mode=mmap_mode)),
+                   np.nan if entry['fill_value'] is None else entry['fill_value'],
+                   entry['value_columns'])
+
+def compile_cig_consumption_table(consumption: LookupTable, trend: LookupTable, final_year: int):
+    '''
+    compile the cigarette consumption table indexed by (year, age, sex, pSEP, perc_num) up to the final year.
+    Before 2025, bCigConsumption of a year is the bCigConsumption of that year in the cigarette consumption percentiles file;
+    from 2025 onwards, bCigConsumption of a year = bCigConsumption of 2024 x bCigConsumptionTrend (the multiplier) of the matching (year, age, sex, social grade)
+    in the quit attempt exogenous dynamics file or bCigConsumption of 2024 if there is no matching multiplier.
+    input: consumption, bCigConsumption of the years before 2025 indexed by (year, age, sex, pSEP, perc_num) with fill_value NaN
+           trend, bCigConsumptionTrend indexed by (year, age, sex, social grade) with fill_value 1 or None if there is no bCigConsumptionTrend
+           final_year, year of the final tick of the simulation
+    output: a LookupTable with NaN for the keys with no matching bCigConsumption (the agents' bCigConsumption is not updated)
+            or consumption if it already has the years from 2025 to the final year (e.g. compiled into a compiled input bundle)
+    '''
+    if 2024 < consumption.offsets[0] or 2024 >= consumption.offsets[0] + consumption.shape[0]:#no bCigConsumption of 2024
+        return consumption
+    if trend is not None:
+        final_year = max(final_year, int(trend.offsets[0]) + trend.shape[0] - 1)
+    last_year = int(consumption.offsets[0]) + consumption.shape[0] - 1
+    if final_year < 2025 or (last_year >= 2025 and last_year >= final_year):
+        return consumption
+    years = np.arange(consumption.offsets[0], final_year + 1)
+    values = np.full((len(years),) + consumption.shape[1:], np.nan)
+    found = np.zeros((len(years),) + consumption.shape[1:], dtype=bool)
+    values[:consumption.shape[0]] = consumption.values
+    found[:consumption.shape[0]] = consumption.found
+    baseline = 2024 - consumption.offsets[0] #index of 2024
+    ages, sexes, seps = [np.arange(offset, offset + size) for offset, size in zip(consumption.offsets[1:4], consumption.shape[1:4])]
+    for year in range(2025, final_year + 1):
+        i = year - consumption.offsets[0]
+        if trend is not None:
+            multipliers = trend.get_many(year, ages[:, None, None], sexes[None, :, None], seps[None, None, :])
+            values[i] = values[baseline] * multipliers[..., None]
+        else:
+            values[i] = values[baseline]
+        found[i] = found[baseline]
+    return LookupTable(consumption.key_columns, consumption.offsets, values, found, np.nan)
+
+class ExogenousDynamicsCache:
+    '''
+    cache of the log odds of an exogenous dynamics table (e.g. table_attempts_dynamic_extended_integers.csv) of the current year
+    with key=(age, sex, social grade), value=tuple of the log odds of the log odds columns.
+    As the exogenous dynamics only change by year, the cache is rebuilt once per simulated year (when the year of a lookup changes).
+    '''
+    def __init__(self, table: LookupTable):
+        self.table = table #the exogenous dynamics indexed by (year, age, sex, social grade) with the log odds columns as the value columns
+        self.logodds_columns = table.value_columns #names of the log odds columns e.g. ['oReceiptGPAdviceLodOdds', 'pNRTLogOdds']
+        self.year = None #year of the cached log odds
+        self.logodds = {} #key=(age, sex, social grade), value=tuple of the log odds
+
+    def rebuild(self, year: int):
+        '''cache the log odds of the year'''
+        self.logodds = {}
+        i = int(year) - int(self.table.offsets[0])
+        if 0 <= i < self.table.shape[0]:
+            found = self.table.found[i]
+            keys = zip(*[(index + offset).tolist() for index, offset in zip(np.nonzero(found), self.table.offsets[1:])])
+            self.logodds = dict(zip(keys, map(tuple, self.table.values[i][found].tolist())))
+        self.year = year
+
+    def get(self, year: int, age: int, sex: int, social_grade: int):
+        '''
+        get the log odds of the matching (year, age, sex, social grade)
+        output: tuple of the log odds in the order of logodds_columns or None if the table has no matching row
+        '''
+        if year != self.year:
+            self.rebuild(year)
+        return self.logodds.get((age, sex, social_grade))
+
+    def get_many(self, year: int, ages, sexes, social_grades):
+        '''
+        vectorised get: get the log odds of the matching (year, age, sex, social grade) of the arrays of ages, sexes and social grades
+        output: matrix of the log odds (rows=keys, columns=logodds_columns) with 0 log odds for the keys with no matching row,
+                boolean array, True if the table has a matching row
+        '''
+        keys = np.broadcast_arrays(*[np.asarray(key).astype(np.int64) for key in (year, ages, sexes, social_grades)])
+        found = self.table.contains_many(*keys)
+        logodds = np.zeros(found.shape + (len(self.logodds_columns),))
+        logodds[found] = self.table.values[tuple(key[found] - offset for key, offset in zip(keys, self.table.offsets))]
+        return logodds, found
+
+class LookupMissCounter:
+    '''
+    counter of the lookups with no matching row in a lookup table (e.g. an agent's (year, age, sex, social grade) not in the quit attempt exogenous dynamics).
+    A miss is recorded in O(1) into a hashmap with key=(year, name of the table, key tuple), value=number of misses of the key in the year
+    and the misses are summarised per year at the end of the simulation.
+    '''
+    def __init__(self):
+        self.key_columns = {} #key=name of a table, value=names of the columns of the key tuples of the table e.g. ['age', 'sex', 'social grade']
+        self.misses = {} #key=(year, name of the table, key tuple), value=number of misses
+
+    def add_table(self, table: str, key_columns: List[str]):
+        '''register the names of the columns of the key tuples of a table'''
+        self.key_columns[table] = list(key_columns)
+
+    def record(self, year: int, table: str, key: tuple):
+        '''record a miss of the key in the table in the year'''
+        miss = (year, table, key)
+        self.misses[miss] = self.misses.get(miss, 0) + 1
+
+    def total(self):
+        '''total number of misses'''
+        return sum(self.misses.values())
+
+    def summary(self):
+        '''
+        summarise the misses per year and table
+        output: list of (year, table, number of misses, number of distinct keys) sorted by year and table
+        '''
+        summary = {}
+        for (year, table, _), count in self.misses.items():
+            misses, keys = summary.get((year, table), (0, 0))
+            summary[(year, table)] = (misses + count, keys + 1)
+        return [(year, table, misses, keys) for (year, table), (misses, keys) in sorted(summary.items())]
+
+    def format_key(self, table: str, key: tuple):
+        '''format a key tuple as e.g. age=16;sex=1;social grade=0'''
+        columns = self.key_columns.get(table, [f'key{i}' for i in range(len(key))])
+        return ';'.join(f'{col}={value}' for col, value in zip(columns, key))
+
+    def write_summary(self, logfile):
+        '''write the summary of the misses per year into the logfile'''
+        logfile.write('\n=== LOOKUP MISSES ===\n')
+        if len(self.misses) == 0:
+            logfile.write('no lookup misses\n')
+        for year, table, misses, keys in self.summary():
+            logfile.write(f'year {year}: {misses} lookups of {keys} keys have no matching row in {table}\n')
+        logfile.write('=== END OF LOOKUP MISSES ===\n')
+
+    def write_csv(self, filename: str):
+        '''write the misses into a CSV file with columns: year, table, key, misses (sorted by year, table and key)'''
+        with open(filename, 'w') as f:
+            f.write('year,table,key,misses\n')
+            for (year, table, key), count in sorted(self.misses.items()):
+                f.write(f'{year},{table},{self.format_key(table, key)},{count}\n')
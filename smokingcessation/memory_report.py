@@ -0,0 +1,96 @@
+'''
+memory report of the agents of the ABM: bytes per agent of the objects owned by an agent (the Person, its personal attributes,
+behaviour buffer, mediator, theories and their level 2 attributes) and of its slots of the PopulationStore and StateHistory.
+The bytes per agent are reported with the __slots__ layout of the classes (after) and estimated with a per-instance __dict__ layout (before)
+i.e. the size of an object of a plain class with the same attributes in its __dict__.
+'''
+import sys
+import types
+from enum import Enum
+import numpy as np
+
+class _DictLayout:#a plain class whose instances store their attributes in __dict__
+    pass
+
+def attribute_names(obj):
+    '''names of the attributes of the object (stored in its __slots__ or __dict__)'''
+    names = []
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        for name in ([slots] if isinstance(slots, str) else slots):
+            if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                names.append(name)
+    if hasattr(obj, '__dict__'):
+        names.extend(obj.__dict__.keys())
+    return names
+
+def object_bytes(obj, dict_layout=False):
+    '''
+    bytes of the object (excluding the objects referenced by its attributes)
+    input: dict_layout, False: bytes of the object with its own layout; True: bytes of the object if its attributes were stored in a __dict__
+    '''
+    if dict_layout and not isinstance(obj, (list, dict, tuple, set, str, int, float)):
+        plain = _DictLayout()
+        for name in attribute_names(obj):
+            setattr(plain, name, None)
+        return sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def bytes_of_agent(agent, shared_ids, dict_layout=False):
+    '''
+    bytes of the objects owned by the agent
+    input: agent, a Person
+           shared_ids, ids of the objects shared by the agents (e.g. the smoking model) which are not counted
+           dict_layout, True: estimate the bytes with a per-instance __dict__ layout of the objects
+    '''
+    seen = set(shared_ids)
+    stack = [agent]
+    total = 0
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType, Enum, np.ndarray, bool)):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, str) and sys.intern(obj) is obj:#an interned string is shared by the agents
+            continue
+        if type(obj) is int and -5 <= obj <= 256:#small integers are cached by Python
+            continue
+        total += object_bytes(obj, dict_layout)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, int, float, np.generic)):
+            stack.extend(getattr(obj, name) for name in attribute_names(obj))
+    return total
+
+def memory_report(smoking_model, sample_size=1000):
+    '''
+    estimate the bytes per agent from a sample of the agents
+    output: hashmap with keys: agents (number of agents), sampled (number of sampled agents),
+                               dict_layout (bytes per agent with a per-instance __dict__ layout i.e. before __slots__),
+                               slots_layout (bytes per agent with the __slots__ layout i.e. after __slots__),
+                               store (bytes per agent of the PopulationStore)
+                               state_history (bytes per agent of the StateHistory)
+    '''
+    agents = list(smoking_model.context.agents())
+    sample = agents[::max(1, len(agents) // sample_size)][:sample_size]
+    #the smoking model and the objects referenced by it (e.g. the population store, lookup tables and social network) are shared by the agents
+    shared_ids = {id(smoking_model)} | {id(value) for value in vars(smoking_model).values()}
+    #the objects held in the hashmaps of the smoking model (e.g. the COM-B formula plans of the theories) are also shared by the agents
+    for value in vars(smoking_model).values():
+        if isinstance(value, dict):
+            shared_ids.update(id(item) for item in value.values())
+    for agent in sample:
+        if hasattr(agent, 'graph'):
+            shared_ids.add(id(agent.graph))
+    report = {'agents': len(agents), 'sampled': len(sample)}
+    report['dict_layout'] = sum(bytes_of_agent(agent, shared_ids, dict_layout=True) for agent in sample) / max(1, len(sample))
+    report['slots_layout'] = sum(bytes_of_agent(agent, shared_ids) for agent in sample) / max(1, len(sample))
+    report['store'] = smoking_model.population_store.nbytes() / max(1, smoking_model.population_store.size)
+    report['state_history'] = smoking_model.state_history.nbytes() / max(1, smoking_model.state_history.size)
+    return report
@@ -6,17 +6,42 @@ import random
 from typing import List
 from config.definitions import *
 from smokingcessation.smoking_model import SmokingModel
-from smokingcessation.attribute import PersonalAttribute
+from smokingcessation.attribute import ColumnAttribute
+from smokingcessation.population_store import StoreColumn, NEWEST_BEHAVIOUR, POPCOUNT
 from mbssm.micro_agent import MicroAgent
 import config.global_variables as g
-import pandas as pd
 
 class Person(MicroAgent):
+    #attributes of this agent (no per-instance __dict__)
+    __slots__ = ('smoking_model', 'store', 'state_history', 'slot',
+                 'p_age', 'p_gender', 'p_imd_quintile', 'p_cohort', 'p_educational_level', 'p_sep', 'p_region', 'p_social_housing',
+                 'p_mental_health_conditions', 'p_alcohol_consumption', 'p_expenditure', 'p_prescription_nrt', 'p_over_counter_nrt',
+                 'p_use_of_nrt', 'p_varenicline_use', 'p_ecig_use', 'p_percentile', 'p_difficulty_of_access',
+                 'c_age_group_30to44', 'c_age_group_45to64', 'c_age_group_65plus', 'm_age_group_30to44', 'm_age_group_45to64', 'm_age_group_65plus',
+                 'eCig_diff_subgroup', 'prequit_addiction_strength', 'ecig_type', 'ecig_use',
+                 'quit_attempt_theory', 'quit_maintenance_theory', 'graph')
+    #attributes stored in the columns of the PopulationStore of the smoking model at the slot of this agent
+    is_active = StoreColumn('active')
+    entry_year = StoreColumn('entry_year')
+    b_cig_consumption = StoreColumn('cig_consumption')
+    b_number_of_recent_quit_attempts = StoreColumn('number_of_recent_quit_attempts')
+    b_years_since_quit = StoreColumn('years_since_quit')
+    b_months_since_quit = StoreColumn('months_since_quit')
+    months_counter_ex_smoker = StoreColumn('months_counter_ex_smoker')
+    behaviour_buffer = StoreColumn('behaviour_buffer')
+    propensity_receive_GP_advice_attempt = StoreColumn('propensity_receive_GP_advice_attempt')
+    propensity_NRT_attempt = StoreColumn('propensity_NRT_attempt')
+    propensity_NRT_maintenance = StoreColumn('propensity_NRT_maintenance')
+    propensity_behaviour_support_maintenance = StoreColumn('propensity_behaviour_support_maintenance')
+    propensity_varenicline_maintenance = StoreColumn('propensity_varenicline_maintenance')
+    propensity_cytisine_maintenance = StoreColumn('propensity_cytisine_maintenance')
+
     def __init__(self,
                  smoking_model: SmokingModel,
                  id: int,
                  type: int,
                  rank: int,
+                 slot: int = None, #slot of this agent in the PopulationStore of the smoking model
                  age: int = None,
                  gender: str = None,
                  qimd: float = None,
@@ -51,59 +76,63 @@ class Person(MicroAgent):
                  quit_maintenance_theory=None,
                  regular_smoking_behaviour=None,#regular smoking COMB model or STPM intiation transition probabilities
                  quitting_behaviour=None, #quit attempt COMB model or STPM quitting transition probabilities
-                 entry_year: int = None  # Add entry_year parameter
+                 entry_year: int = None,  # Add entry_year parameter
+                 behaviour_buffer: int = None #behaviour buffer drawn before the agent is created (lazy agent creation) or None to draw it
                  ):
         super().__init__(id=id, type=type, rank=rank)
+        self.store = smoking_model.population_store
+        self.slot = slot
         self.is_active = False  # Initialise agents and default to inactive
         self.entry_year = entry_year  # Store entry year
         self.smoking_model = smoking_model        
-        self.b_states = states #list of states. states[t] is the agent's state at time step t (t=0,1,...,current time step) with t=0 representing the beginning of the simulation.
+        self.state_history = smoking_model.state_history #states of the agent at time steps t=0,1,...,current time step with t=0 representing the beginning of the simulation are recorded in the row (slot) of the agent
+        self.state_history.set_states(slot, states)
         self.b_months_since_quit = months_since_quit #number of months of maintaining the quit behhaviour; only tracked for the ongoing quitter state.
         self.b_cig_consumption = cig_consumption 
         self.b_number_of_recent_quit_attempts = number_of_recent_quit_attempts
         self.b_years_since_quit = years_since_quit        
         self.months_counter_ex_smoker = 0  # count number of consecutive months when the self stays as an ex-smoker
-        self.init_behaviour_buffer() #initialise the behaviour buffer which stores the agent's behaviours (COMB and STPM behaviours) over the last 12 months                                           
-        self.p_age = PersonalAttribute(name='pAge') 
+        self.init_behaviour_buffer(behaviour_buffer) #initialise the behaviour buffer which stores the agent's behaviours (COMB and STPM behaviours) over the last 12 months                                           
+        self.p_age = ColumnAttribute(self.store.age, slot, name='pAge') 
         self.p_age.set_value(age)
-        self.p_gender = PersonalAttribute(name='pGender')
+        self.p_gender = ColumnAttribute(self.store.gender, slot, name='pGender')
         self.p_gender.set_value(gender)
-        self.p_imd_quintile = PersonalAttribute(name='pIMDQuintile')
+        self.p_imd_quintile = ColumnAttribute(self.store.imd_quintile, slot, name='pIMDQuintile')
         self.p_imd_quintile.set_value(qimd)
-        self.p_cohort = PersonalAttribute(name='pCohort')
+        self.p_cohort = ColumnAttribute(self.store.cohort, slot, name='pCohort')
         self.p_cohort.set_value(cohort)
-        self.p_educational_level = PersonalAttribute(name='pEducationalLevel')
+        self.p_educational_level = ColumnAttribute(self.store.educational_level, slot, name='pEducationalLevel')
         self.p_educational_level.set_value(educational_level)
-        self.p_sep = PersonalAttribute(name='pSEP')
+        self.p_sep = ColumnAttribute(self.store.sep, slot, name='pSEP')
         self.p_sep.set_value(sep)
-        self.p_region = PersonalAttribute(name='pRegion')
+        self.p_region = ColumnAttribute(self.store.region, slot, name='pRegion')
         self.p_region.set_value(region)
-        self.p_social_housing = PersonalAttribute(name='pSocialHousing')
+        self.p_social_housing = ColumnAttribute(self.store.social_housing, slot, name='pSocialHousing')
         self.p_social_housing.set_value(social_housing)
-        self.p_mental_health_conditions = PersonalAttribute(name='pMentalHealthConditions')
+        self.p_mental_health_conditions = ColumnAttribute(self.store.mental_health_conditions, slot, name='pMentalHealthConditions')
         self.p_mental_health_conditions.set_value(mental_health_conds)
-        self.p_alcohol_consumption = PersonalAttribute(name='pAlcoholConsumption')
+        self.p_alcohol_consumption = ColumnAttribute(self.store.alcohol_consumption, slot, name='pAlcoholConsumption')
         self.p_alcohol_consumption.set_value(alcohol)
-        self.p_expenditure = PersonalAttribute(name='pExpenditure')
+        self.p_expenditure = ColumnAttribute(self.store.expenditure, slot, name='pExpenditure')
         self.p_expenditure.set_value(expenditure)
-        self.p_prescription_nrt = PersonalAttribute(name='pPrescriptionNRT')
+        self.p_prescription_nrt = ColumnAttribute(self.store.prescription_nrt, slot, name='pPrescriptionNRT')
         self.p_prescription_nrt.set_value(prescription_nrt)
-        self.p_over_counter_nrt = PersonalAttribute(name='pOverCounterNRT')
+        self.p_over_counter_nrt = ColumnAttribute(self.store.over_counter_nrt, slot, name='pOverCounterNRT')
         self.p_over_counter_nrt.set_value(over_counter_nrt)
-        self.p_use_of_nrt = PersonalAttribute(name='pUseOfNRT')
+        self.p_use_of_nrt = ColumnAttribute(self.store.use_of_nrt, slot, name='pUseOfNRT')
         self.p_use_of_nrt.set_value(use_of_nrt)
-        self.p_varenicline_use = PersonalAttribute(name='pVareniclineUse')
+        self.p_varenicline_use = ColumnAttribute(self.store.varenicline_use, slot, name='pVareniclineUse')
         self.p_varenicline_use.set_value(varenicline_use)
-        self.p_ecig_use = PersonalAttribute(name='pECigUse')
+        self.p_ecig_use = ColumnAttribute(self.store.ecig_use, slot, name='pECigUse')
         self.p_ecig_use.set_value(ecig_use)
         
         # Age group dummy variables
-        self.c_age_group_30to44 = PersonalAttribute(name='cAgeGroup30To44')
-        self.c_age_group_45to64 = PersonalAttribute(name='cAgeGroup45To64')
-        self.c_age_group_65plus = PersonalAttribute(name='cAgeGroup65Plus')
-        self.m_age_group_30to44 = PersonalAttribute(name='mAgeGroup30To44')
-        self.m_age_group_45to64 = PersonalAttribute(name='mAgeGroup45To64')
-        self.m_age_group_65plus = PersonalAttribute(name='mAgeGroup65Plus')
+        self.c_age_group_30to44 = ColumnAttribute(self.store.c_age_group_30to44, slot, name='cAgeGroup30To44')
+        self.c_age_group_45to64 = ColumnAttribute(self.store.c_age_group_45to64, slot, name='cAgeGroup45To64')
+        self.c_age_group_65plus = ColumnAttribute(self.store.c_age_group_65plus, slot, name='cAgeGroup65Plus')
+        self.m_age_group_30to44 = ColumnAttribute(self.store.m_age_group_30to44, slot, name='mAgeGroup30To44')
+        self.m_age_group_45to64 = ColumnAttribute(self.store.m_age_group_45to64, slot, name='mAgeGroup45To64')
+        self.m_age_group_65plus = ColumnAttribute(self.store.m_age_group_65plus, slot, name='mAgeGroup65Plus')
         
         # Always calculate age group dummies based on age - ignore any pre-calculated values
         self.c_age_group_30to44.set_value(1 if 30 <= age < 45 else 0)
@@ -115,7 +144,7 @@ class Person(MicroAgent):
         
         self.eCig_diff_subgroup=None
         self.prequit_addiction_strength=None
-        self.p_percentile = PersonalAttribute(name='pPercentile') 
+        self.p_percentile = ColumnAttribute(self.store.percentile, slot, name='pPercentile') 
         self.p_percentile.set_value(perc_num) 
         self.propensity_receive_GP_advice_attempt = propensity_receive_GP_advice_attempt
         self.propensity_NRT_attempt = propensity_NRT_attempt
@@ -129,52 +158,34 @@ class Person(MicroAgent):
             self.ecig_type=eCigType.Nondisp
         else:#ecig_use == 0
             self.ecig_type=None         
-        if regular_smoking_behaviour=='COMB':#if the regular smoking COMB model is used by the ABM, add its Level 2 attributes associated with the personal attributes to their lists
-            self.p_age.add_level2_attribute(reg_smoke_theory.level2_attributes['oAge'])
-            self.p_age.set_value(age)
-            self.p_difficulty_of_access = PersonalAttribute(name='pDifficultyofAccess')       
-            self.p_difficulty_of_access.add_level2_attribute(reg_smoke_theory.level2_attributes['oDifficultyofAccess'])
+        if regular_smoking_behaviour=='COMB':#if the regular smoking COMB model is used by the ABM, bind its Level 2 attributes associated with the personal attributes to the columns of the personal attributes
+            self.p_age.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oAge')
+            self.p_difficulty_of_access = ColumnAttribute(self.store.difficulty_of_access, slot, name='pDifficultyofAccess')       
+            self.p_difficulty_of_access.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oDifficultyofAccess')
             self.update_difficulty_of_access()
-            self.p_gender.add_level2_attribute(reg_smoke_theory.level2_attributes['mGender'])
-            self.p_gender.set_value(gender)
-            self.p_educational_level.add_level2_attribute(reg_smoke_theory.level2_attributes['oEducationalLevel'])
-            self.p_educational_level.set_value(educational_level)
-            self.p_sep.add_level2_attribute(reg_smoke_theory.level2_attributes['oSEP'])
-            self.p_sep.set_value(sep)
-            self.p_social_housing.add_level2_attribute(reg_smoke_theory.level2_attributes['oSocialHousing'])
-            self.p_social_housing.set_value(social_housing)
-            self.p_mental_health_conditions.add_level2_attribute(reg_smoke_theory.level2_attributes['cMentalHealthConditions'])
-            self.p_mental_health_conditions.set_value(mental_health_conds)
-            self.p_alcohol_consumption.add_level2_attribute(reg_smoke_theory.level2_attributes['cAlcoholConsumption'])
-            self.p_alcohol_consumption.set_value(alcohol)
-            self.p_ecig_use.add_level2_attribute(reg_smoke_theory.level2_attributes['cEcigaretteUse'])
-            self.p_ecig_use.set_value(ecig_use)
-            self.p_expenditure.add_level2_attribute(reg_smoke_theory.level2_attributes['oPerceivedCostPerStick'])
-            self.p_expenditure.set_value(expenditure)
-        if quitting_behaviour=='COMB':#if quit attempt COM-B model and quit maintenance COM-B model are used by this ABM, add their Level 2 attributes associated with the personal attributes to the personal attributes' lists
+            self.p_gender.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'mGender')
+            self.p_educational_level.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oEducationalLevel')
+            self.p_sep.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oSEP')
+            self.p_social_housing.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oSocialHousing')
+            self.p_mental_health_conditions.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'cMentalHealthConditions')
+            self.p_alcohol_consumption.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'cAlcoholConsumption')
+            self.p_ecig_use.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'cEcigaretteUse')
+            self.p_expenditure.bind_level2_attribute(reg_smoke_theory.level2_attributes, 'oPerceivedCostPerStick')
+        if quitting_behaviour=='COMB':#if quit attempt COM-B model and quit maintenance COM-B model are used by this ABM, bind their Level 2 attributes associated with the personal attributes to the columns of the personal attributes
             self.prequit_addiction_strength=quit_attempt_theory.level2_attributes['cCigAddictStrength'].get_value()
-            self.p_age.add_level2_attribute(quit_maintenance_theory.level2_attributes['cAge'])
-            self.p_age.add_level2_attribute(quit_attempt_theory.level2_attributes['mAge'])
-            self.p_age.set_value(age)
-            self.p_educational_level.add_level2_attribute(quit_maintenance_theory.level2_attributes['oEducationalLevel'])
-            self.p_educational_level.set_value(educational_level)
-            self.p_sep.add_level2_attribute(quit_maintenance_theory.level2_attributes['oSEP'])
-            self.p_sep.set_value(sep)
-            self.p_social_housing.add_level2_attribute(quit_attempt_theory.level2_attributes['oSocialHousing'])
-            self.p_social_housing.add_level2_attribute(quit_maintenance_theory.level2_attributes['oSocialHousing'])
-            self.p_social_housing.set_value(social_housing)
-            self.p_mental_health_conditions.add_level2_attribute(quit_maintenance_theory.level2_attributes['cMentalHealthConditions'])
-            self.p_mental_health_conditions.set_value(mental_health_conds)
-            self.p_alcohol_consumption.add_level2_attribute(quit_maintenance_theory.level2_attributes['cAlcoholConsumption'])
-            self.p_alcohol_consumption.set_value(alcohol)
-            self.p_ecig_use.add_level2_attribute(quit_maintenance_theory.level2_attributes['cEcigaretteUse'])
-            self.p_ecig_use.set_value(ecig_use)
-            self.p_prescription_nrt.add_level2_attribute(quit_maintenance_theory.level2_attributes['cPrescriptionNRT'])
-            self.p_prescription_nrt.set_value(prescription_nrt)
-            self.p_varenicline_use.add_level2_attribute(quit_maintenance_theory.level2_attributes['cVareniclineUse'])
-            self.p_varenicline_use.set_value(varenicline_use)
+            self.p_age.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cAge')
+            self.p_age.bind_level2_attribute(quit_attempt_theory.level2_attributes, 'mAge')
+            self.p_educational_level.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'oEducationalLevel')
+            self.p_sep.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'oSEP')
+            self.p_social_housing.bind_level2_attribute(quit_attempt_theory.level2_attributes, 'oSocialHousing')
+            self.p_social_housing.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'oSocialHousing')
+            self.p_mental_health_conditions.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cMentalHealthConditions')
+            self.p_alcohol_consumption.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cAlcoholConsumption')
+            self.p_ecig_use.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cEcigaretteUse')
+            self.p_prescription_nrt.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cPrescriptionNRT')
+            self.p_varenicline_use.bind_level2_attribute(quit_maintenance_theory.level2_attributes, 'cVareniclineUse')
             
-            # Link age group dummies to the COMB models
+            # Link age group dummies to the COMB models (their level 2 attributes keep the values of the data file until the dummies are updated)
             if 'mAgeGroup30To44' in quit_attempt_theory.level2_attributes:
                 self.m_age_group_30to44.add_level2_attribute(quit_attempt_theory.level2_attributes['mAgeGroup30To44'])
             if 'mAgeGroup45To64' in quit_attempt_theory.level2_attributes:
@@ -203,39 +214,44 @@ class Person(MicroAgent):
         if self.mediator is not None:
             self.mediator.mediate_situation(self,do_smoking_behaviour_mechanisms=do_smoking_behaviour_mechanisms)
 
-    def init_behaviour_buffer(self):
+    def init_behaviour_buffer(self, behaviour_buffer: int = None):
         """
         The behaviour buffer stores this agent's 'quit attempt behaviours' (1) and 'not quit attempt behaviours' (0) over the last 12 months
-        (12 ticks with each tick represents 1 month).
+        (12 ticks with each tick represents 1 month) in the 12 bits of an integer: bit i is the behaviour at the ith index of the buffer
+        with bit 0 the oldest behaviour and bit 11 the newest behaviour.
         The behaviour buffer is initialised at t=0 as follows:
         X: number of quit attempts in past 12 months
         1. Generate a random permutation of indices 0,...,11
         2. Take first X indices of the permutation
         3. Assign quit attempt behaviours (1s) to the X indices and 'not quit attempt behaviours (0s) to the other indices
+        input: behaviour_buffer, a behaviour buffer drawn by draw_behaviour_buffer before the agent is created or None to draw it
         """
-        self.behaviour_buffer = [0 for _ in range(0, 12)]#The behaviour buffer stores this agent's 'quit attempt behaviours' (1) and 'not quit attempt behaviours' (0) over the last 12 months
+        if behaviour_buffer is None:
+            behaviour_buffer = Person.draw_behaviour_buffer(self.b_number_of_recent_quit_attempts)
+        self.behaviour_buffer = behaviour_buffer
+
+    @staticmethod
+    def draw_behaviour_buffer(number_of_recent_quit_attempts):
+        '''draw a behaviour buffer with the given number of quit attempts in the past 12 months (see init_behaviour_buffer)'''
+        behaviour_buffer = 0
         perm = random.sample(range(12), 12)
         i=0
-        while i < self.b_number_of_recent_quit_attempts:
-              self.behaviour_buffer[perm[i]]=1
+        while i < number_of_recent_quit_attempts:
+              behaviour_buffer |= 1 << perm[i]
               i+=1
+        return behaviour_buffer
 
     def add_behaviour(self, behaviour: AgentBehaviour):
         if not isinstance(behaviour, AgentBehaviour):
             raise ValueError(f'{behaviour} is not an acceptable self behaviour')
-        elif behaviour == AgentBehaviour.QUITATTEMPT:
-            self.behaviour_buffer.append(1)
-        else:
-            self.behaviour_buffer.append(0)
+        elif behaviour == AgentBehaviour.QUITATTEMPT:#the newest behaviour (bit 11) is freed by delete_oldest_behaviour
+            self.behaviour_buffer |= NEWEST_BEHAVIOUR
 
     def delete_oldest_behaviour(self):
-        if len(self.behaviour_buffer) > 0:
-            del self.behaviour_buffer[0]
-        else:
-            raise ValueError('Attempting to delete a behaviour from an empty buffer')
+        self.behaviour_buffer >>= 1
 
     def count_quit_attempt_behaviour(self):
-        return sum(self.behaviour_buffer)
+        return int(POPCOUNT[self.behaviour_buffer])
 
     def update_ec_ig_use(self, eciguse: int):
         self.ecig_use = eciguse
@@ -243,27 +259,23 @@ class Person(MicroAgent):
     def set_state_of_next_time_step(self, state: AgentState):
         if not isinstance(state, AgentState):
             raise ValueError(f'{state} is not an acceptable self state')
-        self.b_states.append(state)
+        self.state_history.append(self.slot, state)
 
     def get_previous_state(self):
         if self.smoking_model.current_time_step > 0:
-            return self.b_states[self.smoking_model.get_current_time_step-1]
+            return self.state_history.get(self.slot, self.smoking_model.current_time_step-1)
         else:
-            return self.b_states[0]
+            return self.state_history.get(self.slot, 0)
         
     def get_current_state(self):  # get the self's state at the current time step
         current_time_step = self.smoking_model.current_time_step
         
-        # If current_time_step is beyond our state history, this is an error
-        if current_time_step >= len(self.b_states):
-            raise IndexError(f"Trying to access state at time step {current_time_step} but agent only has states up to {len(self.b_states)-1}")
-        
-        # Get the current state
-        current_state = self.b_states[current_time_step]
+        # Get the current state (IndexError if current_time_step is beyond our state history)
+        current_state = self.state_history.get(self.slot, current_time_step)
         
         # If the state is NA, this indicates we're trying to access a state before the agent's entry year
         # This shouldn't happen in normal operation
-        if current_state is pd.NA:
+        if current_state is None:
             raise ValueError(f"Accessing NA state at time step {current_time_step} for agent {self.get_id()}. This suggests trying to access state before agent's entry year.")
             
         return current_state
@@ -332,8 +344,8 @@ class Person(MicroAgent):
         res = ['self id: ' + str(self.get_id()) + '\n',
                'state: ' + self.get_current_state().name.lower() + '\n',
                'age: ' + str(self.p_age.get_value()) + '\n',
-               'behaviour: ' + self.behaviour_buffer[len(self.behaviour_buffer) - 1].name.lower() + '\n',
-               'behaviour buffer: ' + str([e.name.lower() for e in self.behaviour_buffer]) + '\n',
+               'behaviour: ' + ('quit attempt' if self.behaviour_buffer & NEWEST_BEHAVIOUR else 'not quit attempt') + '\n',
+               'behaviour buffer: ' + str([(self.behaviour_buffer >> i) & 1 for i in range(12)]) + '\n',
                'p_number_of_recent_quit_attempts: ' + str(self.p_number_of_recent_quit_attempts.get_value()) + '\n',
                'p_years_since_quit: ' + str(self.p_years_since_quit.get_value()) + '\n',
                'probability of behaviour: ' + str(prob_behaviour) + '\n',
@@ -0,0 +1,118 @@
+'''
+definition of the PopulationStore class which stores the attributes of all the agents in columns (NumPy arrays) i.e. a struct of arrays
+indexed by the slot of an agent (the row of the agent in the synthetic population file) and of the StoreColumn descriptor.
+A Person is a view over its slot of the store: its personal attributes (p_age, p_gender etc.), behavioural attributes (b_cig_consumption etc.),
+propensities and is_active are read from and written to the columns of the store, so the existing agent by agent code keeps working
+and the vectorised mechanisms can gather or update the attributes of all the agents with a NumPy indexing of the columns.
+'''
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+BEHAVIOUR_BUFFER_SIZE = 12 #the behaviour buffer of an agent stores its behaviours over the last 12 months (ticks)
+NEWEST_BEHAVIOUR = 1 << (BEHAVIOUR_BUFFER_SIZE - 1) #bit of the newest behaviour of the behaviour buffer
+POPCOUNT = np.array([bin(bits).count('1') for bits in range(1 << BEHAVIOUR_BUFFER_SIZE)], dtype=np.int64) #POPCOUNT[bits] = number of 1 bits of a behaviour buffer
+
+class PopulationStore:
+    #name of a column: (name of the column of the synthetic population file or None if the column is not in the file, dtype of the column)
+    #dtype None: the dtype of the column of the synthetic population file (the agents read the same values as from the file)
+    COLUMNS = {'entry_year': ('year', None),
+               'active': (None, np.bool_),
+               'age': ('pAge', None),
+               'gender': ('pGender', None),
+               'imd_quintile': ('pIMDquintile', None),
+               'cohort': ('pCohort', None),
+               'educational_level': ('pEducationalLevel', None),
+               'sep': ('pSEP', None),
+               'region': ('pRegion', None),
+               'social_housing': ('pSocialHousing', None),
+               'mental_health_conditions': ('pMentalHealthConditions', None),
+               'alcohol_consumption': ('pAlcoholConsumption', None),
+               'expenditure': ('pExpenditure', np.float64),
+               'prescription_nrt': ('pPrescriptionNRT', None),
+               'over_counter_nrt': ('pOverCounterNRT', None),
+               'use_of_nrt': ('pUseOfNRT', None),
+               'varenicline_use': ('pVareniclineUse', None),
+               'ecig_use': ('pECigUse', None),
+               'percentile': ('perc_num', None),
+               'difficulty_of_access': (None, np.int64),
+               'c_age_group_30to44': (None, np.int64),
+               'c_age_group_45to64': (None, np.int64),
+               'c_age_group_65plus': (None, np.int64),
+               'm_age_group_30to44': (None, np.int64),
+               'm_age_group_45to64': (None, np.int64),
+               'm_age_group_65plus': (None, np.int64),
+               'cig_consumption': ('bCigConsumption', np.float64),
+               'years_since_quit': ('bYearsSinceQuit', None),
+               'months_since_quit': ('bMonthsSinceQuit', None),
+               'number_of_recent_quit_attempts': ('bNumberOfRecentQuitAttempts', None),
+               'months_counter_ex_smoker': (None, np.int64),
+               'behaviour_buffer': (None, np.uint16),
+               'propensity_receive_GP_advice_attempt': (None, np.float64),
+               'propensity_NRT_attempt': (None, np.float64),
+               'propensity_NRT_maintenance': (None, np.float64),
+               'propensity_behaviour_support_maintenance': (None, np.float64),
+               'propensity_varenicline_maintenance': (None, np.float64),
+               'propensity_cytisine_maintenance': (None, np.float64)}
+
+    def __init__(self, size: int, columns: Dict[str, np.ndarray]):
+        self.size = size #number of slots (agents)
+        self.columns = columns #key=name of a column, value=NumPy array of the values of the agents indexed by slot
+        for name, column in columns.items():#the columns are also attributes of the store e.g. store.age
+            setattr(self, name, column)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame):
+        '''
+        create the store of the agents of the synthetic population with slot i = row i of the dataframe
+        input: df, dataframe of the synthetic population (missing values replaced with 0)
+        '''
+        size = len(df)
+        columns = {}
+        for name, (data_column, dtype) in cls.COLUMNS.items():
+            if data_column is not None:
+                columns[name] = df[data_column].to_numpy(dtype=dtype, copy=True)
+            else:
+                columns[name] = np.zeros(size, dtype=dtype)
+        return cls(size, columns)
+
+    def add_behaviours(self, slots: np.ndarray, quit_attempts: np.ndarray):
+        '''
+        vectorised delete_oldest_behaviour and add_behaviour of Person: shift out the oldest behaviour of the behaviour buffers of the agents
+        and add their new behaviours (quit attempt (1) or not quit attempt (0)) as the newest behaviours
+        input: slots, slots of the agents
+               quit_attempts, boolean array (True: the new behaviour of an agent is a quit attempt)
+        '''
+        buffers = self.behaviour_buffer[slots] >> 1
+        buffers[quit_attempts] |= NEWEST_BEHAVIOUR
+        self.behaviour_buffer[slots] = buffers
+
+    def count_quit_attempt_behaviours(self, slots: np.ndarray):
+        '''
+        vectorised count_quit_attempt_behaviour of Person
+        output: array of the numbers of quit attempts of the agents over the last 12 months
+        '''
+        return POPCOUNT[self.behaviour_buffer[slots]]
+
+    def update_number_of_recent_quit_attempts(self, slots: np.ndarray):
+        '''set bNumberOfRecentQuitAttempts of the agents to the numbers of quit attempts in their behaviour buffers'''
+        self.number_of_recent_quit_attempts[slots] = self.count_quit_attempt_behaviours(slots)
+
+    def nbytes(self):
+        '''memory of the columns in bytes'''
+        return sum(column.nbytes for column in self.columns.values())
+
+class StoreColumn:
+    '''
+    descriptor of an attribute of Person (e.g. b_cig_consumption) which is stored in a column of the PopulationStore of the agent at the slot of the agent
+    '''
+    def __init__(self, column: str):
+        self.column = column #name of the column
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        return agent.store.columns[self.column][agent.slot]
+
+    def __set__(self, agent, value):
+        agent.store.columns[self.column][agent.slot] = value
@@ -14,17 +14,24 @@ from typing import Dict
 from mpi4py.MPI import Intracomm
 from repast4py.context import SharedContext
 from repast4py.schedule import SharedScheduleRunner, init_schedule_runner
-from config.definitions import ROOT_DIR, AgentState, SubGroup, eCigDiffSubGroup, eCigType
+from config.definitions import ROOT_DIR, AgentState, SubGroup, eCigDiffSubGroup, eCigType, Theories
 from mbssm.model import Model
 import config.global_variables as g
 import os
 import random
 import gc
 # Import the SocialNetwork class
+from repast4py import random as repast_random
 from smokingcessation.social_network import SocialNetwork
+from smokingcessation.lookup_tables import ExogenousDynamicsCache, LookupMissCounter, compile_cig_consumption_table
+from smokingcessation.comb_formula import compile_comb_formula
+from smokingcessation.input_bundle import read_input_data_files, compile_lookup_tables, compile_regional_prevalence, load_input_bundle
 #import ipdb #python debugger https://wangchuan.github.io/coding/2017/07/12/ipdb-cheat-sheet.html#command-cheatsheet
 
 class SmokingModel(Model):
+    #columns of the population store of the propensities of the agents (in the order of draw_propensities)
+    PROPENSITY_COLUMNS = ('propensity_receive_GP_advice_attempt', 'propensity_NRT_attempt', 'propensity_NRT_maintenance',
+                          'propensity_behaviour_support_maintenance', 'propensity_varenicline_maintenance', 'propensity_cytisine_maintenance')
     
     def __init__(self, comm: Intracomm, params: Dict):
         super().__init__(comm, params)
@@ -47,26 +54,42 @@ class SmokingModel(Model):
         self.seed = self.props["seed"]
         self.fixed_agent_ids = self.props["fixed_agent_ids"]
         random.seed(self.seed) #set the random seed of ABM
+        self.rng = np.random.default_rng(self.seed) #random number generator of the vectorised mechanisms
+        self.vectorised_mechanisms = self.props.get("vectorised_mechanisms", False) #True: run the mechanisms of a group of agents in one NumPy pass per tick
+        self.lazy_agent_creation = self.props.get("lazy_agent_creation", False) #True: create the agents entering the population after the baseline year at the beginning of their entry years
+        self.compact_dead_agents = self.props.get("compact_dead_agents", False) #True: move the dead agents into an archive and remove them from the context and social network at the end of each year
+        self.dispatch_by_state = self.props.get("dispatch_by_state", False) #True: run the situation and action mechanisms of each theory over the agents in its states (a bucket of the state index) in one loop
         self.data_file: str = self.props["data_file"]  #the baseline synthetic population
         self.regionalSmokingPrevalenceFile = self.props["regional_prevalence"]
         self.regionalSmokingPrevalence=None 
-        self.readInRegionalPrevalence()
-        self.data = pd.read_csv(f'{ROOT_DIR}/' + self.data_file, encoding='ISO-8859-1')
+        self.compiled_input_bundle = self.props.get("compiled_input_bundle") #directory of the compiled input bundle (None: read in the CSV input data files)
+        #True: memory-map the lookup tables of the compiled input bundle read-only so that the replicates running on a node share one copy of the tables
+        self.mmap_input_bundle = self.props.get("mmap_input_bundle", False)
+        self.lookup_tables = {} #key=name of a lookup table e.g. relapse_prob, value=LookupTable
+        self.read_input_data()
         self.data = self.replace_missing_value_with_zero(self.data)
         self.level2_attributes_names = list(self.data.filter(regex='^[com]').columns)#get the level 2 attribute names from the data file
         self.difference_between_start_time_of_ABM_and_start_time_of_non_disp_diffusions = self.props['difference_between_start_time_of_ABM_and_start_time_of_non_disp_diffusions']
         self.difference_between_start_time_of_ABM_and_start_time_of_disp_diffusions = self.props['difference_between_start_time_of_ABM_and_start_time_of_disp_diffusions']        
         self.agents_to_kill=set() #unique ids of the agents to be killed after iteration through the population during situational mechanism
-        self.relapse_prob_file = f'{ROOT_DIR}/' + self.props["relapse_prob_file"]
-        self.relapse_prob = pd.read_csv(self.relapse_prob_file)
-        self.death_prob_file = f'{ROOT_DIR}/' + self.props["death_prob_file"]
-        self.death_prob = pd.read_csv(self.death_prob_file, encoding='ISO-8859-1')
-        self.attempt_exogenous_dynamics_file = f'{ROOT_DIR}/' + self.props["attempt_exogenous_dynamics_file"] 
-        self.attempt_exogenous_dynamics_data = pd.read_csv(self.attempt_exogenous_dynamics_file, encoding='ISO-8859-1') 
-        self.maintenance_exogenous_dynamics_file = f'{ROOT_DIR}/' + self.props["maintenance_exogenous_dynamics_file"] 
-        self.maintenance_exogenous_dynamics_data = pd.read_csv(self.maintenance_exogenous_dynamics_file, encoding='ISO-8859-1') 
-        self.cig_consumption_percentiles_file = f'{ROOT_DIR}/' + self.props["cig_consumption_percentiles_file"]
-        self.cig_consumption_percentiles_data = pd.read_csv(self.cig_consumption_percentiles_file, encoding='ISO-8859-1')
+        #STPM relapse probabilities indexed by (year, age, sex, imd_quintile, time_since_quit)
+        self.relapse_prob_table = self.lookup_tables['relapse_prob']
+        #smk.state codes of the death probabilities: the smokers group in stpm death model includes quitters as well as smokers 
+        self.death_smoking_states = {AgentState.SMOKER: 0, AgentState.NEWQUITTER: 0,
+                                     AgentState.ONGOINGQUITTER1: 0, AgentState.ONGOINGQUITTER2: 0, AgentState.ONGOINGQUITTER3: 0,
+                                     AgentState.ONGOINGQUITTER4: 0, AgentState.ONGOINGQUITTER5: 0, AgentState.ONGOINGQUITTER6: 0,
+                                     AgentState.ONGOINGQUITTER7: 0, AgentState.ONGOINGQUITTER8: 0, AgentState.ONGOINGQUITTER9: 0,
+                                     AgentState.ONGOINGQUITTER10: 0, AgentState.ONGOINGQUITTER11: 0,
+                                     AgentState.EXSMOKER: 1, AgentState.NEVERSMOKE: 2}
+        #death probabilities indexed by (year, smk.state, age, sex, imd_quintile) i.e. a death probabilities cube per year
+        self.death_prob_table = self.lookup_tables['death_prob']
+        #caches of the log odds of the quit attempt and quit maintenance exogenous dynamics of the current year with key=(age, sex, social grade)
+        self.attempt_exogenous_dynamics_cache = ExogenousDynamicsCache(self.lookup_tables['attempt_exogenous_dynamics'])
+        self.maintenance_exogenous_dynamics_cache = ExogenousDynamicsCache(self.lookup_tables['maintenance_exogenous_dynamics'])
+        #counts of the lookups with no matching row in the lookup tables per year (output to lookup_misses.csv at the end of the simulation)
+        self.lookup_misses = LookupMissCounter()
+        self.lookup_misses.add_table('attempt_exogenous_dynamics', ['age', 'sex', 'social grade'])
+        self.lookup_misses.add_table('maintenance_exogenous_dynamics', ['age', 'sex', 'social grade'])
         self.sigma_propensity_GP_advice_attempt = self.props["sigma_propensity_GP_advice_attempt"]
         self.sigma_propensity_NRT_attempt = self.props["sigma_propensity_NRT_attempt"]
         self.sigma_propensity_NRT_maintenance = self.props["sigma_propensity_NRT_maintenance"]
@@ -81,6 +104,9 @@ class SmokingModel(Model):
         self.start_year_tick = 1 #tick of January of the current year
         self.end_year_tick = 12 #tick of December of the current year
         self.stop_at: int = self.props["stop.at"]  # final time step (tick) of simulation
+        #bCigConsumption indexed by (year, age, sex, pSEP, perc_num) up to the year of the final tick
+        self.cig_consumption_table = compile_cig_consumption_table(self.lookup_tables['cig_consumption'], self.lookup_tables.get('cig_consumption_trend'),
+                                                                   int(self.props["year_of_baseline"]) + (int(self.stop_at) - 1) // 12)
         self.tickInterval = self.props["tickInterval"] #time length of a tick (1 month) in weeks
         if self.running_mode == 'debug':
             print('tickInterval: ',self.tickInterval)
@@ -99,16 +125,24 @@ class SmokingModel(Model):
         self.store_level2_attributes_of_comb_formulae_into_maps()
         self.regular_smoking_behaviour = self.props['regular_smoking_behaviour'] #COMB or STPM
         self.quitting_behaviour = self.props['quitting_behaviour'] #COMB or STPM
+        #COM-B formulae of the COM-B theories validated and compiled once (key=name of a COM-B theory, value=FormulaPlan)
+        self.comb_formula_plans = {}
+        if self.regular_smoking_behaviour=='COMB':
+            self.comb_formula_plans[Theories.REGSMOKE] = compile_comb_formula('uptake', self.uptake_betas, self.level2_attributes_of_uptake_formula,
+                                                                              self.level2_attributes_names, self.data_file)
+        if self.quitting_behaviour=='COMB':
+            self.comb_formula_plans[Theories.QUITATTEMPT] = compile_comb_formula('attempt', self.attempt_betas, self.level2_attributes_of_attempt_formula,
+                                                                                 self.level2_attributes_names, self.data_file)
+            self.comb_formula_plans[Theories.QUITMAINTENANCE] = compile_comb_formula('maintenance', self.maintenance_betas, self.level2_attributes_of_maintenance_formula,
+                                                                                     self.level2_attributes_names, self.data_file)
         if self.regular_smoking_behaviour=='STPM':
-            self.initiation_prob_file = f'{ROOT_DIR}/' + self.props["initiation_prob_file"]
-            self.initiation_prob = pd.read_csv(self.initiation_prob_file) 
+            self.initiation_prob_table = self.lookup_tables['initiation_prob'] #STPM initiation probabilities indexed by (year, age, sex, imd_quintile)
         elif self.regular_smoking_behaviour=='COMB':
             pass
         else:
             raise ValueError(f'invalid regular smoking behaviour: {self.regular_smoking_behaviour}\nvalid behaviour model: COMB or STPM')
         if self.quitting_behaviour=='STPM':
-            self.quit_prob_file = f'{ROOT_DIR}/' + self.props["quit_prob_file"]
-            self.quit_prob = pd.read_csv(self.quit_prob_file)   
+            self.quit_prob_table = self.lookup_tables['quit_prob'] #STPM quit probabilities indexed by (year, age, sex, imd_quintile)
         elif self.quitting_behaviour=='COMB':
             pass
         else:
@@ -149,6 +183,9 @@ class SmokingModel(Model):
                             eCigDiffSubGroup.Smoker_over1991:[],
                             eCigDiffSubGroup.Neversmoked_over1991:[]}
             
+        self.lookup_coverage_check = self.props.get("lookup_coverage_check", True) #True: check the coverage of the lookup tables at startup
+        if self.lookup_coverage_check:
+            self.check_lookup_coverage()
         # Create social network object (just the object, not the connections yet)
         self.social_network = SocialNetwork(self)
         # Get fixed agent IDs from config, with default if not specified
@@ -162,15 +199,49 @@ class SmokingModel(Model):
         from datetime import datetime
         self.formatted_month = datetime(year, month, 1).strftime("%b-%y")
     
-    def readInRegionalPrevalence(self):
+    def read_input_data(self):
         '''
-        read in the regional smoking prevalences between 2011 and 2019 into a dataframe
+        read in the synthetic population, the regional smoking prevalences between 2011 and 2019 and the lookup tables
+        from the compiled input bundle if compiled_input_bundle is given in model.yaml (no parsing of CSV files) 
+        or else from the CSV input data files.
+        The regional smoking prevalences are stored in a matrix with rows=months (Jan-11,...,Dec-19) and columns=regions (1 to 9); NaN if a prevalence is missing.
         '''
-        df=pd.read_csv(f'{ROOT_DIR}/' + self.regionalSmokingPrevalenceFile, encoding='ISO-8859-1')
-        pattern = r"^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-1[1-9]$"#match months: Jan-11,Feb-11,...,Dec-19
-        self.regionalSmokingPrevalence = df[df["month"].str.match(pattern, na=False)]
-        self.regionalSmokingPrevalence = self.regionalSmokingPrevalence[['month','region','prevalence']]
+        if self.compiled_input_bundle is not None:
+            bundle = load_input_bundle(f'{ROOT_DIR}/' + self.compiled_input_bundle, mmap_mode='r' if self.mmap_input_bundle else None)
+            self.data = bundle['population']
+            self.lookup_tables = bundle['tables']
+            months = bundle['regional_prevalence_months']
+            self.regionalSmokingPrevalenceMatrix = bundle['regional_prevalence_matrix']
+        else:
+            data = read_input_data_files(self.props,
+                                         initiation=self.props['regular_smoking_behaviour']=='STPM',
+                                         quit=self.props['quitting_behaviour']=='STPM')
+            self.data = data['population']
+            self.lookup_tables = compile_lookup_tables(data)
+            months, self.regionalSmokingPrevalenceMatrix = compile_regional_prevalence(data['regional_prevalence'])
+        self.regionalSmokingPrevalenceMonths = {month: i for i, month in enumerate(months)} #key=month e.g. Jan-11, value=row of the month in the matrix
      
+    def check_lookup_coverage(self):
+        '''
+        before any tick runs, check that the lookup tables (death probabilities, STPM probabilities, exogenous dynamics, cigarette consumption and
+        regional smoking prevalences) have a row for every key of the synthetic population between year_of_baseline and the year of the final tick.
+        The uncovered keys are saved in the file lookup_coverage.csv and summarised per table.
+        A missing regional smoking prevalence would stop the simulation, so it stops the ABM at startup.
+        '''
+        from smokingcessation.lookup_coverage import check_lookup_coverage
+        year_of_baseline = int(self.props["year_of_baseline"])
+        final_year = year_of_baseline + (int(self.stop_at) - 1) // 12 #year of the final tick
+        uncovered, fatal = check_lookup_coverage(self, year_of_baseline, final_year)
+        uncovered.to_csv(f'{ROOT_DIR}/output/lookup_coverage.csv', index=False)
+        for table, count in uncovered.groupby('table', sort=False).size().items():
+            sstr = f'lookup coverage: {count} keys of the synthetic population between {year_of_baseline} and {final_year} have no matching row in {table}'
+            print(sstr)
+            if self.running_mode == 'debug':
+                self.logfile.write(sstr + '\n')
+        if len(fatal) > 0:
+            raise ValueError('missing regional smoking prevalences (see lookup_coverage.csv):\n' + '\n'.join(fatal[:10]) +
+                             (f'\n... and {len(fatal) - 10} more' if len(fatal) > 10 else ''))
+
     def init_geographic_regional_prevalence(self):
         '''
         initialze GeographicSmokingPrevalence macro entity
@@ -474,9 +545,13 @@ class SmokingModel(Model):
     def init_agents(self):
         '''initialise the baseline agent population at tick 0'''
         from smokingcessation.smoking_theory_mediator import SmokingTheoryMediator, Theories
-        from smokingcessation.comb_theory import RegSmokeTheory, QuitAttemptTheory, QuitMaintenanceTheory
         from smokingcessation.stpm_theory import DemographicsSTPMTheory, RelapseSTPMTheory, InitiationSTPMTheory, QuitSTPMTheory
-        from smokingcessation.person import Person
+        from smokingcessation.population_store import PopulationStore
+        from smokingcessation.state_history import StateHistory
+        from smokingcessation.agent_archive import AgentArchive
+        from smokingcessation.active_agents import ActiveAgents, StateIndex
+        from smokingcessation.comb_theory import COMBEngine
+        from smokingcessation.level2_table import Level2Table
 
         # Load all potential agents from the data file, not just the baseline year
         # the name baseline_agents is kept for consistency with the original code though it really is all agents
@@ -487,11 +562,49 @@ class SmokingModel(Model):
             
         if self.running_mode == 'debug':
             self.logfile.write(f"Loading {r} potential agents from data file\n")
+        #columnar store of the attributes of all the agents (slot i = row i of the data file)
+        self.population_store = PopulationStore.from_dataframe(baseline_agents)
+        #states of all the agents over the ticks (state_history: full) or over the previous, current and next time steps (state_history: current)
+        state_history = self.props.get("state_history", "full")
+        if state_history not in ("full", "current"):
+            raise ValueError(f"state_history: {state_history} is not 'full' or 'current'.")
+        self.state_history = StateHistory(r, int(self.stop_at), full_history=(state_history == "full"))
+        self.deferred_slots = {} #lazy agent creation: key=entry year, value=list of the slots (rows) of the deferred agents entering the population in the year
+        self.deferred_agent_ids = set() #ids of the deferred agents which are not created yet
+        self.dead_agents = AgentArchive() #the dead agents removed from the context (compact_dead_agents: True)
+        self.active_agents = ActiveAgents(self.population_store) #registry of the active agents of the context
+        self.state_index = StateIndex(self.active_agents, self.state_history) #the active agents grouped by their current states (updated at the beginning of each tick)
+        #vectorised COM-B formulae of the COM-B theories (vectorised_mechanisms: True)
+        self.comb_engine = COMBEngine(self) if self.vectorised_mechanisms and len(self.comb_formula_plans) > 0 else None
+        #level 2 attributes of all the agents in columns (row i = slot i) which the COM-B theories of the agents are created from
+        self.level2_table = Level2Table(self.data, self.level2_attributes_names) if len(self.comb_formula_plans) > 0 else None
+        #entry year buckets: key=entry year after the baseline year, value=array of the slots of the agents entering the population in the year (in the order of the rows)
+        entry_years = self.population_store.entry_year
+        self.entry_year_slots = {int(year): np.flatnonzero(entry_years == year) for year in np.unique(entry_years[entry_years > self.year_of_current_time_step])}
             
+        #the STPM theories have no state of an agent (prob_behaviour and threshold are scratch values of the agent being run),
+        #so one instance of each STPM theory is shared by all the agents
+        #relapse theory and demographics theory are also used by the vectorised relapse mechanism of all the ex-smokers and the vectorised December mortality and ageing
+        self.relapse_stpm_theory = RelapseSTPMTheory(Theories.RELAPSESSTPM, self)
+        self.demographics_stpm_theory = DemographicsSTPMTheory(Theories.DemographicsSTPM, self)
+
         # Track how many of each theory type we create
         rsmoke_theories = 0
         qattempt_theories = 0
         qmaintenance_theories = 0
+        if self.regular_smoking_behaviour!='COMB':#STPM
+            self.initiation_stpm_theory = InitiationSTPMTheory(Theories.REGSMOKE, self)
+            rsmoke_theories += 1
+        if self.quitting_behaviour!='COMB':#STPM
+            self.quit_attempt_stpm_theory = QuitSTPMTheory(Theories.QUITATTEMPT, self)
+            qattempt_theories += 1
+            self.quit_maintenance_stpm_theory = QuitSTPMTheory(Theories.QUITMAINTENANCE, self)
+            qmaintenance_theories += 1
+        #the agents share a mediator if all their theories are shared (STPM regular smoking and STPM quitting)
+        self.shared_mediator = None
+        if self.regular_smoking_behaviour!='COMB' and self.quitting_behaviour!='COMB':
+            self.shared_mediator = SmokingTheoryMediator([self.initiation_stpm_theory, self.quit_attempt_stpm_theory, self.quit_maintenance_stpm_theory,
+                                                     self.relapse_stpm_theory, self.demographics_stpm_theory])
             
         for i in range(r):
             subgroup = None
@@ -593,83 +706,20 @@ class SmokingModel(Model):
                     subgroup=SubGroup.ONGOINGQUITTERFEMALE                        
             else:
                 raise ValueError(f'{init_state} is not an acceptable agent state')
+            if self.lazy_agent_creation and entry_year > self.year_of_current_time_step:
+                #keep the row as a compact record (its slot of the population store and state history) until its entry year is activated
+                self.defer_agent(i, agent_id, entry_year, states)
+                continue
+            agent = self.create_agent(i, states)
             if self.regular_smoking_behaviour=='COMB':
-                rsmoke_theory = RegSmokeTheory(Theories.REGSMOKE, self, i)
                 rsmoke_theories += 1
-            else:#STPM
-                rsmoke_theory = InitiationSTPMTheory(Theories.REGSMOKE, self)
             if self.quitting_behaviour=='COMB':
-                qattempt_theory = QuitAttemptTheory(Theories.QUITATTEMPT, self, i)
-                qattempt_theories += 1
-                qmaintenance_theory = QuitMaintenanceTheory(Theories.QUITMAINTENANCE, self, i)
-                qmaintenance_theories += 1
-            else:#STPM
-                qattempt_theory = QuitSTPMTheory(Theories.QUITATTEMPT, self)
                 qattempt_theories += 1
-                qmaintenance_theory = QuitSTPMTheory(Theories.QUITMAINTENANCE, self)
                 qmaintenance_theories += 1
-            relapse_stpm_theory = RelapseSTPMTheory(Theories.RELAPSESSTPM, self)
-            demographics_theory = DemographicsSTPMTheory(Theories.DemographicsSTPM, self)
-            
-            # Create the agent
-            agent = Person(
-                    self,
-                    agent_id,  # Use the actual agent ID from the data file
-                    self.type,
-                    self.rank,
-                    age=baseline_agents.at[i, 'pAge'],
-                    gender=baseline_agents.at[i, 'pGender'],
-                    cohort=baseline_agents.at[i, 'pCohort'],
-                    qimd=baseline_agents.at[i, 'pIMDquintile'],
-                    educational_level=baseline_agents.at[i, 'pEducationalLevel'],
-                    sep=baseline_agents.at[i, 'pSEP'],
-                    region=baseline_agents.at[i, 'pRegion'],
-                    social_housing=baseline_agents.at[i, 'pSocialHousing'],
-                    mental_health_conds=baseline_agents.at[i, 'pMentalHealthConditions'],
-                    alcohol=baseline_agents.at[i, 'pAlcoholConsumption'],
-                    expenditure=baseline_agents.at[i, 'pExpenditure'],
-                    prescription_nrt=baseline_agents.at[i, 'pPrescriptionNRT'],
-                    over_counter_nrt=baseline_agents.at[i, 'pOverCounterNRT'],
-                    use_of_nrt=baseline_agents.at[i, 'pUseOfNRT'],
-                    ecig_use=baseline_agents.at[i, 'pECigUse'],
-                    ecig_type=baseline_agents.at[i, 'pECigType'],                    
-                    varenicline_use=baseline_agents.at[i, 'pVareniclineUse'],
-                    cig_consumption=baseline_agents.at[i, 'bCigConsumption'],
-                    years_since_quit=baseline_agents.at[i, 'bYearsSinceQuit'],# number of years since quit smoking for an ex-smoker, None for quitter, never_smoker and smoker
-                    number_of_recent_quit_attempts=baseline_agents.at[i, 'bNumberOfRecentQuitAttempts'],
-                    months_since_quit=baseline_agents.at[i, 'bMonthsSinceQuit'],
-                    perc_num=baseline_agents.at[i,"perc_num"],
-                    states=states,
-                    propensity_receive_GP_advice_attempt=np.random.normal(0,self.sigma_propensity_GP_advice_attempt),
-                    propensity_NRT_attempt=np.random.normal(0,self.sigma_propensity_NRT_attempt),
-                    propensity_NRT_maintenance = np.random.normal(0,self.sigma_propensity_NRT_maintenance),
-                    propensity_behaviour_support_maintenance = np.random.normal(0,self.sigma_propensity_behaviour_support_maintenance),
-                    propensity_varenicline_maintenance = np.random.normal(0,self.sigma_propensity_varenicline_maintenance),
-                    propensity_cytisine_maintenance = np.random.normal(0,self.sigma_propensity_cytisine_maintenance),                    
-                    reg_smoke_theory=rsmoke_theory,
-                    quit_attempt_theory=qattempt_theory,
-                    quit_maintenance_theory=qmaintenance_theory,
-                    regular_smoking_behaviour=self.regular_smoking_behaviour,
-                    quitting_behaviour=self.quitting_behaviour,
-                    entry_year=entry_year  # Pass the entry year to the agent
-            )
-                    
-            # Add the agent to the context
-            self.context.add(agent)
-            
-            # Set up the theories as direct attributes on the agent
-            agent = self.context.agent((agent_id, self.type, self.rank))
-            # Set theories as direct attributes on the agent object
-            agent.quit_attempt_theory = qattempt_theory
-            agent.quit_maintenance_theory = qmaintenance_theory
-            
-            # Set up the mediator
-            mediator = SmokingTheoryMediator([rsmoke_theory, qattempt_theory, qmaintenance_theory, relapse_stpm_theory, demographics_theory])
-            agent.set_mediator(mediator)
             
             # Activate the agent if it's from the baseline year
             if entry_year == self.year_of_current_time_step:
-                agent.is_active = True
+                self.active_agents.activate(agent)
                 self.population_counts[subgroup] += 1
         
         self.size_of_population = self.get_size_of_population()
@@ -677,12 +727,152 @@ class SmokingModel(Model):
         # At the end of the method, after all agents are created
         if self.running_mode == 'debug':
             # Count active agents for logging
-            active_agents = sum(1 for agent in self.context.agents() if agent.is_active)
-            self.logfile.write(f"Created {r} agents, {active_agents} active for baseline year {self.year_of_current_time_step}\n")
+            self.logfile.write(f"Created {r - len(self.deferred_agent_ids)} agents, {len(self.active_agents)} active for baseline year {self.year_of_current_time_step}\n")
+            if self.lazy_agent_creation:
+                self.logfile.write(f"Deferred {len(self.deferred_agent_ids)} agents entering the population after the baseline year\n")
             self.logfile.write(f"Created {rsmoke_theories} regular smoking theories\n")
             self.logfile.write(f"Created {qattempt_theories} quit attempt theories\n")
             self.logfile.write(f"Created {qmaintenance_theories} quit maintenance theories\n")
 
+    def draw_propensities(self):
+        '''draw the propensities of an agent (GP advice attempt, NRT attempt, NRT maintenance, behaviour support maintenance, varenicline maintenance and cytisine maintenance)'''
+        return [np.random.normal(0,self.sigma_propensity_GP_advice_attempt),
+                np.random.normal(0,self.sigma_propensity_NRT_attempt),
+                np.random.normal(0,self.sigma_propensity_NRT_maintenance),
+                np.random.normal(0,self.sigma_propensity_behaviour_support_maintenance),
+                np.random.normal(0,self.sigma_propensity_varenicline_maintenance),
+                np.random.normal(0,self.sigma_propensity_cytisine_maintenance)]
+
+    def create_agent(self, i: int, states, deferred=False):
+        '''
+        create the agent of row i of the synthetic population (slot i of the population store) with its theories and mediator and add it to the context
+        input: i, row of the agent
+               states, states of the agent at time steps 0 and 1
+               deferred, True: the agent is a deferred row (lazy agent creation) whose propensities and behaviour buffer were drawn by defer_agent
+        output: the agent
+        '''
+        from smokingcessation.smoking_theory_mediator import SmokingTheoryMediator, Theories
+        from smokingcessation.comb_theory import RegSmokeTheory, QuitAttemptTheory, QuitMaintenanceTheory
+        from smokingcessation.person import Person
+        baseline_agents = self.data
+        agent_id = baseline_agents.at[i, 'agentID']
+        entry_year = baseline_agents.at[i, 'year']
+        if deferred:
+            propensities = [self.population_store.columns[col][i] for col in self.PROPENSITY_COLUMNS]
+            behaviour_buffer = int(self.population_store.behaviour_buffer[i])
+        else:
+            propensities = self.draw_propensities()
+            behaviour_buffer = None
+        if self.regular_smoking_behaviour=='COMB':
+            rsmoke_theory = RegSmokeTheory(Theories.REGSMOKE, self, i)
+        else:#STPM
+            rsmoke_theory = self.initiation_stpm_theory
+        if self.quitting_behaviour=='COMB':
+            qattempt_theory = QuitAttemptTheory(Theories.QUITATTEMPT, self, i)
+            qmaintenance_theory = QuitMaintenanceTheory(Theories.QUITMAINTENANCE, self, i)
+        else:#STPM
+            qattempt_theory = self.quit_attempt_stpm_theory
+            qmaintenance_theory = self.quit_maintenance_stpm_theory
+        
+        # Create the agent
+        agent = Person(
+                self,
+                agent_id,  # Use the actual agent ID from the data file
+                self.type,
+                self.rank,
+                slot=i,
+                age=baseline_agents.at[i, 'pAge'],
+                gender=baseline_agents.at[i, 'pGender'],
+                cohort=baseline_agents.at[i, 'pCohort'],
+                qimd=baseline_agents.at[i, 'pIMDquintile'],
+                educational_level=baseline_agents.at[i, 'pEducationalLevel'],
+                sep=baseline_agents.at[i, 'pSEP'],
+                region=baseline_agents.at[i, 'pRegion'],
+                social_housing=baseline_agents.at[i, 'pSocialHousing'],
+                mental_health_conds=baseline_agents.at[i, 'pMentalHealthConditions'],
+                alcohol=baseline_agents.at[i, 'pAlcoholConsumption'],
+                expenditure=baseline_agents.at[i, 'pExpenditure'],
+                prescription_nrt=baseline_agents.at[i, 'pPrescriptionNRT'],
+                over_counter_nrt=baseline_agents.at[i, 'pOverCounterNRT'],
+                use_of_nrt=baseline_agents.at[i, 'pUseOfNRT'],
+                ecig_use=baseline_agents.at[i, 'pECigUse'],
+                ecig_type=baseline_agents.at[i, 'pECigType'],                    
+                varenicline_use=baseline_agents.at[i, 'pVareniclineUse'],
+                cig_consumption=baseline_agents.at[i, 'bCigConsumption'],
+                years_since_quit=baseline_agents.at[i, 'bYearsSinceQuit'],# number of years since quit smoking for an ex-smoker, None for quitter, never_smoker and smoker
+                number_of_recent_quit_attempts=baseline_agents.at[i, 'bNumberOfRecentQuitAttempts'],
+                months_since_quit=baseline_agents.at[i, 'bMonthsSinceQuit'],
+                perc_num=baseline_agents.at[i,"perc_num"],
+                states=states,
+                propensity_receive_GP_advice_attempt=propensities[0],
+                propensity_NRT_attempt=propensities[1],
+                propensity_NRT_maintenance = propensities[2],
+                propensity_behaviour_support_maintenance = propensities[3],
+                propensity_varenicline_maintenance = propensities[4],
+                propensity_cytisine_maintenance = propensities[5],
+                reg_smoke_theory=rsmoke_theory,
+                quit_attempt_theory=qattempt_theory,
+                quit_maintenance_theory=qmaintenance_theory,
+                regular_smoking_behaviour=self.regular_smoking_behaviour,
+                quitting_behaviour=self.quitting_behaviour,
+                entry_year=entry_year,  # Pass the entry year to the agent
+                behaviour_buffer=behaviour_buffer
+        )
+                
+        # Add the agent to the context
+        self.context.add(agent)
+        self.active_agents.register(agent)
+        
+        # Set up the theories as direct attributes on the agent
+        agent = self.context.agent((agent_id, self.type, self.rank))
+        # Set theories as direct attributes on the agent object
+        agent.quit_attempt_theory = qattempt_theory
+        agent.quit_maintenance_theory = qmaintenance_theory
+        
+        # Set up the mediator
+        if self.shared_mediator is not None:
+            agent.set_mediator(self.shared_mediator)
+        else:
+            mediator = SmokingTheoryMediator([rsmoke_theory, qattempt_theory, qmaintenance_theory, self.relapse_stpm_theory, self.demographics_stpm_theory])
+            agent.set_mediator(mediator)
+        return agent
+
+    def defer_agent(self, i: int, agent_id, entry_year: int, states):
+        '''
+        lazy agent creation: keep row i of the synthetic population as a compact record instead of creating its agent.
+        The random numbers of the agent (propensities and behaviour buffer) are drawn now in the order of the rows so that
+        the agent is the same as an agent created at initialisation, and its states are recorded in the state history.
+        The agent is created by materialise_agents at the beginning of its entry year.
+        '''
+        from smokingcessation.person import Person
+        for col, propensity in zip(self.PROPENSITY_COLUMNS, self.draw_propensities()):
+            self.population_store.columns[col][i] = propensity
+        self.population_store.behaviour_buffer[i] = Person.draw_behaviour_buffer(self.population_store.number_of_recent_quit_attempts[i])
+        self.state_history.set_states(i, states)
+        self.deferred_slots.setdefault(entry_year, []).append(i)
+        self.deferred_agent_ids.add(agent_id)
+
+    def materialise_agents(self):
+        '''
+        lazy agent creation: create the deferred agents whose entry year is the current year and add them to the social network
+        (their edges to the agents created before them are resolved now)
+        output: number of agents created
+        '''
+        slots = self.deferred_slots.pop(self.year_of_current_time_step, [])
+        for i in slots:
+            agent = self.create_agent(i, [self.state_history.get(i, 0), self.state_history.get(i, 1)], deferred=True)
+            self.deferred_agent_ids.discard(agent.get_id())
+            if "network_file" in self.props:
+                self.social_network.add_agent(agent)
+            if self.social_network is not None and self.social_network.network is not None:
+                if hasattr(agent, 'quit_attempt_theory'):
+                    agent.quit_attempt_theory.network = self.social_network
+                if hasattr(agent, 'quit_maintenance_theory'):
+                    agent.quit_maintenance_theory.network = self.social_network
+        if self.running_mode == 'debug':
+            self.logfile.write(f"Created {len(slots)} deferred agents with entry_year={self.year_of_current_time_step}\n")
+        return len(slots)
+
     def init_population_counts(self):
         subgroupsL=[SubGroup.NEVERSMOKERFEMALE,SubGroup.NEVERSMOKERMALE,SubGroup.SMOKERFEMALE,SubGroup.SMOKERMALE,\
                        SubGroup.EXSMOKERFEMALE,SubGroup.EXSMOKERMALE,SubGroup.NEWQUITTERFEMALE,SubGroup.NEWQUITTERMALE,\
@@ -692,7 +882,7 @@ class SmokingModel(Model):
 
     def get_size_of_population(self):#get the size of the current population
         # Count only active agents rather than all agents in the context
-        return sum(1 for agent in self.context.agents() if agent.is_active)
+        return len(self.active_agents)
 
     def init_population(self):
         self.months_counter = 0
@@ -820,9 +1010,8 @@ class SmokingModel(Model):
         return c
  
     def set_ecig_diffusion_subgroups_of_agents(self,shuffle_population=False):
-        for agent in self.context.agents(agent_type=self.type,shuffle=shuffle_population):    
-            if agent.is_active:  # Only process active agents
-                agent.set_ecig_diffusion_subgroup_of_agent()
+        for agent in self.active_agents.agents_of_context(shuffle=shuffle_population):  # Only process active agents
+            agent.set_ecig_diffusion_subgroup_of_agent()
 
     def do_transformational_mechanisms(self):
         '''
@@ -873,22 +1062,60 @@ class SmokingModel(Model):
         if do_smoking_behaviour_mechanisms = False, do situational mechanism of DemographicsSTPMTheory i.e. if December, at the end of the year, add agents to the agents_to_kill set, deactivate them, and increase the ages of the surviving ones etc.
         '''
         if count_population_subgroups:  # count population subgroups only
-            for agent in self.context.agents(agent_type=self.type):
-                if agent.is_active:  # Only process active agents
-                    agent.count_agent_for_initiation_subgroups_by_ages_sex()
-                    agent.count_agent_for_initiation_subgroups_by_ages_imd()
-                    agent.count_agent_for_quit_subgroups_by_ages_sex()
-                    agent.count_agent_for_quit_subgroups_by_ages_imd() 
+            for agent in self.active_agents.agents_of_context():  # Only process active agents
+                agent.count_agent_for_initiation_subgroups_by_ages_sex()
+                agent.count_agent_for_initiation_subgroups_by_ages_imd()
+                agent.count_agent_for_quit_subgroups_by_ages_sex()
+                agent.count_agent_for_quit_subgroups_by_ages_imd()
+        elif self.dispatch_by_state and do_smoking_behaviour_mechanisms:#run the situation mechanism of each theory over the agents in its states
+            from smokingcessation.smoking_theory_mediator import states_of_theory
+            for theory_name in (Theories.REGSMOKE, Theories.QUITATTEMPT, Theories.QUITMAINTENANCE, Theories.RELAPSESSTPM):
+                for agent in self.state_index.agents_of(states_of_theory(theory_name)):
+                    agent.mediator.theory_map[theory_name].do_situation(agent)
+        elif self.vectorised_mechanisms and not do_smoking_behaviour_mechanisms:#do mortality and ageing of all the agents in one NumPy pass in December
+            if self.months_counter == 12:
+                self.demographics_stpm_theory.do_situation_of_agents(self.active_agents.agents_of_context())
         else:#do situational mechanisms of agents only
-            for agent in self.context.agents(agent_type=self.type):
-                if agent.is_active:  # Only process active agents
-                    agent.do_situation(do_smoking_behaviour_mechanisms=do_smoking_behaviour_mechanisms)
+            for agent in self.active_agents.agents_of_context():  # Only process active agents
+                agent.do_situation(do_smoking_behaviour_mechanisms=do_smoking_behaviour_mechanisms)
+        if do_smoking_behaviour_mechanisms and not count_population_subgroups and self.comb_engine is not None:
+            #sample the treatments of all the smokers and new quitters in one pass
+            self.comb_engine.do_treatment_uptake()
         # No longer calling kill_agents here
         return 0
 
     def do_action_mechanisms(self,shuffle_population=False):  
-        for agent in self.context.agents(agent_type=self.type,shuffle=shuffle_population):
-            if agent.is_active:  # Only process active agents
+        if self.dispatch_by_state:#run the action mechanism of each theory over the agents in its states
+            from smokingcessation.smoking_theory_mediator import states_of_theory
+            for theory_name in (Theories.REGSMOKE, Theories.QUITATTEMPT, Theories.QUITMAINTENANCE, Theories.RELAPSESSTPM):
+                agents = self.state_index.agents_of(states_of_theory(theory_name))
+                if shuffle_population:
+                    repast_random.default_rng.shuffle(agents)
+                if theory_name == Theories.RELAPSESSTPM and self.vectorised_mechanisms:
+                    self.relapse_stpm_theory.do_action_of_agents(agents)
+                elif self.comb_engine is not None and theory_name in self.comb_engine.formulae:
+                    self.comb_engine.do_action_of_agents(theory_name, agents)
+                else:
+                    for agent in agents:
+                        agent.mediator.theory_map[theory_name].do_action(agent)
+        elif self.vectorised_mechanisms:
+            exsmokers = [] #the ex-smokers run the vectorised relapse mechanism after the other agents have run their action mechanisms
+            comb_agents = {} #key=name of a COM-B theory, value=agents running the vectorised COM-B formula of the theory after the other agents have run their action mechanisms
+            for agent in self.active_agents.agents_of_context(shuffle=shuffle_population):  # Only process active agents
+                state = agent.get_current_state()
+                if state == AgentState.EXSMOKER:
+                    exsmokers.append(agent)
+                    continue
+                theory_name = agent.mediator.get_theory_of_state(state).name
+                if self.comb_engine is not None and theory_name in self.comb_engine.formulae:
+                    comb_agents.setdefault(theory_name, []).append(agent)
+                else:
+                    agent.do_action()
+            for theory_name, agents in comb_agents.items():
+                self.comb_engine.do_action_of_agents(theory_name, agents)
+            self.relapse_stpm_theory.do_action_of_agents(exsmokers)
+        else:
+            for agent in self.active_agents.agents_of_context(shuffle=shuffle_population):  # Only process active agents
                 agent.do_action()
                   
     def smoking_prevalence(self):
@@ -896,8 +1123,8 @@ class SmokingModel(Model):
         calculate the smoking prevalence
         '''
         smokers = 0
-        for agent in self.context.agents(agent_type=self.type):
-            if agent.is_active and agent.get_current_state() == AgentState.SMOKER:
+        for agent in self.active_agents.agents_of_context():
+            if agent.get_current_state() == AgentState.SMOKER:
                 smokers += 1
         prevalence = np.round(smokers / self.size_of_population * 100, 2)  # percentage of smokers
         return prevalence
@@ -932,71 +1159,70 @@ class SmokingModel(Model):
             activated_by_subgroup[subgroup] = 0
             activated_ids_by_subgroup[subgroup] = []
         
-        # Find all inactive agents with matching entry_year for the current year
-        for agent in self.context.agents(agent_type=self.type):
-            if not agent.is_active and agent.entry_year == self.year_of_current_time_step:
-                # Re-initialize the agent's state history with NA values for past time steps
-                # and their initial state for the current time step
-                initial_state = agent.b_states[0] if agent.b_states else AgentState.NEVERSMOKE
-                
-                # Clear existing state history and fill with NA values for past time steps
-                agent.b_states = []
-                t = 0
-                while t < self.current_time_step:  # Fill with NA for all previous ticks
-                    agent.b_states.append(pd.NA)
-                    t += 1
-                
-                # Add the initial state for the current time step
-                agent.b_states.append(initial_state)
-                
-                # Get agent ID
-                agent_id = agent.get_id()
-                
-                # Activate the agent
-                agent.is_active = True
-                activated_count += 1
-                
-                # Determine the agent's subgroup and update population counts
-                gender = agent.p_gender.get_value()
-                current_state = agent.get_current_state()
-                
-                # Determine subgroup based on state and gender
-                subgroup = None
-                if current_state == AgentState.NEVERSMOKE:
-                    if gender == 1:  # male
-                        subgroup = SubGroup.NEVERSMOKERMALE
-                    elif gender == 2:  # female
-                        subgroup = SubGroup.NEVERSMOKERFEMALE
-                elif current_state == AgentState.EXSMOKER:
-                    if gender == 1:
-                        subgroup = SubGroup.EXSMOKERMALE
-                    elif gender == 2:
-                        subgroup = SubGroup.EXSMOKERFEMALE
-                elif current_state == AgentState.SMOKER:
-                    if gender == 1:
-                        subgroup = SubGroup.SMOKERMALE
-                    elif gender == 2:
-                        subgroup = SubGroup.SMOKERFEMALE
-                elif current_state == AgentState.NEWQUITTER:
-                    if gender == 1:
-                        subgroup = SubGroup.NEWQUITTERMALE
-                    elif gender == 2:
-                        subgroup = SubGroup.NEWQUITTERFEMALE
-                elif current_state in (AgentState.ONGOINGQUITTER1, AgentState.ONGOINGQUITTER2, 
-                                      AgentState.ONGOINGQUITTER3, AgentState.ONGOINGQUITTER4,
-                                      AgentState.ONGOINGQUITTER5, AgentState.ONGOINGQUITTER6,
-                                      AgentState.ONGOINGQUITTER7, AgentState.ONGOINGQUITTER8,
-                                      AgentState.ONGOINGQUITTER9, AgentState.ONGOINGQUITTER10,
-                                      AgentState.ONGOINGQUITTER11):
-                    if gender == 1:
-                        subgroup = SubGroup.ONGOINGQUITTERMALE
-                    elif gender == 2:
-                        subgroup = SubGroup.ONGOINGQUITTERFEMALE
-                
-                if subgroup:
-                    self.population_counts[subgroup] += 1
-                    activated_by_subgroup[subgroup] += 1
-                    activated_ids_by_subgroup[subgroup].append(agent_id)
+        # Create the deferred agents of the current year (lazy agent creation) before activating them
+        if self.lazy_agent_creation:
+            self.materialise_agents()
+        
+        # Find the inactive agents in the bucket of the current year (the agents whose entry_year is the current year)
+        slots = self.entry_year_slots.pop(self.year_of_current_time_step, np.empty(0, dtype=np.int64))
+        slots = slots[~self.population_store.active[slots]]
+        
+        # Re-initialize the state histories of the agents in one pass with NA values for past time steps
+        # and their initial states (states at time step 0) for the current time step
+        initial_codes = np.where(self.state_history.lengths[slots] > 0, self.state_history.codes_at(slots, 0), AgentState.NEVERSMOKE.value)
+        self.state_history.init_states(slots, self.current_time_step, initial_codes)
+        
+        for slot in slots:
+            agent = self.active_agents.agents[slot]
+            
+            # Get agent ID
+            agent_id = agent.get_id()
+            
+            # Activate the agent
+            self.active_agents.activate(agent)
+            activated_count += 1
+            
+            # Determine the agent's subgroup and update population counts
+            gender = agent.p_gender.get_value()
+            current_state = agent.get_current_state()
+            
+            # Determine subgroup based on state and gender
+            subgroup = None
+            if current_state == AgentState.NEVERSMOKE:
+                if gender == 1:  # male
+                    subgroup = SubGroup.NEVERSMOKERMALE
+                elif gender == 2:  # female
+                    subgroup = SubGroup.NEVERSMOKERFEMALE
+            elif current_state == AgentState.EXSMOKER:
+                if gender == 1:
+                    subgroup = SubGroup.EXSMOKERMALE
+                elif gender == 2:
+                    subgroup = SubGroup.EXSMOKERFEMALE
+            elif current_state == AgentState.SMOKER:
+                if gender == 1:
+                    subgroup = SubGroup.SMOKERMALE
+                elif gender == 2:
+                    subgroup = SubGroup.SMOKERFEMALE
+            elif current_state == AgentState.NEWQUITTER:
+                if gender == 1:
+                    subgroup = SubGroup.NEWQUITTERMALE
+                elif gender == 2:
+                    subgroup = SubGroup.NEWQUITTERFEMALE
+            elif current_state in (AgentState.ONGOINGQUITTER1, AgentState.ONGOINGQUITTER2, 
+                                  AgentState.ONGOINGQUITTER3, AgentState.ONGOINGQUITTER4,
+                                  AgentState.ONGOINGQUITTER5, AgentState.ONGOINGQUITTER6,
+                                  AgentState.ONGOINGQUITTER7, AgentState.ONGOINGQUITTER8,
+                                  AgentState.ONGOINGQUITTER9, AgentState.ONGOINGQUITTER10,
+                                  AgentState.ONGOINGQUITTER11):
+                if gender == 1:
+                    subgroup = SubGroup.ONGOINGQUITTERMALE
+                elif gender == 2:
+                    subgroup = SubGroup.ONGOINGQUITTERFEMALE
+            
+            if subgroup:
+                self.population_counts[subgroup] += 1
+                activated_by_subgroup[subgroup] += 1
+                activated_ids_by_subgroup[subgroup].append(agent_id)
         
         # Provide comprehensive logging of activation results
         if self.running_mode == 'debug':
@@ -1089,7 +1315,7 @@ class SmokingModel(Model):
                     pass  # If unable to determine subgroup, simply skip grouping
                 
                 # Mark as inactive instead of removing
-                agent.is_active = False
+                self.active_agents.deactivate(agent)
         
         # Log the deactivation data directly instead of storing it for do_per_tick
         if self.running_mode == 'debug' and killed_count > 0:
@@ -1127,6 +1353,10 @@ class SmokingModel(Model):
             
             self.logfile.write("=== END OF DEACTIVATION SUMMARY ===\n\n")
         
+        # Move the deactivated agents into the archive of the dead agents and remove them from the context and social network
+        if self.compact_dead_agents:
+            self.archive_dead_agents(killed_ids)
+        
         # Clear the agents_to_kill set for the next round
         self.agents_to_kill.clear()
         gc.collect()
@@ -1134,6 +1364,25 @@ class SmokingModel(Model):
         # Return the count of agents deactivated
         return killed_count
 
+    def archive_dead_agents(self, uids):
+        '''
+        compaction of the dead agents: add the dead agents to the archive of the dead agents (id, final state, tick of death and edges of the social network),
+        then remove them from the social network and the context so that they are not visited by the loops over the agents of the context
+        input: uids, unique ids of the dead agents
+        '''
+        graph = self.social_network.network.graph if self.social_network is not None else None
+        for uid in uids:
+            agent = self.context.agent(uid)
+            if agent is None:
+                continue
+            self.dead_agents.archive(agent, self.current_time_step, graph)
+            if graph is not None and agent in graph:
+                self.social_network.remove_agent(agent)
+            self.active_agents.unregister(agent)
+            self.context.remove(agent)
+        if self.running_mode == 'debug':
+            self.logfile.write(f"Archived {len(uids)} dead agents, {len(self.dead_agents)} dead agents in the archive\n")
+
     def do_per_tick(self):
         '''
         do_per_tick is executed at each tick from tick 1 to execute the mechanisms of the ABM.
@@ -1167,13 +1416,16 @@ class SmokingModel(Model):
             
         # Ensure all active agents have their state array extended to cover the current time step
         agents_updated = 0
-        for agent in self.context.agents(agent_type=self.type):
-            if agent.is_active and len(agent.b_states) <= previous_time_step:
+        for agent in self.active_agents.agents_of_context():
+            if self.state_history.length(agent.slot) <= previous_time_step:
                 # Get the agent's last known state
-                last_state = agent.b_states[previous_time_step]
+                last_state = self.state_history.get(agent.slot, previous_time_step)
                 # Add this state for the current time step
                 agent.set_state_of_next_time_step(last_state)
                 agents_updated += 1
+        
+        # Group the active agents by their states of the current time step
+        self.state_index.update(self.current_time_step)
                     
         self.current_time_step_of_non_disp_diffusions = max(0, self.current_time_step - self.difference_between_start_time_of_ABM_and_start_time_of_non_disp_diffusions)       
         self.diffusion_models_of_this_tick={}
@@ -1246,16 +1498,14 @@ class SmokingModel(Model):
 
             # Log network stats for all agents in our fixed sample at each tick
             if self.social_network is not None:
-                active_agents = {agent.get_id(): agent for agent in self.context.agents(agent_type=self.type) if hasattr(agent, 'is_active') and agent.is_active}
+                active_agents = {agent.get_id(): agent for agent in self.active_agents.agents_of_context()}
                 self.logfile.write(f"\n=== NETWORK STATISTICS (TICK {self.current_time_step}) ===\n")
                 logged_count = 0
                 for agent_id in self.fixed_agent_ids:
                     if agent_id in active_agents:
                         agent = active_agents[agent_id]
                         state = agent.get_current_state()
-                        # Convert iterator to list to get length
-                        neighbours = list(self.social_network.get_neighbours(agent))
-                        self.logfile.write(f"Agent {agent_id} network stats: total alters={len(neighbours)}, "
+                        self.logfile.write(f"Agent {agent_id} network stats: total alters={self.social_network.count_neighbours(agent)}, "
                                           f"active alters={self.social_network.count_active_neighbours(agent)}, "
                                           f"active smoking alters={self.social_network.count_smoking_neighbours(agent)}, "
                                           f"state={state}\n")
@@ -1319,6 +1569,9 @@ class SmokingModel(Model):
         self.file_initiation_imd.close()
         self.file_quit_age_sex.close()
         self.file_quit_imd.close()
+        self.lookup_misses.write_csv(f'{ROOT_DIR}/output/lookup_misses.csv')
+        if self.lookup_misses.total() > 0:
+            print(f'{self.lookup_misses.total()} lookups have no matching row in the lookup tables (their log odds are set to 0). The misses are saved in the file lookup_misses.csv.')
         if self.running_mode == 'debug':
             print('whole population counts and subgroups counts for initiation and quitting are saved in the files:\n')
             print('whole_population_counts.csv, '+str(self.filename_initiation_sex)+', '+str(self.filename_initiation_imd)+',\n')
@@ -1328,7 +1581,13 @@ class SmokingModel(Model):
                 f.write(str(prev) + ',')
             f.close()
             self.write_ecig_prevalence_to_csv_files()
+            self.lookup_misses.write_summary(self.logfile)
             self.logfile.close()
+        if self.compact_dead_agents:
+            self.dead_agents.write_csv(f'{ROOT_DIR}/output/dead_agents.csv', f'{ROOT_DIR}/output/dead_agents_edges.csv')
+        if self.props.get("export_state_history", False):
+            self.state_history.write_csv(f'{ROOT_DIR}/output/state_history.csv', self.data['agentID'].to_numpy())
+            print('states of the agents over the ticks are saved in the file state_history.csv.')
 
     def init(self):
         '''initialise the ABM'''
@@ -1365,6 +1624,9 @@ class SmokingModel(Model):
             
         self.update_theories_with_network()
         
+        if self.props.get("memory_report", False):
+            self.write_memory_report()
+        
         if self.running_mode == 'debug':
             self.logfile.write("Initialising schedule\n")
             
@@ -1373,6 +1635,18 @@ class SmokingModel(Model):
         if self.running_mode == 'debug':
             self.logfile.write("ABM initialisation complete\n")
 
+    def write_memory_report(self):
+        '''print the bytes per agent with a per-instance __dict__ layout (before __slots__) and with the __slots__ layout (after __slots__)'''
+        from smokingcessation.memory_report import memory_report
+        report = memory_report(self)
+        sstr = (f"memory report ({report['sampled']} of {report['agents']} agents sampled): "
+                f"{report['dict_layout']:.0f} bytes per agent with __dict__ (before), {report['slots_layout']:.0f} bytes per agent with __slots__ (after) "
+                f"+ {report['store']:.0f} bytes per agent in the population store + {report['state_history']:.0f} bytes per agent in the state history; "
+                f"estimated memory of the agents: {report['agents'] * (report['slots_layout'] + report['store'] + report['state_history']) / 2**20:.1f} MB")
+        print(sstr)
+        if self.running_mode == 'debug':
+            self.logfile.write(sstr + '\n')
+
     def run(self):
         self.runner.execute()
         self.collect_data()
@@ -1397,8 +1671,7 @@ class SmokingModel(Model):
             self.logfile.write(f"Agents with is_active attribute: {has_is_active}\n")
             
             # Count how many agents are active
-            active_agents = sum(1 for agent in self.context.agents() if hasattr(agent, 'is_active') and agent.is_active)
-            self.logfile.write(f"Active agents: {active_agents}\n")
+            self.logfile.write(f"Active agents: {len(self.active_agents)}\n")
             
             # Count how many agents have the theory attributes
             has_quit_attempt = sum(1 for agent in self.context.agents() if hasattr(agent, 'quit_attempt_theory'))
@@ -1499,7 +1772,7 @@ class SmokingModel(Model):
             self.logfile.write("\n=== NETWORK STATISTICS FOR FIXED SAMPLE AGENTS ===\n")
             
             # Get all active agents and their IDs for quick lookup
-            active_agents = {agent.get_id(): agent for agent in self.context.agents(agent_type=self.type) if agent.is_active}
+            active_agents = {agent.get_id(): agent for agent in self.active_agents.agents_of_context()}
             
             # Log stats for our fixed set of agents if they are active
             logged_count = 0
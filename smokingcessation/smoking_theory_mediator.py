@@ -6,6 +6,20 @@ from mbssm.theory_mediator import TheoryMediator
 from mbssm.theory import Theory
 from mbssm.micro_agent import MicroAgent
 from smokingcessation.person import Person
+from smokingcessation.state_history import STATES
+
+#THEORY_OF_STATE[code of an AgentState] = name of the theory of the situation and action mechanisms of an agent in the state (None: not an acceptable state)
+THEORY_OF_STATE = [None] * len(STATES)
+THEORY_OF_STATE[AgentState.NEVERSMOKE.value] = Theories.REGSMOKE
+THEORY_OF_STATE[AgentState.SMOKER.value] = Theories.QUITATTEMPT
+for code in range(AgentState.NEWQUITTER.value, AgentState.ONGOINGQUITTER11.value + 1):#new quitter and ongoing quitters 1 to 11
+    THEORY_OF_STATE[code] = Theories.QUITMAINTENANCE
+THEORY_OF_STATE[AgentState.EXSMOKER.value] = Theories.RELAPSESSTPM
+
+def states_of_theory(name: Theories):
+    '''output: list of the states (AgentState) of the agents which run the theory in their situation and action mechanisms'''
+    return [STATES[code] for code, theory_name in enumerate(THEORY_OF_STATE) if theory_name == name]
+
 class SmokingTheoryMediator(TheoryMediator):
 
     def __init__(self, theory_list: List [Theory]):
@@ -17,6 +31,14 @@ class SmokingTheoryMediator(TheoryMediator):
             if not isinstance(theory.name, Theories):
                 raise ValueError(f'{theory.name} must be an instance of the class Theories.')
             self.theory_map[theory.name] = theory
+        #theory_of_state[code of an AgentState] = theory of the situation and action mechanisms of an agent in the state
+        self.theory_of_state = [None if name is None else self.theory_map.get(name) for name in THEORY_OF_STATE]
+
+    def get_theory_of_state(self, state: AgentState):
+        theory = self.theory_of_state[state.value]
+        if theory is None:
+            raise ValueError(f'{state} is not an acceptable agent state')
+        return theory
     
     def mediate_situation(self, agent: Person, do_smoking_behaviour_mechanisms=True):
         '''
@@ -24,22 +46,8 @@ class SmokingTheoryMediator(TheoryMediator):
         if do_smoking_behaviour_mechanisms = False, do situational mechanism of DemographicsSTPMTheory i.e. if December, kill some agents and increase the ages of the surving ones etc.
         '''
         if do_smoking_behaviour_mechanisms==True:
-            cstate = agent.get_current_state()
-            if cstate == AgentState.NEVERSMOKE:
-                self.theory_map[Theories.REGSMOKE].do_situation(agent)
-            elif cstate == AgentState.SMOKER:
-                self.theory_map[Theories.QUITATTEMPT].do_situation(agent)        
-            elif cstate == AgentState.NEWQUITTER:
-                self.theory_map[Theories.QUITMAINTENANCE].do_situation(agent)
-            elif cstate in (AgentState.ONGOINGQUITTER1,AgentState.ONGOINGQUITTER2,AgentState.ONGOINGQUITTER3,
-                            AgentState.ONGOINGQUITTER4,AgentState.ONGOINGQUITTER5,AgentState.ONGOINGQUITTER6,
-                            AgentState.ONGOINGQUITTER7,AgentState.ONGOINGQUITTER8,AgentState.ONGOINGQUITTER9,
-                            AgentState.ONGOINGQUITTER10,AgentState.ONGOINGQUITTER11):
-                self.theory_map[Theories.QUITMAINTENANCE].do_situation(agent)
-            elif cstate == AgentState.EXSMOKER:
-                self.theory_map[Theories.RELAPSESSTPM].do_situation(agent)
-            else:
-                raise ValueError(f'{cstate} is not an acceptable agent state')
+            #never smoker: regular smoking theory; smoker: quit attempt theory; new quitter and ongoing quitters: quit maintenance theory; ex-smoker: relapse theory
+            self.get_theory_of_state(agent.get_current_state()).do_situation(agent)
         else: 
             self.theory_map[Theories.DemographicsSTPM].do_situation(agent)#this agent may be killed
             
@@ -71,36 +79,4 @@ class SmokingTheoryMediator(TheoryMediator):
                 if p >= threshold {A transitions to a smoker at t+1} else { A stays as ex-smoker at t+1}
             where threshold is a pseudo-random number drawn from uniform(0,1)
         """
-        cstate = agent.get_current_state()
-        if cstate == AgentState.NEVERSMOKE:
-            self.theory_map[Theories.REGSMOKE].do_action(agent)
-        elif cstate == AgentState.SMOKER:
-            self.theory_map[Theories.QUITATTEMPT].do_action(agent)
-        elif cstate == AgentState.NEWQUITTER:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER1:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER2:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER3:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER4:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER5:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER6:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER7:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER8:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER9:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER10:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.ONGOINGQUITTER11:
-            self.theory_map[Theories.QUITMAINTENANCE].do_action(agent)
-        elif cstate == AgentState.EXSMOKER:
-            self.theory_map[Theories.RELAPSESSTPM].do_action(agent)
-        else:
-            raise ValueError(f'{cstate} is not an acceptable agent state')
\ No newline at end of file
+        self.get_theory_of_state(agent.get_current_state()).do_action(agent)
\ No newline at end of file
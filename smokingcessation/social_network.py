@@ -30,6 +30,12 @@ class SocialNetwork:
         
         # Create a directed network projection
         self.network = network.DirectedSharedNetwork("social_network", self.comm)
+        
+        # Edges to agents which are not created yet (lazy agent creation): key=id of a deferred agent, value=list of (ego id, alter id)
+        self.pending_edges = {}
+        
+        # Number of alters of an agent which are dead and removed from the network (compaction of dead agents): key=id of the ego, value=number of archived alters
+        self.archived_alters = {}
             
         # Add the network projection to the context
         self.context.add_projection(self.network)
@@ -74,6 +80,11 @@ class SocialNetwork:
                     alter = id_to_person[alter_id]
                     self.network.add_edge(ego, alter)
                     edge_count += 1
+                elif all(agent_id in id_to_person or agent_id in self.smoking_model.deferred_agent_ids for agent_id in (ego_id, alter_id)):
+                    # Keep the edge until its deferred agents are created
+                    for agent_id in (ego_id, alter_id):
+                        if agent_id not in id_to_person:
+                            self.pending_edges.setdefault(agent_id, []).append((ego_id, alter_id))
             
             # Set graph reference for all agents
             active_count = 0
@@ -90,14 +101,47 @@ class SocialNetwork:
                 self.smoking_model.logfile.write(f"Set {active_count} agents as active during network initialisation\n")
                 
             self.log_info(f"Network initialised with {edge_count} connections")
+            if len(self.pending_edges) > 0:
+                self.log_info(f"{sum(len(edges) for edges in self.pending_edges.values())} connections of {len(self.pending_edges)} agents which are not created yet are pending")
             
         except Exception as e:
             self.log_info(f"ERROR initialising network: {str(e)}")
             raise
     
+    def add_agent(self, agent):
+        """
+        Add an agent created after the initialisation of the network (lazy agent creation) and resolve its pending edges
+        to the agents which are already created.
+        
+        Args:
+            agent: The created agent
+        """
+        agent.graph = self.network.graph
+        smoking_model = self.smoking_model
+        for ego_id, alter_id in self.pending_edges.pop(agent.get_id(), []):
+            ego = smoking_model.context.agent((ego_id, smoking_model.type, smoking_model.rank))
+            alter = smoking_model.context.agent((alter_id, smoking_model.type, smoking_model.rank))
+            if ego is not None and alter is not None:
+                self.network.add_edge(ego, alter)
+            elif ego is not None and alter_id in smoking_model.dead_agents:
+                # The alter died before this agent was created
+                self.archived_alters[ego_id] = self.archived_alters.get(ego_id, 0) + 1
+                smoking_model.dead_agents.edges.append((ego_id, alter_id))
+    
+    def remove_agent(self, agent):
+        """
+        Remove a dead agent from the network (compaction of dead agents). The dead agent is counted as an archived alter of its egos.
+        
+        Args:
+            agent: The dead agent
+        """
+        for ego in self.network.graph.predecessors(agent):
+            self.archived_alters[ego.get_id()] = self.archived_alters.get(ego.get_id(), 0) + 1
+        self.archived_alters.pop(agent.get_id(), None)
+    
     def get_neighbours(self, agent):
         """
-        Get all neighbours of an agent from the network (including inactive ones).
+        Get all neighbours of an agent from the network (including inactive ones which are not removed from the network).
         
         Args:
             agent: The agent whose neighbours to get
@@ -107,6 +151,18 @@ class SocialNetwork:
         """
         return self.network.graph.neighbors(agent)
     
+    def count_neighbours(self, agent):
+        """
+        Count all neighbours of an agent including the dead neighbours removed from the network.
+        
+        Args:
+            agent: The agent whose neighbours to count
+            
+        Returns:
+            Integer count of neighbours
+        """
+        return sum(1 for _ in self.get_neighbours(agent)) + self.archived_alters.get(agent.get_id(), 0)
+    
     def get_active_neighbours(self, agent):
         """
         Get only the active neighbours of an agent.
@@ -179,7 +235,7 @@ class SocialNetwork:
             agent: The agent whose network statistics to log
         """
         # Always collect the stats, even if not in debug mode
-        total_neighbours = sum(1 for _ in self.get_neighbours(agent))
+        total_neighbours = self.count_neighbours(agent)
         active_neighbours = self.count_active_neighbours(agent)
         smoking_neighbours = self.count_smoking_neighbours(agent)
         
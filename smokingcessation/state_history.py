@@ -0,0 +1,94 @@
+'''
+definition of the StateHistory class which records the states of all the agents over the ticks of the simulation
+in an int8 matrix (rows=slots of the agents, columns=ticks) instead of a list of AgentState objects per agent.
+A state is stored as the value of its AgentState (1 to 16) and 0 represents NA i.e. a tick before the entry year of an agent.
+The full history (a column per tick) can be exported for analysis. If only the current states are needed,
+the history keeps a window of 3 columns (the previous, current and next time steps) which are reused as the ticks go on.
+'''
+import numpy as np
+import pandas as pd
+from config.definitions import AgentState
+
+NA = 0 #code of a NA state
+STATES = [None] * (max(state.value for state in AgentState) + 1) #STATES[code] = AgentState of the code
+for state in AgentState:
+    STATES[state.value] = state
+
+class StateHistory:
+    def __init__(self, size: int, ticks: int, full_history=True):
+        '''
+        input: size, number of slots (agents)
+               ticks, number of ticks of the simulation (stop.at)
+               full_history, True: keep the states of all the ticks (0 to ticks+1);
+                             False: keep the states of the previous, current and next time steps only
+        '''
+        self.size = size
+        self.full_history = full_history
+        self.window = ticks + 2 if full_history else 3 #number of columns of the matrix
+        self.states = np.zeros((size, self.window), dtype=np.int8) #states[slot, t % window] = code of the state of the agent at time step t
+        self.lengths = np.zeros(size, dtype=np.int32) #lengths[slot] = number of time steps recorded for the agent i.e. the next time step of the agent
+
+    def set_states(self, slot: int, states):
+        '''
+        set the states of an agent from time step 0 onwards
+        input: states, list of AgentState or NA (pd.NA or None) of time steps 0, 1,...
+        '''
+        self.lengths[slot] = 0
+        for state in states:
+            self.append(slot, state)
+
+    def init_states(self, slots: np.ndarray, t: int, codes: np.ndarray):
+        '''
+        bulk set_states of the agents activated at time step t: NA states at time steps 0 to t-1 and the codes at time step t
+        input: slots, slots of the agents
+               codes, codes of the states of the agents at time step t
+        '''
+        self.states[slots] = NA
+        self.states[slots, t % self.window] = codes
+        self.lengths[slots] = t + 1
+
+    def append(self, slot: int, state):
+        '''record the state of an agent at its next time step'''
+        t = self.lengths[slot]
+        self.states[slot, t % self.window] = NA if state is None or state is pd.NA else state.value
+        self.lengths[slot] = t + 1
+
+    def get(self, slot: int, t: int):
+        '''
+        output: the AgentState of an agent at time step t or None if the state is NA
+        '''
+        if t >= self.lengths[slot] or t < 0:
+            raise IndexError(f"Trying to access state at time step {t} but agent only has states up to {self.lengths[slot]-1}")
+        if t < self.lengths[slot] - self.window:
+            raise IndexError(f"state at time step {t} is no longer kept (only the states of the last {self.window} time steps are kept)")
+        return STATES[self.states[slot, t % self.window]]
+
+    def length(self, slot: int):
+        return int(self.lengths[slot])
+
+    def codes_at(self, slots: np.ndarray, t: int):
+        '''
+        output: array of the codes of the states of the agents at time step t (the agents must have a state at time step t)
+        '''
+        return self.states[slots, t % self.window]
+
+    def to_dataframe(self, ids):
+        '''
+        export the full history
+        input: ids, array of the ids of the agents indexed by slot
+        output: dataframe with columns id, tick and state (name of the state) of the recorded non-NA states of the agents
+        '''
+        if not self.full_history:
+            raise ValueError('the full state history is not kept. Set state_history: full in model.yaml to export the state history.')
+        ticks = np.arange(self.window)
+        recorded = (ticks[None, :] < self.lengths[:, None]) & (self.states != NA)
+        slots, ticks = np.nonzero(recorded)
+        names = np.array([None if state is None else state.name for state in STATES], dtype=object)
+        return pd.DataFrame({'id': np.asarray(ids)[slots], 'tick': ticks, 'state': names[self.states[slots, ticks]]})
+
+    def write_csv(self, filename: str, ids):
+        self.to_dataframe(ids).to_csv(filename, index=False)
+
+    def nbytes(self):
+        '''memory of the history in bytes'''
+        return self.states.nbytes + self.lengths.nbytes
@@ -2,15 +2,17 @@
 definition of STPMTheory abstract class and and its subclasses: DemographicsSTPMTheory, RelapseSTPMTheory, Initiation and QuitSTPMTheory
 STPMTheory represents the STPM model.
 '''
-import pandas as pd
+import numpy as np
 import random
 from abc import abstractmethod
+from typing import List
 from config.definitions import AgentState
 from config.definitions import AgentBehaviour
 from config.definitions import Theories
 from mbssm.theory import Theory
 from mbssm.micro_agent import MicroAgent
 from smokingcessation.smoking_model import SmokingModel
+from smokingcessation.state_history import STATES
 
 class STPMTheory(Theory):
     def __init__(self, name, smoking_model: SmokingModel):
@@ -38,33 +40,12 @@ class DemographicsSTPMTheory(STPMTheory):
             if agent.p_age.get_value() > 89: 
                 self.smoking_model.agents_to_kill.add(agent.uid)
             else:
-                if agent.get_current_state() in {AgentState.SMOKER, AgentState.NEWQUITTER, 
-                                                         AgentState.ONGOINGQUITTER1, AgentState.ONGOINGQUITTER2, AgentState.ONGOINGQUITTER3,
-                                                         AgentState.ONGOINGQUITTER4, AgentState.ONGOINGQUITTER5, AgentState.ONGOINGQUITTER6,
-                                                         AgentState.ONGOINGQUITTER7, AgentState.ONGOINGQUITTER8, AgentState.ONGOINGQUITTER9,
-                                                         AgentState.ONGOINGQUITTER10, AgentState.ONGOINGQUITTER11}:
-                     state='current'
-                elif agent.get_current_state() == AgentState.EXSMOKER:
-                      state='former'
-                elif agent.get_current_state() == AgentState.NEVERSMOKE:
-                      state='never'
-                else:
-                    import sys
-                    sstr='no such state:'+agent.get_current_state()
-                    sys.exit(sstr)
-                matched_row = self.smoking_model.death_prob[
-                                (self.smoking_model.death_prob["year"] == self.smoking_model.year_of_current_time_step) &
-                                (self.smoking_model.death_prob["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.death_prob["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.death_prob["imd_quintile"] == agent.p_imd_quintile.get_value()) &
-                                (self.smoking_model.death_prob["smk.state"] == state)
-                                ]
-                matched_row = pd.DataFrame(matched_row)
-                if len(matched_row) > 0:
-                    col_index = matched_row.columns.get_loc("qx")
-                    self.prob_behaviour = float(matched_row.iat[0, col_index])
-                else:#death probability file has no death probability for this agent 
-                    self.prob_behaviour = 0
+                #retrieve the death probability of this agent (0 if the death probability file has no death probability for this agent) 
+                self.prob_behaviour = self.smoking_model.death_prob_table.get(self.smoking_model.year_of_current_time_step,
+                                                                              self.get_death_smoking_state(agent),
+                                                                              agent.p_age.get_value(),
+                                                                              agent.p_gender.get_value(),
+                                                                              agent.p_imd_quintile.get_value())
                 self.threshold = random.uniform(0, 1)
                 if self.prob_behaviour >= self.threshold:
                     self.smoking_model.agents_to_kill.add(agent.uid)
@@ -72,44 +53,76 @@ class DemographicsSTPMTheory(STPMTheory):
                     agent.increment_age()
             #update bCigConsumption of this agent based on sex, age, year, SEP, percentile number if it is not killed
             if agent.uid not in self.smoking_model.agents_to_kill:
-                if self.smoking_model.year_of_current_time_step < 2025:
-                    matched_cigconsumption = self.smoking_model.cig_consumption_percentiles_data[
-                                (self.smoking_model.cig_consumption_percentiles_data["year"] == self.smoking_model.year_of_current_time_step) &
-                                (self.smoking_model.cig_consumption_percentiles_data["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["pSEP"] == agent.p_sep.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["perc_num"] == agent.p_percentile.get_value())
-                                ]
-                else:#from 2025 onwards, use bCigConsumption of 2024 and apply a multiplier to it.
-                    matched_cigconsumption = self.smoking_model.cig_consumption_percentiles_data[
-                                (self.smoking_model.cig_consumption_percentiles_data["year"] == 2024) &
-                                (self.smoking_model.cig_consumption_percentiles_data["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["pSEP"] == agent.p_sep.get_value()) &
-                                (self.smoking_model.cig_consumption_percentiles_data["perc_num"] == agent.p_percentile.get_value())
-                                ]
-                    matched_cigconsumptiontrend = self.smoking_model.attempt_exogenous_dynamics_data[
-                                (self.smoking_model.attempt_exogenous_dynamics_data["year"] == self.smoking_model.year_of_current_time_step) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["age"] == agent.p_age.get_value()) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["sex"] == agent.p_gender.get_value()) &
-                                (self.smoking_model.attempt_exogenous_dynamics_data["social grade"] == agent.p_sep.get_value())
-                                ]
-                    matched_cigconsumptiontrend = pd.DataFrame(matched_cigconsumptiontrend)
-                matched_cigconsumption = pd.DataFrame(matched_cigconsumption)
-                #ipdb.set_trace()#debug break point
-                if len(matched_cigconsumption) > 0:
-                    if self.smoking_model.year_of_current_time_step < 2025:
-                        col_index = matched_cigconsumption.columns.get_loc("bCigConsumption")
-                        agent.b_cig_consumption = float(matched_cigconsumption.iat[0, col_index])
-                    else:
-                        col_index = matched_cigconsumption.columns.get_loc("bCigConsumption")
-                        if len(matched_cigconsumptiontrend) > 0:
-                            col_index2 = matched_cigconsumptiontrend.columns.get_loc("bCigConsumptionTrend") #the multiplier
-                            agent.b_cig_consumption = float(matched_cigconsumption.iat[0, col_index])*float(matched_cigconsumptiontrend.iat[0, col_index2])
-                        else:#no matched bCigConsumptionTrend (multiplier)
-                            agent.b_cig_consumption = float(matched_cigconsumption.iat[0, col_index])
-                else:#no matched bCigConsumption and don't update agent's bCigConsumption
-                    pass
+                self.update_cig_consumption(agent)
+
+    def do_situation_of_agents(self, agents: List[MicroAgent]):
+        '''
+        vectorised do_situation: in December, run the mortality and ageing of all the given agents in one NumPy pass
+        i.e. gather the death probabilities of the agents from the death probabilities cube of the current year, 
+        draw their thresholds from the random number generator of the model, add the dead agents to agents_to_kill,
+        increment the ages of the surviving agents and update their age group dummies and bCigConsumption.
+        '''
+        n = len(agents)
+        if self.smoking_model.months_counter != 12 or n == 0:
+            return
+        #gather the attributes of the agents from the columns of the population store
+        store = self.smoking_model.population_store
+        slots = np.fromiter((agent.slot for agent in agents), dtype=np.int64, count=n)
+        ages = store.age[slots].astype(np.int64)
+        sexes = store.gender[slots]
+        imd_quintiles = store.imd_quintile[slots]
+        #smk.state codes of the agents gathered from the current states of the agents in the state history
+        codes = self.smoking_model.state_history.codes_at(slots, self.smoking_model.current_time_step)
+        death_smoking_states = np.full(len(STATES), -1, dtype=np.int64) #death_smoking_states[code of an AgentState] = smk.state code
+        for state, smoking_state in self.smoking_model.death_smoking_states.items():
+            death_smoking_states[state.value] = smoking_state
+        states = death_smoking_states[codes]
+        if (states < 0).any():
+            import sys
+            sstr='no such state:'+str(STATES[codes[np.argmax(states < 0)]])
+            sys.exit(sstr)
+        probs = self.smoking_model.death_prob_table.get_many(self.smoking_model.year_of_current_time_step, states, ages, sexes, imd_quintiles)
+        thresholds = self.smoking_model.rng.uniform(0, 1, n)
+        killed = (ages > 89) | (probs >= thresholds) #kill the agents older than 89
+        new_ages = ages + 1
+        #age group dummies change only when an agent turns 30, 45 or 65
+        age_group_changed = np.isin(new_ages, (30, 45, 65))
+        #bCigConsumption of the agents at their new ages (NaN if there is no matching bCigConsumption)
+        seps = store.sep[slots]
+        percentiles = store.percentile[slots]
+        cig_consumptions = self.smoking_model.cig_consumption_table.get_many(self.smoking_model.year_of_current_time_step, new_ages, sexes, seps, percentiles)
+        updated = ~killed & ~np.isnan(cig_consumptions)
+        store.cig_consumption[slots[updated]] = cig_consumptions[updated]
+        #the level 2 attributes of pAge (oAge, cAge and mAge) are bound to the age column so the ages of the surviving agents are set in one write
+        store.age[slots[~killed]] = new_ages[~killed]
+        for agent, kill, changed in zip(agents, killed.tolist(), age_group_changed.tolist()):
+            if kill:
+                self.smoking_model.agents_to_kill.add(agent.uid)
+            elif changed:
+                agent.update_age_group_dummies()
+
+    def get_death_smoking_state(self, agent: MicroAgent):
+        '''
+        get the smk.state code (current, former or never) of the agent in the death probabilities cube
+        '''
+        smoking_state = self.smoking_model.death_smoking_states.get(agent.get_current_state())
+        if smoking_state is None:
+            import sys
+            sstr='no such state:'+str(agent.get_current_state())
+            sys.exit(sstr)
+        return smoking_state
+
+    def update_cig_consumption(self, agent: MicroAgent):
+        #from 2025 onwards, bCigConsumption of 2024 with the multiplier applied to it is compiled into the cigarette consumption array
+        cig_consumption = self.smoking_model.cig_consumption_table.get(self.smoking_model.year_of_current_time_step,
+                                                                       agent.p_age.get_value(),
+                                                                       agent.p_gender.get_value(),
+                                                                       agent.p_sep.get_value(),
+                                                                       agent.p_percentile.get_value())
+        if not np.isnan(cig_consumption):
+            agent.b_cig_consumption = cig_consumption
+        else:#no matched bCigConsumption and don't update agent's bCigConsumption
+            pass
 
     def do_action(self, agent: MicroAgent):        
         pass    
@@ -128,67 +141,80 @@ class RelapseSTPMTheory(STPMTheory):
             agent.b_years_since_quit += 1
             agent.months_counter_ex_smoker = 0
         # retrieve probability of relapse of the matching person from STPM transition probabilities file
-        if (agent.b_years_since_quit > 0) and (agent.b_years_since_quit < 10):
-            if self.smoking_model.year_of_current_time_step < 2011:
-                matched = self.smoking_model.relapse_prob[
-                (self.smoking_model.relapse_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.relapse_prob['year'] == 2011) &
-                (self.smoking_model.relapse_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.relapse_prob['imd_quintile'] == agent.p_imd_quintile.get_value()) &
-                (self.smoking_model.relapse_prob['time_since_quit'] == agent.b_years_since_quit)]
-            else:
-                matched = self.smoking_model.relapse_prob[
-                (self.smoking_model.relapse_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.relapse_prob['year'] == self.smoking_model.year_of_current_time_step) &
-                (self.smoking_model.relapse_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.relapse_prob['imd_quintile'] == agent.p_imd_quintile.get_value()) &
-                (self.smoking_model.relapse_prob['time_since_quit'] == agent.b_years_since_quit)]
-            matched = pd.DataFrame(matched)
-            if len(matched) > 0:
-                self.prob_behaviour = float(matched.iat[0, -1])
-            else:
-                self.prob_behaviour = 0
-        elif agent.b_years_since_quit >= 10:  # retrieve the probability of 10 years since quit
-            if self.smoking_model.year_of_current_time_step < 2011:
-                matched = self.smoking_model.relapse_prob[
-                    (self.smoking_model.relapse_prob['age'] == agent.p_age.get_value()) &
-                    (self.smoking_model.relapse_prob['year'] == 2011) &
-                    (self.smoking_model.relapse_prob['sex'] == agent.p_gender.get_value()) &
-                    (self.smoking_model.relapse_prob['imd_quintile'] == agent.p_imd_quintile.get_value()) &
-                    (self.smoking_model.relapse_prob['time_since_quit'] == 10)]
-            else:
-                  matched = self.smoking_model.relapse_prob[
-                    (self.smoking_model.relapse_prob['age'] == agent.p_age.get_value()) &
-                    (self.smoking_model.relapse_prob['year'] == self.smoking_model.year_of_current_time_step) &
-                    (self.smoking_model.relapse_prob['sex'] == agent.p_gender.get_value()) &
-                    (self.smoking_model.relapse_prob['imd_quintile'] == agent.p_imd_quintile.get_value()) &
-                    (self.smoking_model.relapse_prob['time_since_quit'] == 10)]
-            matched = pd.DataFrame(matched)
-            if len(matched) > 0:
-                self.prob_behaviour = float(matched.iat[0,-1])
-            else:
-                self.prob_behaviour = 0
+        if agent.b_years_since_quit > 0:
+            #STPM relapse probabilites start from 2011, so match the agent with STPM 2011 data before 2011
+            #retrieve the probability of 10 years since quit if the agent has quit for 10 years or more
+            self.prob_behaviour = self.smoking_model.relapse_prob_table.get(max(self.smoking_model.year_of_current_time_step, 2011),
+                                                                            agent.p_age.get_value(),
+                                                                            agent.p_gender.get_value(),
+                                                                            agent.p_imd_quintile.get_value(),
+                                                                            min(agent.b_years_since_quit, 10))
         else:
             self.prob_behaviour = 0
         self.threshold = random.uniform(0, 1)
         if self.prob_behaviour >= self.threshold:
+            self.relapse(agent)
+        else:
+            self.not_relapse(agent)
+
+    def do_action_of_agents(self, agents: List[MicroAgent]):
+        '''
+        vectorised do_action: run the relapse mechanism of all the given ex-smokers in one NumPy pass
+        i.e. update their months and years since quit, retrieve their probabilities of relapse from the STPM relapse probabilities array,
+        draw their thresholds from the random number generator of the model and write back their new states and behaviours.
+        '''
+        n = len(agents)
+        if n == 0:
+            return
+        #gather the attributes of the agents from the columns of the population store
+        store = self.smoking_model.population_store
+        slots = np.fromiter((agent.slot for agent in agents), dtype=np.int64, count=n)
+        months_counter_ex_smoker = store.months_counter_ex_smoker[slots] + 1
+        years_since_quit = store.years_since_quit[slots].astype(np.int64)
+        new_year = months_counter_ex_smoker == 12
+        years_since_quit[new_year] += 1
+        months_counter_ex_smoker[new_year] = 0
+        store.months_counter_ex_smoker[slots] = months_counter_ex_smoker
+        store.years_since_quit[slots] = years_since_quit
+        ages = store.age[slots]
+        sexes = store.gender[slots]
+        imd_quintiles = store.imd_quintile[slots]
+        #STPM relapse probabilites start from 2011, so match the agents with STPM 2011 data before 2011
+        #retrieve the probability of 10 years since quit if an agent has quit for 10 years or more
+        probs = self.smoking_model.relapse_prob_table.get_many(max(self.smoking_model.year_of_current_time_step, 2011),
+                                                               ages, sexes, imd_quintiles, np.minimum(years_since_quit, 10))
+        probs[years_since_quit <= 0] = 0
+        thresholds = self.smoking_model.rng.uniform(0, 1, n)
+        relapses = probs >= thresholds
+        #relapse and not relapse behaviours are not quit attempts: shift out the oldest behaviours of the behaviour buffers of all the agents at once
+        store.add_behaviours(slots, np.zeros(n, dtype=bool))
+        for agent, relapse in zip(agents, relapses.tolist()):
+            if relapse:
+                self.relapse(agent, update_behaviour_buffer=False)
+            else:
+                self.not_relapse(agent, update_behaviour_buffer=False)
+
+    def relapse(self, agent: MicroAgent, update_behaviour_buffer=True):
+        if update_behaviour_buffer:#False: the behaviour buffers are updated by do_action_of_agents
             # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
             agent.delete_oldest_behaviour()
             # append the agent's new behaviour to its behaviour buffer
             agent.add_behaviour(AgentBehaviour.RELAPSE)
-            agent.set_state_of_next_time_step(AgentState.SMOKER)
-            agent.b_years_since_quit = 0
-            if agent.smoking_model.quitting_behaviour=='COMB':
-                agent.mediator.theory_map[Theories.QUITATTEMPT].level2_attributes['cCigAddictStrength'].set_value(agent.prequit_addiction_strength)
-                agent.mediator.theory_map[Theories.QUITMAINTENANCE].level2_attributes['cCigAddictStrength'].set_value(agent.prequit_addiction_strength)
-                agent.mediator.theory_map[Theories.QUITATTEMPT].level2_attributes['mNonSmokerSelfIdentity'].set_value(0)
-                agent.mediator.theory_map[Theories.QUITMAINTENANCE].level2_attributes['mNonSmokerSelfIdentity'].set_value(0)
-        else:
+        agent.set_state_of_next_time_step(AgentState.SMOKER)
+        agent.b_years_since_quit = 0
+        if agent.smoking_model.quitting_behaviour=='COMB':
+            agent.mediator.theory_map[Theories.QUITATTEMPT].level2_attributes['cCigAddictStrength'].set_value(agent.prequit_addiction_strength)
+            agent.mediator.theory_map[Theories.QUITMAINTENANCE].level2_attributes['cCigAddictStrength'].set_value(agent.prequit_addiction_strength)
+            agent.mediator.theory_map[Theories.QUITATTEMPT].level2_attributes['mNonSmokerSelfIdentity'].set_value(0)
+            agent.mediator.theory_map[Theories.QUITMAINTENANCE].level2_attributes['mNonSmokerSelfIdentity'].set_value(0)
+
+    def not_relapse(self, agent: MicroAgent, update_behaviour_buffer=True):
+        if update_behaviour_buffer:
             # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
             agent.delete_oldest_behaviour()
             # append the agent's new behaviour to its behaviour buffer
             agent.add_behaviour(AgentBehaviour.NORELAPSE)
-            agent.set_state_of_next_time_step(AgentState.EXSMOKER)           
+        agent.set_state_of_next_time_step(AgentState.EXSMOKER)           
             
 class InitiationSTPMTheory(STPMTheory):
     def __init__(self, name, smoking_model: SmokingModel):
@@ -198,23 +224,11 @@ class InitiationSTPMTheory(STPMTheory):
         self.smoking_model.allocateDiffusionToAgent(agent)
 
     def do_action(self, agent: MicroAgent):
-        if self.smoking_model.year_of_current_time_step < 2011: #STPM initiation probabilites start from 2011, so match the agent with STPM 2011 data
-            matched = self.smoking_model.initiation_prob[
-                (self.smoking_model.initiation_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.initiation_prob['year'] == 2011) &
-                (self.smoking_model.initiation_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.initiation_prob['imd_quintile'] == agent.p_imd_quintile.get_value())]
-        else:    
-            matched = self.smoking_model.initiation_prob[
-                (self.smoking_model.initiation_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.initiation_prob['year'] == self.smoking_model.year_of_current_time_step) &
-                (self.smoking_model.initiation_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.initiation_prob['imd_quintile'] == agent.p_imd_quintile.get_value())]
-        matched = pd.DataFrame(matched)        
-        if len(matched) > 0:
-            self.prob_behaviour = float(matched.iat[0,-1])
-        else:
-            self.prob_behaviour = 0
+        #STPM initiation probabilites start from 2011, so match the agent with STPM 2011 data before 2011 (probability is 0 if no matching row)
+        self.prob_behaviour = self.smoking_model.initiation_prob_table.get(max(self.smoking_model.year_of_current_time_step, 2011),
+                                                                           agent.p_age.get_value(),
+                                                                           agent.p_gender.get_value(),
+                                                                           agent.p_imd_quintile.get_value())
         self.threshold = random.uniform(0, 1)
         if self.prob_behaviour >= self.threshold:
             # delete the agent's oldest behaviour (at 0th index) from the behaviour buffer
@@ -236,22 +250,15 @@ class QuitSTPMTheory(STPMTheory):
         
     def do_action(self, agent: MicroAgent):
         if self.smoking_model.year_of_current_time_step < 2011: #STPM initiation probabilites start from 2011, so match this agent with STPM 2011 data
-            matched = self.smoking_model.initiation_prob[
-                (self.smoking_model.initiation_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.initiation_prob['year'] == 2011) &
-                (self.smoking_model.initiation_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.initiation_prob['imd_quintile'] == agent.p_imd_quintile.get_value())]
-        else:            
-            matched = self.smoking_model.quit_prob[
-                (self.smoking_model.quit_prob['age'] == agent.p_age.get_value()) &
-                (self.smoking_model.quit_prob['year'] == self.smoking_model.year_of_current_time_step) &
-                (self.smoking_model.quit_prob['sex'] == agent.p_gender.get_value()) &
-                (self.smoking_model.quit_prob['imd_quintile'] == agent.p_imd_quintile.get_value())]
-        matched = pd.DataFrame(matched)
-        if len(matched) > 0:
-            self.prob_behaviour = float(matched.iat[0,-1])
+            self.prob_behaviour = self.smoking_model.initiation_prob_table.get(2011,
+                                                                               agent.p_age.get_value(),
+                                                                               agent.p_gender.get_value(),
+                                                                               agent.p_imd_quintile.get_value())
         else:
-            self.prob_behaviour = 0
+            self.prob_behaviour = self.smoking_model.quit_prob_table.get(self.smoking_model.year_of_current_time_step,
+                                                                         agent.p_age.get_value(),
+                                                                         agent.p_gender.get_value(),
+                                                                         agent.p_imd_quintile.get_value())
         self.threshold = random.uniform(0, 1)
         if agent.get_current_state() == AgentState.SMOKER:            
             if self.prob_behaviour >= self.threshold:
@@ -51,7 +51,17 @@ calculate_monthly_relapse_probability()
 #replace_values_of_exogenous_dynamics_file(maintenance_exogenous_dynamics_file,maintenance_exogenous_dynamics_file2)
 
 running command: python process_input_data_files.py
+
+Compile mode: compile the input data files of model.yaml (synthetic population, regional smoking prevalence, STPM probabilities, death probabilities,
+exogenous dynamics and cigarette consumption percentiles) into a compiled input bundle (a directory of NumPy .npy files and index.json)
+which SmokingModel loads without parsing the CSV files when compiled_input_bundle is set to the directory of the bundle in model.yaml.
+Recompile the bundle after changing any of the input data files.
+The replicates of the ABM running on a node can share the lookup tables of the bundle by memory-mapping them (mmap_input_bundle: True in model.yaml).
+
+running command: python process_input_data_files.py compile ../props/model.yaml ../data/input_bundle
 '''
+import os
+import sys
 import pandas as pd
 
 startyear=2011 #start year of simulation
@@ -133,9 +143,32 @@ def replace_values_of_exogenous_dynamics_file(exogenous_dynamics_file,outfile):
     df.to_csv(outdir+outfile,index=False)
     print('output file: '+outfile)
 
-calculate_monthly_initiation_probability()
-calculate_monthly_relapse_probability()
-#calculate_monthly_quit_probability()
-#replace_values_of_death_prob_file()
-#replace_values_of_exogenous_dynamics_file(attempt_exogenous_dynamics_file,attempt_exogenous_dynamics_file2)
-#replace_values_of_exogenous_dynamics_file(maintenance_exogenous_dynamics_file,maintenance_exogenous_dynamics_file2)
+def compile_input_bundle(model_yaml,bundle_dir):
+    print("Running compile_input_bundle(model_yaml,bundle_dir)")
+    import yaml
+    sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))#root directory of the ABM
+    from smokingcessation.input_bundle import read_input_data_files, compile_lookup_tables, compile_regional_prevalence, write_input_bundle
+    from smokingcessation.lookup_tables import compile_cig_consumption_table
+    with open(model_yaml) as f:
+        props=yaml.safe_load(f)
+    #compile the STPM initiation and quit probabilities so that the bundle can be used with both the STPM and COMB behaviours
+    data=read_input_data_files(props,initiation='initiation_prob_file' in props,quit='quit_prob_file' in props)
+    months,matrix=compile_regional_prevalence(data['regional_prevalence'])
+    tables=compile_lookup_tables(data)
+    #compile bCigConsumption up to the year of the final tick of model.yaml into the bundle so that the replicates memory-mapping the bundle share it
+    final_year=int(props['year_of_baseline'])+(int(props['stop.at'])-1)//12
+    tables['cig_consumption']=compile_cig_consumption_table(tables['cig_consumption'],tables.get('cig_consumption_trend'),final_year)
+    write_input_bundle(bundle_dir,data['population'],months,matrix,tables)
+    print('output directory: '+bundle_dir)
+
+if len(sys.argv) > 1 and sys.argv[1]=='compile':
+    if len(sys.argv) != 4:
+        sys.exit('usage: python process_input_data_files.py compile <model.yaml> <directory of the compiled input bundle>')
+    compile_input_bundle(sys.argv[2],sys.argv[3])
+else:
+    calculate_monthly_initiation_probability()
+    calculate_monthly_relapse_probability()
+    #calculate_monthly_quit_probability()
+    #replace_values_of_death_prob_file()
+    #replace_values_of_exogenous_dynamics_file(attempt_exogenous_dynamics_file,attempt_exogenous_dynamics_file2)
+    #replace_values_of_exogenous_dynamics_file(maintenance_exogenous_dynamics_file,maintenance_exogenous_dynamics_file2)